@@ -58,9 +58,9 @@ def digit_to_int(digit):
 
 
 def segment_video(video_file, label_file):
-    _, video_frames = utils.ffmpeg.ffprobe_video(video_file)
+    _, video_times = utils.ffmpeg.ffprobe_video(video_file)
     htk_labels = parse_htk_labels(label_file)
-    print('number of video frames: {}'.format(len(video_frames)))
+    print('number of video frames: {}'.format(len(video_times)))
     print('number of labels: {}'.format(len(htk_labels)))
     current_frame = 0
     idxes = []
@@ -73,8 +73,7 @@ def segment_video(video_file, label_file):
         # print(start, end, number)
         seq_len = 0
         while True:
-            f = video_frames[current_frame]
-            pts_time = to_100ns(f.pkt_pts_time)
+            pts_time = to_100ns(video_times[current_frame])
             # check if frame is withing utterance window
             if pts_time > start and pts_time <= end:
                 idxes.append(current_frame)
@@ -118,9 +117,12 @@ def parse_options():
     options['merge_samples'] = False
     options['output'] = None
     options['mergesize'] = 3
+    options['resize_interp'] = 'bilinear'
     parser = argparse.ArgumentParser()
-    parser.add_argument('--resize', action='store_true', help='resize image given the original and resized '
-                                                              'image dimensions eg: 60,80,30,40')
+    parser.add_argument('--resize', help='resize image given the original and resized '
+                                         'image dimensions eg: 60,80,30,40')
+    parser.add_argument('--resize_interp', help='interpolation used to resize, nearest, bilinear, bicubic. '
+                                                'default: bilinear')
     parser.add_argument('--remove_mean', action='store_true', help='remove mean image')
     parser.add_argument('--diff_image', action='store_true', help='compute difference of image')
     parser.add_argument('--samplewise_norm', action='store_true', help='samplewise normalize')
@@ -132,6 +134,8 @@ def parse_options():
     args = parser.parse_args()
     if args.resize:
         options['resize'] = args.resize
+    if args.resize_interp:
+        options['resize_interp'] = args.resize_interp
     if args.remove_mean:
         options['remove_mean'] = args.remove_mean
     if args.diff_image:
@@ -163,7 +167,8 @@ def main():
         data_matrix = reorder_data(data_matrix, imagesize)
     if 'resize' in options:
         imagesize = tuple([int(d) for d in options['resize'].split(',')])
-        data_matrix = resize_images(data_matrix, (imagesize[0], imagesize[1]), (imagesize[2], imagesize[3]))
+        data_matrix = resize_image_stack(data_matrix, (imagesize[0], imagesize[1]), (imagesize[2], imagesize[3]),
+                                         interp=options['resize_interp'])
     if options['samplewise_norm']:
         data_matrix = normalize_input(data_matrix)
     if options['remove_mean']:
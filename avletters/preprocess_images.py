@@ -4,9 +4,9 @@ realign images to c format from f format
 import sys
 sys.path.append('../')
 import argparse
-from utils.io import load_mat_file, save_mat
-from utils.preprocessing import resize_images, normalize_input, sequencewise_mean_image_subtraction, reorder_data
-from utils.preprocessing import compute_dct_features, concat_first_second_deltas
+from utils.io import load_dataset, save_mat
+from utils.preprocessing import resize_image_stack, normalize_input, sequencewise_mean_image_subtraction, reorder_data
+from utils.preprocessing import compute_dct_features, compute_dct2_features, concat_first_second_deltas
 from utils.preprocessing import compute_diff_images, apply_zca_whitening
 from utils.plotting_utils import visualize_images
 
@@ -14,7 +14,7 @@ from utils.plotting_utils import visualize_images
 def resize(data):
     X = data['dataMatrix']
     vidlens = data['videoLengthVec'].reshape((-1,))
-    X = resize_images(X)
+    X = resize_image_stack(X)
     # X = apply_zca_whitening(X)
     visualize_images(X[800:864])
     dct_feats = compute_dct_features(X, (30, 40), 30, method='zigzag')
@@ -30,7 +30,7 @@ def resize(data):
 def remove_mean(data):
     X = data['dataMatrix'].astype('float32')
     vidlens = data['videoLengthVec'].reshape((-1,))
-    X = resize_images(X)
+    X = resize_image_stack(X)
     X = sequencewise_mean_image_subtraction(X, vidlens)
     # X = apply_zca_whitening(X)
     X_fortran = reorder_data(X, (30, 40), 'c', 'f')
@@ -50,7 +50,7 @@ def remove_mean(data):
 def diff_image(data):
     X = data['dataMatrix'].astype('float32')
     vidlens = data['videoLengthVec'].reshape((-1,))
-    X = resize_images(X)
+    X = resize_image_stack(X)
     X = apply_zca_whitening(X)
     # X = normalize_input(X)
     visualize_images(X[2000:2081])
@@ -62,20 +62,39 @@ def diff_image(data):
     save_mat(data, 'data/resized_diff_image_AVLetters.mat')
 
 
+def dct2_features(data):
+    # separable 2D-dct computed in chunks of frames, dataMatrix can be memory-mapped
+    vidlens = data['videoLengthVec'].reshape((-1,))
+    dct_feats = compute_dct2_features(data['dataMatrix'], (30, 40), 30, method='zigzag')
+    dct_feats = concat_first_second_deltas(dct_feats, vidlens)
+    d = dict()
+    d['dctFeatures'] = dct_feats
+    save_mat(d, 'data/dct2Feat_AVLetters.mat')
+
+
 def parse_options():
     options = dict()
     options['operation'] = None
+    options['input'] = None
     parser = argparse.ArgumentParser()
-    parser.add_argument('--operation', help='remove_mean, diff_image, resize')
+    parser.add_argument('--operation', help='remove_mean, diff_image, resize, dct2')
+    parser.add_argument('--input', help='dataset to use, .mat file or memmap directory, '
+                                        'default data/resized.mat for dct2 and data/allData_mouthROIs.mat otherwise')
     args = parser.parse_args()
     if args.operation:
         options['operation'] = args.operation
+    if args.input:
+        options['input'] = args.input
     return options
 
 
 def main():
     options = parse_options()
-    data = load_mat_file('data/allData_mouthROIs.mat')
+    if options['operation'] == 'dct2':
+        # resized images are already in 'c' format
+        dct2_features(load_dataset(options['input'] or 'data/resized.mat'))
+        return
+    data = load_dataset(options['input'] or 'data/allData_mouthROIs.mat')
     if options['operation'] == 'remove_mean':
         remove_mean(data)
     elif options['operation'] == 'diff_image':
@@ -15,6 +15,7 @@ from utils.data_structures import circular_list
 from utils.datagen import *
 from utils.io import *
 from utils.regularization import early_stop2
+from utils.evaluation import evaluate_model2
 from custom.objectives import temporal_softmax_loss
 
 import theano.tensor as T
@@ -74,72 +75,13 @@ def split_data(X, y, dct, X_diff, subjects, video_lens, train_ids, val_ids, test
     :param test_ids: list of subject ids used for testing
     :return: split data
     """
-    # construct a subjects data matrix offset
-    X_feature_dim = X.shape[1]
-    X_diff_feature_dim = X_diff.shape[1]
-    dct_dim = dct.shape[1]
-    train_X = np.empty((0, X_feature_dim), dtype='float32')
-    val_X = np.empty((0, X_feature_dim), dtype='float32')
-    test_X = np.empty((0, X_feature_dim), dtype='float32')
-    train_y = np.empty((0,), dtype='int')
-    val_y = np.empty((0,), dtype='int')
-    test_y = np.empty((0,), dtype='int')
-    train_dct = np.empty((0, dct_dim), dtype='float32')
-    val_dct = np.empty((0, dct_dim), dtype='float32')
-    test_dct = np.empty((0, dct_dim), dtype='float32')
-    train_X_diff = np.empty((0, X_diff_feature_dim), dtype='float32')
-    val_X_diff = np.empty((0, X_diff_feature_dim), dtype='float32')
-    test_X_diff = np.empty((0, X_diff_feature_dim), dtype='float32')
-    train_vidlens = np.empty((0,), dtype='int')
-    val_vidlens = np.empty((0,), dtype='int')
-    test_vidlens = np.empty((0,), dtype='int')
-    train_subjects = np.empty((0,), dtype='int')
-    val_subjects = np.empty((0,), dtype='int')
-    test_subjects = np.empty((0,), dtype='int')
-    previous_subject = 1
-    subject_video_count = 0
-    current_video_idx = 0
-    current_data_idx = 0
-    populate = False
-    for idx, subject in enumerate(subjects):
-        if previous_subject == subject:  # accumulate
-            subject_video_count += 1
-        else:  # populate the previous subject
-            populate = True
-        if idx == len(subjects) - 1:  # check if it is the last entry, if so populate
-            populate = True
-            previous_subject = subject
-        if populate:
-            # slice the data into the respective splits
-            end_video_idx = current_video_idx + subject_video_count
-            subject_data_len = int(np.sum(video_lens[current_video_idx:end_video_idx]))
-            end_data_idx = current_data_idx + subject_data_len
-            if previous_subject in train_ids:
-                train_X = np.concatenate((train_X, X[current_data_idx:end_data_idx]))
-                train_y = np.concatenate((train_y, y[current_data_idx:end_data_idx]))
-                train_X_diff = np.concatenate((train_X_diff, X_diff[current_data_idx:end_data_idx]))
-                train_dct = np.concatenate((train_dct, dct[current_data_idx:end_data_idx]))
-                train_vidlens = np.concatenate((train_vidlens, video_lens[current_video_idx:end_video_idx]))
-                train_subjects = np.concatenate((train_subjects, subjects[current_video_idx:end_video_idx]))
-            elif previous_subject in val_ids:
-                val_X = np.concatenate((val_X, X[current_data_idx:end_data_idx]))
-                val_y = np.concatenate((val_y, y[current_data_idx:end_data_idx]))
-                val_X_diff = np.concatenate((val_X_diff, X_diff[current_data_idx:end_data_idx]))
-                val_dct = np.concatenate((val_dct, dct[current_data_idx:end_data_idx]))
-                val_vidlens = np.concatenate((val_vidlens, video_lens[current_video_idx:end_video_idx]))
-                val_subjects = np.concatenate((val_subjects, subjects[current_video_idx:end_video_idx]))
-            else:
-                test_X = np.concatenate((test_X, X[current_data_idx:end_data_idx]))
-                test_y = np.concatenate((test_y, y[current_data_idx:end_data_idx]))
-                test_dct = np.concatenate((test_dct, dct[current_data_idx:end_data_idx]))
-                test_X_diff = np.concatenate((test_X_diff, X_diff[current_data_idx:end_data_idx]))
-                test_vidlens = np.concatenate((test_vidlens, video_lens[current_video_idx:end_video_idx]))
-                test_subjects = np.concatenate((test_subjects, subjects[current_video_idx:end_video_idx]))
-            previous_subject = subject
-            current_video_idx = end_video_idx
-            current_data_idx = end_data_idx
-            subject_video_count = 1
-            populate = False
+    train_streams, train_y, train_vidlens, train_subjects, \
+    val_streams, val_y, val_vidlens, val_subjects, \
+    test_streams, test_y, test_vidlens, test_subjects = split_seq_data([X, dct, X_diff], y, subjects, video_lens,
+                                                                       train_ids, val_ids, test_ids)
+    train_X, train_dct, train_X_diff = train_streams
+    val_X, val_dct, val_X_diff = val_streams
+    test_X, test_dct, test_X_diff = test_streams
     return train_X, train_y, train_dct, train_X_diff, train_vidlens, train_subjects,\
            val_X, val_y, val_dct, val_X_diff, val_vidlens, val_subjects,\
            test_X, test_y, test_dct, test_X_diff, test_vidlens, test_subjects
@@ -186,42 +128,6 @@ def evaluate_model(X_val, y_val, mask_val, X_diff_val, window_size, eval_fn):
     return classification_rate, confusion_matrix
 
 
-def evaluate_model2(X_val, y_val, mask_val, X_diff_val, window_size, eval_fn):
-    """
-    Evaluate a lstm model
-    :param X_val: validation inputs
-    :param y_val: validation targets
-    :param mask_val: input masks for variable sequences
-    :param X_diff_val: validation inputs diff image
-    :param window_size: size of window for computing delta coefficients
-    :param eval_fn: evaluation function
-    :return: classification rate, confusion matrix
-    """
-    output = eval_fn(X_val, mask_val, X_diff_val, window_size)
-    num_classes = output.shape[-1]
-    confusion_matrix = np.zeros((num_classes, num_classes), dtype='int')
-    ix = np.zeros((X_val.shape[0],), dtype='int')
-    seq_lens = np.sum(mask_val, axis=-1)
-
-    # for each example, we only consider argmax of the seq len
-    votes = np.zeros((num_classes,), dtype='int')
-    for i, eg in enumerate(output):
-        predictions = np.argmax(eg[:seq_lens[i]], axis=-1)
-        for cls in range(num_classes):
-            count = (predictions == cls).sum(axis=-1)
-            votes[cls] = count
-        ix[i] = np.argmax(votes)
-
-    c = ix == y_val
-    classification_rate = np.sum(c == True) / float(len(c))
-
-    # construct the confusion matrix
-    for i, target in enumerate(y_val):
-        confusion_matrix[target, ix[i]] += 1
-
-    return classification_rate, confusion_matrix
-
-
 def parse_options():
     options = dict()
     options['config'] = 'config/avnet.ini'
@@ -422,7 +328,7 @@ def main():
         pk = 1000 * (np.sum(train_strip) / (STRIP_SIZE * np.min(train_strip)) - 1)
         pq = gl / pk
 
-        cr, val_conf = evaluate_model2(X_val, y_val_evaluate, mask_val, X_diff_val, WINDOW_SIZE, val_fn)
+        cr, val_conf = evaluate_model2([X_val, mask_val, X_diff_val, WINDOW_SIZE], y_val_evaluate, mask_val, val_fn)
         class_rate.append(cr)
 
         if val_cost < best_val:
@@ -431,8 +337,8 @@ def main():
             best_cr = cr
             if fusiontype == 'adasum':
                 adascale_param = las.layers.get_all_param_values(l_fuse, scaling_param=True)
-            test_cr, test_conf = evaluate_model2(X_test, y_test, mask_test,
-                                                 X_diff_test, WINDOW_SIZE, val_fn)
+            test_cr, test_conf = evaluate_model2([X_test, mask_test, X_diff_test, WINDOW_SIZE],
+                                                 y_test, mask_test, val_fn)
             print("Epoch {} train cost = {}, val cost = {}, "
                   "GL loss = {:.3f}, GQ = {:.3f}, CR = {:.3f}, Test CR= {:.3f} ({:.1f}sec)"
                   .format(epoch + 1, cost_train[-1], cost_val[-1], gl, pq, cr, test_cr, time.time() - time_start))
@@ -58,9 +58,9 @@ def digit_to_int(digit):
 
 
 def segment_video(video_file, label_file):
-    _, video_frames = utils.ffmpeg.ffprobe_video(video_file)
+    _, video_times = utils.ffmpeg.ffprobe_video(video_file)
     htk_labels = parse_htk_labels(label_file)
-    print('number of video frames: {}'.format(len(video_frames)))
+    print('number of video frames: {}'.format(len(video_times)))
     print('number of labels: {}'.format(len(htk_labels)))
     current_frame = 0
     idxes = []
@@ -73,8 +73,7 @@ def segment_video(video_file, label_file):
         # print(start, end, number)
         seq_len = 0
         while True:
-            f = video_frames[current_frame]
-            pts_time = to_100ns(f.pkt_pts_time)
+            pts_time = to_100ns(video_times[current_frame])
             # check if frame is withing utterance window
             if pts_time > start and pts_time <= end:
                 idxes.append(current_frame)
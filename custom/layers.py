@@ -102,16 +102,35 @@ class ZNormalizeLayer(Layer):
         return input_shape
 
 
+# default DeltaLayer implementation, 'scan' or 'conv'
+DELTA_MODE = 'scan'
+
+
+def set_delta_mode(mode):
+    """
+    set the implementation used by DeltaLayers created without an explicit mode
+    :param mode: 'scan' computes deltas with nested theano.scan loops per sequence,
+        'conv' computes them as a temporal convolution over the whole batch
+    """
+    global DELTA_MODE
+    if mode not in ('scan', 'conv'):
+        raise ValueError("delta mode not supported, use only 'scan' or 'conv'")
+    DELTA_MODE = mode
+
+
 class DeltaLayer(Layer):
     """
     Layer to add delta coefficients to input sequence,
     Appends 1st and 2nd order delta and acceleration coefficients to input sequence
     """
-    def __init__(self, incoming, window, **kwargs):
+    def __init__(self, incoming, window, mode=None, **kwargs):
         super(DeltaLayer, self).__init__(incoming, **kwargs)
         self.window = window
+        self.mode = DELTA_MODE if mode is None else mode
 
     def get_output_for(self, input, **kwargs):
+        if self.mode == 'conv':
+            return utils.signal.append_delta_coeff_conv(input, self.window)
 
         # compute delta coefficients for multiple sequences
         res, _ = theano.scan(utils.signal.append_delta_coeff, sequences=input, non_sequences=self.window)
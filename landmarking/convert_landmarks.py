@@ -0,0 +1,32 @@
+import os
+import sys
+import argparse
+sys.path.insert(0, '../')
+from utils.landmarks import convert_csv_to_store
+
+
+def find_landmark_files(dir):
+    csv_files = []
+    for root, _, files in os.walk(os.path.abspath(dir)):
+        csv_files += [os.path.join(root, f) for f in files if os.path.splitext(f)[1] == '.csv']
+    csv_files.sort()
+    return csv_files
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description='convert landmark csv files to a binary landmark store')
+    parser.add_argument('--input_dir', required=True, help='directory to search for landmark csv files')
+    parser.add_argument('--output', required=True, help='output landmark store directory')
+    args = parser.parse_args()
+    return {'input_dir': args.input_dir, 'output': args.output}
+
+
+if __name__ == '__main__':
+    options = parse_options()
+    input_dir = os.path.abspath(options['input_dir'])
+    csv_files = find_landmark_files(input_dir)
+    # videos are named by their landmark file relative to the input directory, without extension
+    videos = [os.path.splitext(f[len(input_dir) + 1:])[0] for f in csv_files]
+    print('Converting {} landmark file(s) to {}...'.format(len(csv_files), options['output']))
+    convert_csv_to_store(csv_files, options['output'], videos)
+    print('All Done!')
@@ -1,20 +1,29 @@
 import warnings
 import os
+import sys
 import errno
 import csv
+import json
+import tempfile
 import argparse
 
+import numpy as np
 import menpo.io as mio
-from menpo.visualize import print_progress
 from menpodetect.dlib import load_dlib_frontal_face_detector
 from menpofit.dlib import DlibWrapper
+from menpo.transform import Translation
 
 import multiprocessing as mp
 
+sys.path.insert(0, '../')
+from utils.landmarks import convert_csv_to_store
+
 # constants, change according to system
 FACE_MODEL_PATH = '../config/shape_predictor_68_face_landmarks.dat'
 EXT = ['.mp4', '.mov', '.mpg']
 NO_LANDMARKS = 68
+# diagonal in pixels the frames are rescaled to for face detection
+DETECTION_DIAGONAL = 1000
 
 
 def find_all_videos(dir, ext=EXT, relpath=False):
@@ -42,25 +51,95 @@ def is_video(file, ext=EXT):
     return os.path.splitext(file)[1] in ext
 
 
+def bounds_overlap(shape_a, shape_b):
+    """
+    intersection over union of the bounding boxes of two shapes
+    :param shape_a: menpo PointCloud
+    :param shape_b: menpo PointCloud
+    :return: overlap between 0 and 1
+    """
+    min_a, max_a = shape_a.bounds()
+    min_b, max_b = shape_b.bounds()
+    intersection = np.prod(np.clip(np.minimum(max_a, max_b) - np.maximum(min_a, min_b), 0, None))
+    union = np.prod(max_a - min_a) + np.prod(max_b - min_b) - intersection
+    return intersection / union if union > 0 else 0.
+
+
 class ImageFitter(object):
-    def __init__(self, model):
+    def __init__(self, model, tracking=False, keyframe_interval=30, min_overlap=0.5, search_margin=0.5):
+        """
+        :param model: location of landmark model file
+        :param tracking: detect the face of each frame in a window around the face of the previous frame instead
+            of the whole frame, for consecutive frames of a video
+        :param keyframe_interval: maximum number of tracked frames between whole frame face detections
+        :param min_overlap: minimum overlap of the face detected in the window with the face of the previous frame,
+            below it the face is considered lost and detected in the whole frame
+        :param search_margin: margin of the window around the previous face, as a fraction of its size
+        """
         self.detector = load_dlib_frontal_face_detector()
         self.fitter = DlibWrapper(model)
+        self.tracking = tracking
+        self.keyframe_interval = keyframe_interval
+        self.min_overlap = min_overlap
+        self.search_margin = search_margin
+        self.reset()
+
+    def reset(self):
+        """
+        forget the tracked face, the next frame is detected in the whole frame
+        """
+        self.previous_bbox = None
+        self.tracked_frames = 0
+
+    def detect(self, image):
+        """
+        :return: bounding box of the most probable face in the whole frame, None if no face is detected
+        """
+        bboxes = self.detector(image, image_diagonal=DETECTION_DIAGONAL)
+        return bboxes[0] if len(bboxes) > 0 else None
+
+    def track(self, image):
+        """
+        detect the face again in a window around the face of the previous frame, at the scale of whole frame
+        detection. the shape predictor gives no score and always places a face shaped fit inside its initial
+        box, so a detection is what tells whether the face is still there
+        :return: bounding box of the face in image coordinates, None if not tracking or the face was lost
+        """
+        if not self.tracking or self.previous_bbox is None or self.tracked_frames >= self.keyframe_interval:
+            return None
+        min_b, max_b = self.previous_bbox.bounds()
+        margin = self.search_margin * (max_b - min_b)
+        window_min = np.maximum(np.floor(min_b - margin), 0)
+        window_max = np.minimum(np.ceil(max_b + margin), image.shape)
+        if np.any(window_max <= window_min):
+            return None
+        window = image.crop(window_min, window_max, constrain_to_boundary=True)
+        bboxes = self.detector(window, image_diagonal=window.diagonal() * DETECTION_DIAGONAL / image.diagonal())
+        if len(bboxes) == 0:
+            return None
+        bbox = Translation(window_min).apply(bboxes[0])
+        if bounds_overlap(self.previous_bbox, bbox) < self.min_overlap:
+            return None
+        self.tracked_frames += 1
+        return bbox
 
     def fit_image(self, image):
-        # Face detection
-        bboxes = self.detector(image, image_diagonal=1000)
+        bbox = self.track(image)
+        if bbox is None:
+            # Face detection
+            bbox = self.detect(image)
+            self.tracked_frames = 0
 
         # Check if at least one face was detected, otherwise throw a warning
-        if len(bboxes) > 0:
-            # Use the first bounding box (the most probable to represent a face) to initialise
-            fitting_result = self.fitter.fit_from_bb(image, bboxes[0])
-
+        if bbox is not None:
+            # Use the bounding box (the most probable to represent a face) to initialise
+            fitting_result = self.fitter.fit_from_bb(image, bbox)
             # Assign shape on the image
             image.landmarks['final_shape'] = fitting_result.final_shape
         else:
             # Throw warning if no face was detected
             warnings.warn('No face detected')
+        self.previous_bbox = bbox
 
         # Return the image
         return image
@@ -79,64 +158,220 @@ def fill_row(outwriter, frame_no, row):
     outwriter.writerow([frame_no] + row)
 
 
-def process_video_worker(video_queue, face_model, input_dir, output_dir):
-    image_fitter = ImageFitter(face_model)
-    while True:
-        video = video_queue.get()
-        if video is None:
-            print('[{}] Done...'.format(os.getpid()))
-            video_queue.task_done()
-            break
-        relative_path = video[len(input_dir) + 1:]
-        landmarkfile = os.path.join(output_dir, os.path.splitext(relative_path)[0] + '.csv')
-        process_video(video, landmarkfile, image_fitter)
-        video_queue.task_done()
-
-
-def process_video(file, dest, fitter):
-    if is_video(file):
+def video_landmark_file(video, input_dir, output_dir):
+    relative_path = video[len(input_dir) + 1:]
+    return os.path.join(output_dir, os.path.splitext(relative_path)[0] + '.csv')
+
+
+def import_frames(file):
+    """
+    lazily import the frames of a video
+    :param file: video file
+    :return: lazy list of frames or None if the video cannot be read
+    """
+    try:
+        return mio.import_video(file, normalise=False)
+    except IOError:
+        warnings.warn('IO error reading video file {}, '.format(file) +
+                      'the file may be corrupted or the video format is unsupported, skipping...')
+    except ValueError as e:
+        warnings.warn('Value Error reading video file {}, '.format(file) +
+                      e.message)
+    return None
+
+
+def count_frames(file):
+    """
+    :param file: video file
+    :return: file, number of frames, 0 if the video cannot be read
+    """
+    frames = import_frames(file) if is_video(file) else None
+    return file, len(frames) if frames is not None else 0
+
+
+def frame_ranges(no_frames, chunk_frames):
+    """
+    split the frames of a video into consecutive ranges
+    :param no_frames: number of frames
+    :param chunk_frames: maximum number of frames per range
+    :return: list of (start, end) frame ranges
+    """
+    return [(start, min(start + chunk_frames, no_frames)) for start in range(0, no_frames, chunk_frames)]
+
+
+# one fitter per worker process, created once by init_fitter_worker and reused by every frame range
+_image_fitter = None
+
+
+def init_fitter_worker(face_model, fitter_options):
+    global _image_fitter
+    _image_fitter = ImageFitter(face_model, **fitter_options)
+
+
+def frame_landmarks(frame):
+    if 'final_shape' not in frame.landmarks:
+        return None
+    lmg = frame.landmarks['final_shape']
+    return lmg['all'].points.reshape((NO_LANDMARKS*2,)).tolist()  # reshape to 136 points
+
+
+def fit_frame_range(task):
+    """
+    fit the landmarks of a range of frames of a video in a worker process
+    :param task: (video file, start frame, end frame)
+    :return: video file, start frame, list of (frame number, landmarks)
+    """
+    file, start, end = task
+    frames = import_frames(file)
+    # ranges are not consecutive, start each range from a face detection
+    _image_fitter.reset()
+    rows = []
+    for i in range(start, end):
         try:
-            frames = mio.import_video(file, normalise=False)
-        except IOError:
-            warnings.warn('IO error reading video file {}, '.format(file) +
-                          'the file may be corrupted or the video format is unsupported, skipping...')
-        except ValueError as e:
-            warnings.warn('Value Error reading video file {}, '.format(file) +
-                          e.message)
-            return
-        # check if directory is non empty
-        if os.path.dirname(dest):
-            create_dir(os.path.dirname(dest))
-        print('[{}] {} contains {} frames'.format(os.getpid(), file, len(frames)))
-        print('[{}] writing landmarks to {}...'.format(os.getpid(), dest))
-        frames = frames.map(fitter.fit_image)
-        with open(dest, 'w') as outputfile:
-            outwriter = csv.writer(outputfile)
-            try:
-                for i, frame in enumerate(print_progress(frames)):
-                    if 'final_shape' not in frame.landmarks:
-                        warnings.warn('no faces detected in the frame {}, '.format(i) +
-                                      'initializing landmarks to -1s...')
-                        # dlib does not fitting from previous initial shape so
-                        # leave entire row as -1s
-                        # initial_shape = frames[i - 1].landmarks['final_shape'].lms
-                        # fitting_result = fit_image.fitter.fit_from_shape(frame, initial_shape)
-                        # frame.landmarks['final_shape'] = fitting_result.final_shape
-                        landmarks = [-1] * NO_LANDMARKS*2
-                    else:
-                        lmg = frame.landmarks['final_shape']
-                        landmarks = lmg['all'].points.reshape((NO_LANDMARKS*2,)).tolist()  # reshape to 136 points
-                    fill_row(outwriter, i, landmarks)
-            except Exception as _:
-                warnings.warn('Runtime Error at frame {}'.format(i))
-                print('initializing landmarks to -1s...')
-                fill_row(outwriter, i, [-1] * NO_LANDMARKS*2)
+            landmarks = frame_landmarks(_image_fitter.fit_image(frames[i]))
+            if landmarks is None:
+                warnings.warn('no faces detected in the frame {} of {}, '.format(i, file) +
+                              'initializing landmarks to -1s...')
+        except Exception as _:
+            warnings.warn('Runtime Error at frame {} of {}, initializing landmarks to -1s...'.format(i, file))
+            landmarks = None
+        # dlib does not fitting from previous initial shape so leave entire row as -1s
+        rows.append((i, landmarks if landmarks is not None else [-1] * NO_LANDMARKS*2))
+    return file, start, rows
+
+
+def default_file_mode():
+    """
+    mkstemp creates files readable by the owner only, renamed files get the mode open() would give
+    :return: 0o666 without the bits of the process umask
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def write_landmarks(dest, rows):
+    # check if directory is non empty
+    if os.path.dirname(dest):
+        create_dir(os.path.dirname(dest))
+    # write to a temporary file renamed over dest, so a crash never leaves a partial landmark file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as outputfile:
+        outwriter = csv.writer(outputfile)
+        for frame_no, landmarks in rows:
+            fill_row(outwriter, frame_no, landmarks)
+    os.chmod(tmp_path, default_file_mode())
+    os.rename(tmp_path, dest)
+
+
+def video_signature(video):
+    stat = os.stat(video)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def load_manifest(path):
+    """
+    load the manifest of landmarked videos
+    :param path: manifest json file
+    :return: dict of video file -> size, mtime and landmark file, empty if there is no manifest
+    """
+    if path is None or not os.path.isfile(path):
+        return dict()
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    """
+    atomically write the manifest of landmarked videos
+    :param manifest: dict of video file -> size, mtime and landmark file
+    :param path: manifest json file
+    """
+    if os.path.dirname(path):
+        create_dir(os.path.dirname(path))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.chmod(tmp_path, default_file_mode())
+    os.rename(tmp_path, path)
+
+
+def is_up_to_date(manifest, video, dest):
+    """
+    :return: True if the video was landmarked to dest and has not changed since
+    """
+    entry = manifest.get(video)
+    if entry is None or entry.get('landmarks') != dest or not os.path.isfile(dest):
+        return False
+    signature = video_signature(video)
+    return entry['size'] == signature['size'] and entry['mtime'] == signature['mtime']
+
+
+def process_videos(videos, dests, face_model, no_workers, chunk_frames=250, fitter_options=None,
+                   manifest_path=None, force=False):
+    """
+    landmark videos with a pool of workers, long videos are split into frame ranges so all workers
+    stay busy until the last video is done. the rows of each video are merged back in frame order
+    and written once all of its ranges are fitted
+    :param videos: list of video files
+    :param dests: landmark csv file of each video
+    :param face_model: location of landmark model file
+    :param no_workers: number of worker processes
+    :param chunk_frames: maximum number of frames fitted per task
+    :param fitter_options: keyword arguments of ImageFitter, such as the tracking options
+    :param manifest_path: json manifest of landmarked videos, videos landmarked since they last changed are
+        skipped and each finished video is recorded. None disables the manifest
+    :param force: landmark all videos even if up to date
+    """
+    manifest = load_manifest(manifest_path)
+    if not force:
+        todo = [(video, dest) for video, dest in zip(videos, dests) if not is_up_to_date(manifest, video, dest)]
+        print('Skipping {} up to date video(s)...'.format(len(videos) - len(todo)))
+        videos = [video for video, _ in todo]
+        dests = [dest for _, dest in todo]
+    dests = dict(zip(videos, dests))
+    if not videos:
+        return
+    # signatures are taken before fitting, a video changed meanwhile is landmarked again on the next run
+    signatures = dict((video, video_signature(video)) for video in videos)
+    pool = mp.Pool(no_workers, initializer=init_fitter_worker, initargs=(face_model, fitter_options or dict()))
+    try:
+        video_frames = [vf for vf in pool.map(count_frames, videos) if vf[1] > 0]
+        # longest videos first, their ranges are spread over all workers while short videos fill the gaps
+        video_frames.sort(key=lambda vf: vf[1], reverse=True)
+        tasks = []
+        no_ranges = dict()
+        for video, no_frames in video_frames:
+            ranges = frame_ranges(no_frames, chunk_frames)
+            no_ranges[video] = len(ranges)
+            tasks += [(video, start, end) for start, end in ranges]
+            print('{} contains {} frames, {} task(s)'.format(video, no_frames, len(ranges)))
+        print('Scheduling {} frame range(s) of {} video(s)...'.format(len(tasks), len(video_frames)))
+
+        fitted = dict()
+        for video, start, rows in pool.imap_unordered(fit_frame_range, tasks):
+            ranges = fitted.setdefault(video, dict())
+            ranges[start] = rows
+            if len(ranges) == no_ranges[video]:
+                print('writing landmarks to {}...'.format(dests[video]))
+                write_landmarks(dests[video], [row for s in sorted(ranges) for row in ranges[s]])
+                del fitted[video]
+                if manifest_path is not None:
+                    manifest[video] = dict(signatures[video], landmarks=dests[video])
+                    save_manifest(manifest, manifest_path)
+    finally:
+        pool.close()
+        pool.join()
 
 
 def parse_options():
     options = dict()
     parser = argparse.ArgumentParser()
     options['model'] = '../config/shape_predictor_68_face_landmarks.dat'
+    options['chunk_frames'] = 250
+    options['keyframe_interval'] = 30
+    options['min_overlap'] = 0.5
+    options['search_margin'] = 0.5
     parser.add_argument('--input_dir', help='directory to search for videos, supported formats [.mov, .mpg, .mp4]')
     parser.add_argument('--output_dir', help='output directory to store the landmarks')
     parser.add_argument('--model', help='location of landmark model file. '
@@ -145,6 +380,21 @@ def parse_options():
     parser.add_argument('--output', help='output landmark file name, if not specified '
                                          'creates landmark file in current directory')
     parser.add_argument('--workers', help='number of workers to spawn. Default: number of CPUs available')
+    parser.add_argument('--chunk_frames', help='maximum number of frames of a video landmarked per task, '
+                                               'long videos are split over several workers. Default: 250')
+    parser.add_argument('--manifest', help='json manifest of landmarked videos, unchanged videos are skipped. '
+                                           'Default: landmarks_manifest.json in the output directory')
+    parser.add_argument('--store', help='also pack the landmarks of all videos into a binary landmark store '
+                                        'directory, see utils/landmarks.py')
+    parser.add_argument('--force', action='store_true', help='landmark all videos, even if up to date')
+    parser.add_argument('--tracking', action='store_true', help='detect the face in a window around the face of '
+                                                                'the previous frame instead of the whole frame')
+    parser.add_argument('--keyframe_interval', help='maximum number of tracked frames between whole frame face '
+                                                    'detections. Default: 30')
+    parser.add_argument('--min_overlap', help='minimum bounding box overlap of a tracked face with the previous '
+                                              'frame, below it the face is detected in the whole frame. Default: 0.5')
+    parser.add_argument('--search_margin', help='margin of the tracking window around the previous face, as a '
+                                                'fraction of its size. Default: 0.5')
     args = parser.parse_args()
     if args.input_dir:
         options['input_dir'] = args.input_dir
@@ -158,50 +408,52 @@ def parse_options():
         options['output'] = args.output
     if args.workers:
         options['workers'] = int(args.workers)
+    if args.chunk_frames:
+        options['chunk_frames'] = int(args.chunk_frames)
+    if args.manifest:
+        options['manifest'] = args.manifest
+    if args.store:
+        options['store'] = args.store
+    options['force'] = args.force
+    options['tracking'] = args.tracking
+    if args.keyframe_interval:
+        options['keyframe_interval'] = int(args.keyframe_interval)
+    if args.min_overlap:
+        options['min_overlap'] = float(args.min_overlap)
+    if args.search_margin:
+        options['search_margin'] = float(args.search_margin)
     return options
 
 
-def add_tasks(queue, task_list):
-    for t in task_list:
-        queue.put(t)
-    return queue
-
-
-def add_poison_pills(queue, no_pills):
-    for _ in range(no_pills):
-        queue.put(None)
-    return queue
-
-
 if __name__ == '__main__':
     options = parse_options()
+    no_workers = options['workers'] if 'workers' in options else mp.cpu_count()
+    fitter_options = {'tracking': options['tracking'], 'keyframe_interval': options['keyframe_interval'],
+                      'min_overlap': options['min_overlap'], 'search_margin': options['search_margin']}
 
     if 'file' in options:
         video_file = options['file']
         video_file_basename = os.path.basename(video_file)
         print('Generating Landmarks from {}'.format(video_file))
         output = options['output'] if 'output' in options else os.path.splitext(video_file_basename)[0] + '.csv'
-        process_video(video_file, output)
+        process_videos([video_file], [output], options['model'], no_workers, options['chunk_frames'],
+                       fitter_options, options['manifest'] if 'manifest' in options else None, options['force'])
         exit()
 
     print('Generating Landmarks from {}'.format(options['input_dir']))
     videofiles = find_all_videos(options['input_dir'], relpath=False)
     videofiles.sort()
     print('Found {} video(s)...'.format(len(videofiles)))
-    if 'workers' in options:
-        no_workers = options['workers']
-    else:
-        no_workers = mp.cpu_count()
-    queue = mp.JoinableQueue()
-    queue = add_tasks(queue, videofiles)
-    queue = add_poison_pills(queue, no_workers)
     input_dir = os.path.abspath(options['input_dir'])
     output_dir = os.path.abspath(options['output_dir'])
-    workers = []
     print('Using {} workers...'.format(no_workers))
-    for i in range(no_workers):
-        workers.append(mp.Process(target=process_video_worker, args=(queue, options['model'], input_dir, output_dir)))
-    for p in workers:
-        p.start()
-    queue.join()
+    landmarkfiles = [video_landmark_file(video, input_dir, output_dir) for video in videofiles]
+    manifest = options['manifest'] if 'manifest' in options else os.path.join(output_dir, 'landmarks_manifest.json')
+    process_videos(videofiles, landmarkfiles, options['model'], no_workers, options['chunk_frames'],
+                   fitter_options, manifest, options['force'])
+    if 'store' in options:
+        landmarked = [(video[len(input_dir) + 1:], f) for video, f in zip(videofiles, landmarkfiles)
+                      if os.path.isfile(f)]
+        print('Packing landmarks of {} video(s) to {}...'.format(len(landmarked), options['store']))
+        convert_csv_to_store([f for _, f in landmarked], options['store'], [video for video, _ in landmarked])
     print('All Done!')
@@ -131,81 +131,15 @@ def split_data(X, y, dct, X_diff, subjects, video_lens, train_ids, val_ids, test
     :param target_filenames: list of target video filenames
     :return: split data
     """
-    # construct a subjects data matrix offset
-    X_feature_dim = X.shape[1]
-    X_diff_feature_dim = X_diff.shape[1]
-    dct_dim = dct.shape[1]
-    train_X = np.empty((0, X_feature_dim), dtype='float32')
-    val_X = np.empty((0, X_feature_dim), dtype='float32')
-    test_X = np.empty((0, X_feature_dim), dtype='float32')
-    train_y = np.empty((0,), dtype='int')
-    val_y = np.empty((0,), dtype='int')
-    test_y = np.empty((0,), dtype='int')
-    train_dct = np.empty((0, dct_dim), dtype='float32')
-    val_dct = np.empty((0, dct_dim), dtype='float32')
-    test_dct = np.empty((0, dct_dim), dtype='float32')
-    train_X_diff = np.empty((0, X_diff_feature_dim), dtype='float32')
-    val_X_diff = np.empty((0, X_diff_feature_dim), dtype='float32')
-    test_X_diff = np.empty((0, X_diff_feature_dim), dtype='float32')
-    train_vidlens = np.empty((0,), dtype='int')
-    val_vidlens = np.empty((0,), dtype='int')
-    test_vidlens = np.empty((0,), dtype='int')
-    train_subjects = np.empty((0,), dtype='int')
-    val_subjects = np.empty((0,), dtype='int')
-    test_subjects = np.empty((0,), dtype='int')
-    train_filenames = list()
-    val_filenames = list()
-    test_filenames = list()
-    previous_subject = 1
-    subject_video_count = 0
-    current_video_idx = 0
-    current_data_idx = 0
-    populate = False
-    for idx, subject in enumerate(subjects):
-        if previous_subject == subject:  # accumulate
-            subject_video_count += 1
-        else:  # populate the previous subject
-            populate = True
-        if idx == len(subjects) - 1:  # check if it is the last entry, if so populate
-            populate = True
-            previous_subject = subject
-        if populate:
-            # slice the data into the respective splits
-            end_video_idx = current_video_idx + subject_video_count
-            subject_data_len = int(np.sum(video_lens[current_video_idx:end_video_idx]))
-            end_data_idx = current_data_idx + subject_data_len
-            if previous_subject in train_ids:
-                train_X = np.concatenate((train_X, X[current_data_idx:end_data_idx]))
-                train_y = np.concatenate((train_y, y[current_data_idx:end_data_idx]))
-                train_X_diff = np.concatenate((train_X_diff, X_diff[current_data_idx:end_data_idx]))
-                train_dct = np.concatenate((train_dct, dct[current_data_idx:end_data_idx]))
-                train_vidlens = np.concatenate((train_vidlens, video_lens[current_video_idx:end_video_idx]))
-                train_subjects = np.concatenate((train_subjects, subjects[current_video_idx:end_video_idx]))
-                train_filenames = train_filenames + target_filenames[current_video_idx:end_video_idx]
-            elif previous_subject in val_ids:
-                val_X = np.concatenate((val_X, X[current_data_idx:end_data_idx]))
-                val_y = np.concatenate((val_y, y[current_data_idx:end_data_idx]))
-                val_X_diff = np.concatenate((val_X_diff, X_diff[current_data_idx:end_data_idx]))
-                val_dct = np.concatenate((val_dct, dct[current_data_idx:end_data_idx]))
-                val_vidlens = np.concatenate((val_vidlens, video_lens[current_video_idx:end_video_idx]))
-                val_subjects = np.concatenate((val_subjects, subjects[current_video_idx:end_video_idx]))
-                val_filenames = val_filenames + target_filenames[current_video_idx:end_video_idx]
-            else:
-                test_X = np.concatenate((test_X, X[current_data_idx:end_data_idx]))
-                test_y = np.concatenate((test_y, y[current_data_idx:end_data_idx]))
-                test_dct = np.concatenate((test_dct, dct[current_data_idx:end_data_idx]))
-                test_X_diff = np.concatenate((test_X_diff, X_diff[current_data_idx:end_data_idx]))
-                test_vidlens = np.concatenate((test_vidlens, video_lens[current_video_idx:end_video_idx]))
-                test_subjects = np.concatenate((test_subjects, subjects[current_video_idx:end_video_idx]))
-                test_filenames = test_filenames + target_filenames[current_video_idx:end_video_idx]
-            previous_subject = subject
-            current_video_idx = end_video_idx
-            current_data_idx = end_data_idx
-            subject_video_count = 1
-            populate = False
-    return train_X, train_y, train_dct, train_X_diff, train_vidlens, train_subjects, train_filenames, \
-           val_X, val_y, val_dct, val_X_diff, val_vidlens, val_subjects, val_filenames, \
-           test_X, test_y, test_dct, test_X_diff, test_vidlens, test_subjects, test_filenames
+    video_lens = np.asarray(video_lens).reshape((-1,))
+    subjects = np.asarray(subjects).reshape((-1,))
+    splits = []
+    for video_idxs, frame_idxs in compute_split_idxs(subjects, video_lens, train_ids, val_ids, test_ids):
+        splits += [take_frames(X, frame_idxs), take_frames(y, frame_idxs).astype('int'),
+                   take_frames(dct, frame_idxs), take_frames(X_diff, frame_idxs),
+                   video_lens[video_idxs].astype('int'), subjects[video_idxs].astype('int'),
+                   [target_filenames[i] for i in video_idxs]]
+    return tuple(splits)
 
 
 def read_data_split_file(path, sep=','):
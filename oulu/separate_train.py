@@ -119,75 +119,6 @@ def print_network(network):
         print_layer_shape(layer)
 
 
-def split_data(X, y, subjects, video_lens, train_ids, val_ids, test_ids):
-    """
-    Splits the data into training and testing sets
-    :param X: input X
-    :param y: target y
-    :param subjects: array of video -> subject mapping
-    :param video_lens: array of video lengths for each video
-    :param train_ids: list of subject ids used for training
-    :param val_ids: list of subject ids used for validation
-    :param test_ids: list of subject ids used for testing
-    :return: split data
-    """
-    # construct a subjects data matrix offset
-    X_feature_dim = X.shape[1]
-    train_X = np.empty((0, X_feature_dim), dtype='float32')
-    val_X = np.empty((0, X_feature_dim), dtype='float32')
-    test_X = np.empty((0, X_feature_dim), dtype='float32')
-    train_y = np.empty((0,), dtype='int')
-    val_y = np.empty((0,), dtype='int')
-    test_y = np.empty((0,), dtype='int')
-    train_vidlens = np.empty((0,), dtype='int')
-    val_vidlens = np.empty((0,), dtype='int')
-    test_vidlens = np.empty((0,), dtype='int')
-    train_subjects = np.empty((0,), dtype='int')
-    val_subjects = np.empty((0,), dtype='int')
-    test_subjects = np.empty((0,), dtype='int')
-    previous_subject = 1
-    subject_video_count = 0
-    current_video_idx = 0
-    current_data_idx = 0
-    populate = False
-    for idx, subject in enumerate(subjects):
-        if previous_subject == subject:  # accumulate
-            subject_video_count += 1
-        else:  # populate the previous subject
-            populate = True
-        if idx == len(subjects) - 1:  # check if it is the last entry, if so populate
-            populate = True
-            previous_subject = subject
-        if populate:
-            # slice the data into the respective splits
-            end_video_idx = current_video_idx + subject_video_count
-            subject_data_len = int(np.sum(video_lens[current_video_idx:end_video_idx]))
-            end_data_idx = current_data_idx + subject_data_len
-            if previous_subject in train_ids:
-                train_X = np.concatenate((train_X, X[current_data_idx:end_data_idx]))
-                train_y = np.concatenate((train_y, y[current_data_idx:end_data_idx]))
-                train_vidlens = np.concatenate((train_vidlens, video_lens[current_video_idx:end_video_idx]))
-                train_subjects = np.concatenate((train_subjects, subjects[current_video_idx:end_video_idx]))
-            elif previous_subject in val_ids:
-                val_X = np.concatenate((val_X, X[current_data_idx:end_data_idx]))
-                val_y = np.concatenate((val_y, y[current_data_idx:end_data_idx]))
-                val_vidlens = np.concatenate((val_vidlens, video_lens[current_video_idx:end_video_idx]))
-                val_subjects = np.concatenate((val_subjects, subjects[current_video_idx:end_video_idx]))
-            else:
-                test_X = np.concatenate((test_X, X[current_data_idx:end_data_idx]))
-                test_y = np.concatenate((test_y, y[current_data_idx:end_data_idx]))
-                test_vidlens = np.concatenate((test_vidlens, video_lens[current_video_idx:end_video_idx]))
-                test_subjects = np.concatenate((test_subjects, subjects[current_video_idx:end_video_idx]))
-            previous_subject = subject
-            current_video_idx = end_video_idx
-            current_data_idx = end_data_idx
-            subject_video_count = 1
-            populate = False
-    return train_X, train_y, train_vidlens, train_subjects, \
-           val_X, val_y, val_vidlens, val_subjects, \
-           test_X, test_y, test_vidlens, test_subjects
-
-
 def read_data_split_file(path, sep=','):
     with open(path) as f:
         subjects = f.readline().split(sep)
@@ -274,7 +205,7 @@ def main():
     train_X, train_y, train_vidlens, train_subjects, \
     val_X, val_y, val_vidlens, val_subjects, \
     test_X, test_y, test_vidlens, test_subjects = \
-        split_data(X, y, subjects, video_lens, train_subject_ids, val_subject_ids, test_subject_ids)
+        split_seq_data(X, y, subjects, video_lens, train_subject_ids, val_subject_ids, test_subject_ids)
 
     assert train_X.shape[0] + val_X.shape[0] + test_X.shape[0] == len(X)
     assert train_y.shape[0] + val_y.shape[0] + test_y.shape[0] == len(y)
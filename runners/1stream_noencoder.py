@@ -14,7 +14,10 @@ from utils.data_structures import circular_list
 from utils.datagen import *
 from utils.io import *
 from utils.regularization import early_stop2
+from utils.evaluation import evaluate_model_chunked
+from utils.runner_utils import configure_theano
 from custom.objectives import temporal_softmax_loss
+from custom.layers import set_delta_mode
 
 import theano.tensor as T
 import theano
@@ -27,11 +30,6 @@ from modelzoo import lstm_classifier_majority_vote, deltanet_v1
 from utils.plotting_utils import print_network
 
 
-def configure_theano():
-    theano.config.floatX = 'float32'
-    sys.setrecursionlimit(10000)
-
-
 def read_data_split_file(path, sep=','):
     with open(path) as f:
         subjects = f.readline().split(sep)
@@ -64,41 +62,6 @@ def evaluate_model(X_val, y_val, mask_val, window, eval_fn):
     return classification_rate, confusion_matrix
 
 
-def evaluate_model2(X_val, y_val, mask_val, window, eval_fn):
-    """
-    Evaluate a lstm model
-    :param X_val: validation inputs
-    :param y_val: validation targets
-    :param mask_val: input masks for variable sequences
-    :param window: delta coefficient window
-    :param eval_fn: evaluation function
-    :return: classification rate, confusion matrix
-    """
-    output = eval_fn(X_val, mask_val, window)
-    num_classes = output.shape[-1]
-    confusion_matrix = np.zeros((num_classes, num_classes), dtype='int')
-    ix = np.zeros((X_val.shape[0],), dtype='int')
-    seq_lens = np.sum(mask_val, axis=-1)
-
-    # for each example, we only consider argmax of the seq len
-    votes = np.zeros((num_classes,), dtype='int')
-    for i, eg in enumerate(output):
-        predictions = np.argmax(eg[:seq_lens[i]], axis=-1)
-        for cls in range(num_classes):
-            count = (predictions == cls).sum(axis=-1)
-            votes[cls] = count
-        ix[i] = np.argmax(votes)
-
-    c = ix == y_val
-    classification_rate = np.sum(c == True) / float(len(c))
-
-    # construct the confusion matrix
-    for i, target in enumerate(y_val):
-        confusion_matrix[target, ix[i]] += 1
-
-    return classification_rate, confusion_matrix
-
-
 def parse_options():
     options = dict()
     options['config'] = 'config/unimodal_dct.ini'
@@ -138,7 +101,7 @@ def main():
     print('CLI options: {}'.format(options.items()))
 
     print('preprocessing dataset...')
-    data = load_mat_file(config.get('stream1', 'data'))
+    data = load_dataset(config.get('stream1', 'data'))
     stream1_dim = config.getint('stream1', 'input_dimensions')
     imagesize = tuple([int(d) for d in config.get('stream1', 'imagesize').split(',')])
 
@@ -153,6 +116,9 @@ def main():
     output_classnames = config.get('lstm_classifier', 'output_classnames').split(',')
     lstm_size = config.getint('lstm_classifier', 'lstm_size')
     windowsize = config.getint('lstm_classifier', 'windowsize')
+    delta_mode = config.get('lstm_classifier', 'delta_mode') \
+        if config.has_option('lstm_classifier', 'delta_mode') else 'scan'
+    set_delta_mode(delta_mode)
     weight_init = options['weight_init'] if 'weight_init' in options else config.get('lstm_classifier', 'weight_init')
     use_peepholes = options['use_peepholes'] if 'use_peepholes' in options else config.getboolean('lstm_classifier',
                                                                                                   'use_peepholes')
@@ -166,6 +132,10 @@ def main():
         else config.getfloat('training', 'learning_rate')
     epochsize = config.getint('training', 'epochsize')
     batchsize = config.getint('training', 'batchsize')
+    bucketing = config.getboolean('training', 'bucketing') if config.has_option('training', 'bucketing') \
+        else False
+    eval_chunksize = config.getint('training', 'eval_chunksize') \
+        if config.has_option('training', 'eval_chunksize') else 100
 
     weight_init_fn = las.init.GlorotUniform()
     if weight_init == 'glorot':
@@ -181,7 +151,7 @@ def main():
     val_subject_ids = read_data_split_file(config.get('training', 'val_subjects_file'))
     test_subject_ids = read_data_split_file(config.get('training', 'test_subjects_file'))
 
-    data_matrix = data['dataMatrix'].astype('float32')
+    data_matrix = data['dataMatrix'].astype('float32', copy=False)
     targets_vec = data['targetsVec'].reshape((-1,))
     subjects_vec = data['subjectsVec'].reshape((-1,))
     vidlen_vec = data['videoLengthVec'].reshape((-1,))
@@ -199,14 +169,14 @@ def main():
         test_y -= 1
 
     if meanremove:
-        train_X = sequencewise_mean_image_subtraction(train_X, train_vidlens)
-        val_X = sequencewise_mean_image_subtraction(val_X, val_vidlens)
-        test_X = sequencewise_mean_image_subtraction(test_X, test_vidlens)
+        train_X = sequencewise_mean_image_subtraction(train_X, train_vidlens, inplace=True)
+        val_X = sequencewise_mean_image_subtraction(val_X, val_vidlens, inplace=True)
+        test_X = sequencewise_mean_image_subtraction(test_X, test_vidlens, inplace=True)
 
     if diffimage:
-        train_X = compute_diff_images(train_X, train_vidlens)
-        val_X = compute_diff_images(val_X, val_vidlens)
-        test_X = compute_diff_images(test_X, test_vidlens)
+        train_X = compute_diff_images(train_X, train_vidlens, inplace=True)
+        val_X = compute_diff_images(val_X, val_vidlens, inplace=True)
+        test_X = compute_diff_images(test_X, test_vidlens, inplace=True)
 
     if samplewisenormalize:
         train_X = normalize_input(train_X)
@@ -267,23 +237,14 @@ def main():
     best_tr = float('inf')
     best_cr = 0.0
 
-    datagen = gen_lstm_batch_random(train_X, train_y, train_vidlens, batchsize=batchsize)
-    val_datagen = gen_lstm_batch_random(val_X, val_y, val_vidlens, batchsize=len(val_vidlens))
-    test_datagen = gen_lstm_batch_random(test_X, test_y, test_vidlens, batchsize=len(test_vidlens))
+    if bucketing:
+        # pad each batch only to its longest video
+        datagen = gen_lstm_batch_bucketed(train_X, train_y, train_vidlens, batchsize=batchsize)
+    else:
+        datagen = gen_lstm_batch_random(train_X, train_y, train_vidlens, batchsize=batchsize)
     integral_lens = compute_integral_len(train_vidlens)
 
-    # We'll use this "validation set" to periodically check progress
-    X_val, y_val, mask_val, idxs_val = next(val_datagen)
-    integral_lens_val = compute_integral_len(val_vidlens)
-    dct_val = gen_seq_batch_from_idx(val_X, idxs_val, val_vidlens, integral_lens_val, np.max(val_vidlens))
-
-    X_test, y_test, mask_test, idxs_test = next(test_datagen)
-    integral_lens_test = compute_integral_len(test_vidlens)
-    dct_test = gen_seq_batch_from_idx(test_X, idxs_test, test_vidlens, integral_lens_test, np.max(test_vidlens))
-
-    # reshape the targets for validation
-    y_val_evaluate = y_val
-    y_val = y_val.reshape((-1, 1)).repeat(mask_val.shape[-1], axis=-1)
+    # the validation and test splits are evaluated in length sorted chunks of eval_chunksize videos
 
     for epoch in range(num_epoch):
         time_start = time.time()
@@ -292,7 +253,7 @@ def main():
             # repeat targets based on max sequence len
             y = y.reshape((-1, 1))
             y = y.repeat(m.shape[-1], axis=-1)
-            d = gen_seq_batch_from_idx(train_X, batch_idxs, train_vidlens, integral_lens, np.max(train_vidlens))
+            d = gen_seq_batch_from_idx(train_X, batch_idxs, train_vidlens, integral_lens, m.shape[-1])
             print_str = 'Epoch {} batch {}/{}: {} examples using adam with learning rate = {}'.format(
                 epoch + 1, i + 1, epochsize, len(y), learning_rate)
             print(print_str, end='')
@@ -300,7 +261,8 @@ def main():
             train(d, y, m, windowsize)
             print('\r', end='')
         cost = compute_train_cost(d, y, m, windowsize)
-        val_cost = compute_test_cost(dct_val, y_val, mask_val, windowsize)
+        cr, val_conf, val_cost = evaluate_model_chunked([val_X], val_y, val_vidlens, val_fn, compute_test_cost,
+                                                        [windowsize], eval_chunksize)
         cost_train.append(cost)
         cost_val.append(val_cost)
         train_strip[epoch % STRIP_SIZE] = cost
@@ -310,14 +272,14 @@ def main():
         pk = 1000 * (np.sum(train_strip) / (STRIP_SIZE * np.min(train_strip)) - 1)
         pq = gl / pk
 
-        cr, val_conf = evaluate_model2(dct_val, y_val_evaluate, mask_val, windowsize, val_fn)
         class_rate.append(cr)
 
         if val_cost < best_val:
             best_val = val_cost
             best_conf = val_conf
             best_cr = cr
-            test_cr, test_conf = evaluate_model2(dct_test, y_test, mask_test, windowsize, val_fn)
+            test_cr, test_conf, _ = evaluate_model_chunked([test_X], test_y, test_vidlens, val_fn,
+                                                           extra_inputs=[windowsize], chunksize=eval_chunksize)
             print("Epoch {} train cost = {}, val cost = {}, "
                   "GL loss = {:.3f}, GQ = {:.3f}, CR = {:.3f}, Test CR= {:.3f} ({:.1f}sec)"
                   .format(epoch + 1, cost_train[-1], cost_val[-1], gl, pq, cr, test_cr, time.time() - time_start))
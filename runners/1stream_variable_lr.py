@@ -14,8 +14,10 @@ from utils.data_structures import circular_list
 from utils.datagen import *
 from utils.io import *
 from utils.regularization import early_stop2
+from utils.evaluation import evaluate_model_chunked
+from utils.runner_utils import load_decoder, configure_theano
 from custom.objectives import temporal_softmax_loss
-from custom.nonlinearities import select_nonlinearity
+from custom.layers import set_delta_mode
 import custom.updates
 
 import theano.tensor as T
@@ -29,58 +31,6 @@ from modelzoo import deltanet_majority_vote
 from utils.plotting_utils import print_network
 
 
-def load_decoder(path, shapes, nonlinearities):
-    nn = sio.loadmat(path)
-    weights = []
-    biases = []
-    shapes = [int(s) for s in shapes.split(',')]
-    nonlinearities = [select_nonlinearity(nonlinearity) for nonlinearity in nonlinearities.split(',')]
-    for i in range(len(shapes)):
-        weights.append(nn['w{}'.format(i+1)].astype('float32'))
-        biases.append(nn['b{}'.format(i+1)][0].astype('float32'))
-    return weights, biases, shapes, nonlinearities
-
-
-def configure_theano():
-    theano.config.floatX = 'float32'
-    sys.setrecursionlimit(10000)
-
-
-def evaluate_model2(X_val, y_val, mask_val, window_size, eval_fn):
-    """
-    Evaluate a lstm model
-    :param X_val: validation inputs
-    :param y_val: validation targets
-    :param mask_val: input masks for variable sequences
-    :param window_size: size of window for computing delta coefficients
-    :param eval_fn: evaluation function
-    :return: classification rate, confusion matrix
-    """
-    output = eval_fn(X_val, mask_val, window_size)
-    num_classes = output.shape[-1]
-    confusion_matrix = np.zeros((num_classes, num_classes), dtype='int')
-    ix = np.zeros((X_val.shape[0],), dtype='int')
-    seq_lens = np.sum(mask_val, axis=-1)
-
-    # for each example, we only consider argmax of the seq len
-    votes = np.zeros((num_classes,), dtype='int')
-    for i, eg in enumerate(output):
-        predictions = np.argmax(eg[:seq_lens[i]], axis=-1)
-        for cls in range(num_classes):
-            count = (predictions == cls).sum(axis=-1)
-            votes[cls] = count
-        ix[i] = np.argmax(votes)
-
-    c = ix == y_val
-    classification_rate = np.sum(c == True) / float(len(c))
-
-    # construct the confusion matrix
-    for i, target in enumerate(y_val):
-        confusion_matrix[target, ix[i]] += 1
-
-    return classification_rate, confusion_matrix
-
-
 def parse_options():
     options = dict()
     options['config'] = '../cuave/config/1stream.ini'
@@ -120,7 +70,7 @@ def main():
     print(config.items('training'))
 
     print('preprocessing dataset...')
-    data = load_mat_file(config.get('stream1', 'data'))
+    data = load_dataset(config.get('stream1', 'data'))
     stream1 = config.get('stream1', 'model')
     imagesize = tuple([int(d) for d in config.get('stream1', 'imagesize').split(',')])
     stream1_dim = config.getint('stream1', 'input_dimensions')
@@ -145,6 +95,9 @@ def main():
     use_peepholes = options['use_peepholes'] if 'use_peepholes' in options else config.getboolean('lstm_classifier',
                                                                                                   'use_peepholes')
     windowsize = config.getint('lstm_classifier', 'windowsize')
+    delta_mode = config.get('lstm_classifier', 'delta_mode') \
+        if config.has_option('lstm_classifier', 'delta_mode') else 'scan'
+    set_delta_mode(delta_mode)
 
     # capture training parameters
     validation_window = int(options['validation_window']) \
@@ -155,6 +108,10 @@ def main():
 
     epochsize = config.getint('training', 'epochsize')
     batchsize = config.getint('training', 'batchsize')
+    bucketing = config.getboolean('training', 'bucketing') if config.has_option('training', 'bucketing') \
+        else False
+    eval_chunksize = config.getint('training', 'eval_chunksize') \
+        if config.has_option('training', 'eval_chunksize') else 100
 
     weight_init_fn = las.init.GlorotUniform()
     if weight_init == 'glorot':
@@ -170,7 +127,7 @@ def main():
     val_subject_ids = read_data_split_file(config.get('training', 'val_subjects_file'))
     test_subject_ids = read_data_split_file(config.get('training', 'test_subjects_file'))
 
-    data_matrix = data['dataMatrix'].astype('float32')
+    data_matrix = data['dataMatrix'].astype('float32', copy=False)
     targets_vec = data['targetsVec'].reshape((-1,))
     subjects_vec = data['subjectsVec'].reshape((-1,))
     vidlen_vec = data['videoLengthVec'].reshape((-1,))
@@ -188,14 +145,14 @@ def main():
         test_y -= 1
 
     if meanremove:
-        train_X = sequencewise_mean_image_subtraction(train_X, train_vidlens)
-        val_X = sequencewise_mean_image_subtraction(val_X, val_vidlens)
-        test_X = sequencewise_mean_image_subtraction(test_X, test_vidlens)
+        train_X = sequencewise_mean_image_subtraction(train_X, train_vidlens, inplace=True)
+        val_X = sequencewise_mean_image_subtraction(val_X, val_vidlens, inplace=True)
+        test_X = sequencewise_mean_image_subtraction(test_X, test_vidlens, inplace=True)
 
     if diffimage:
-        train_X = compute_diff_images(train_X, train_vidlens)
-        val_X = compute_diff_images(val_X, val_vidlens)
-        test_X = compute_diff_images(test_X, test_vidlens)
+        train_X = compute_diff_images(train_X, train_vidlens, inplace=True)
+        val_X = compute_diff_images(val_X, val_vidlens, inplace=True)
+        test_X = compute_diff_images(test_X, test_vidlens, inplace=True)
 
     if samplewisenormalize:
         train_X = normalize_input(train_X)
@@ -266,20 +223,13 @@ def main():
     best_val = float('inf')
     best_cr = 0.0
 
-    datagen = gen_lstm_batch_random(train_X, train_y, train_vidlens, batchsize=batchsize)
-
-    val_datagen = gen_lstm_batch_random(val_X, val_y, val_vidlens, batchsize=len(val_vidlens))
-    test_datagen = gen_lstm_batch_random(test_X, test_y, test_vidlens, batchsize=len(test_vidlens))
-
-    # We'll use this "validation set" to periodically check progress
-    X_val, y_val, mask_val, idxs_val = next(val_datagen)
-
-    # we use the test set to check final classification rate
-    X_test, y_test, mask_test, idxs_test = next(test_datagen)
+    if bucketing:
+        # pad each batch only to its longest video
+        datagen = gen_lstm_batch_bucketed(train_X, train_y, train_vidlens, batchsize=batchsize)
+    else:
+        datagen = gen_lstm_batch_random(train_X, train_y, train_vidlens, batchsize=batchsize)
 
-    # reshape the targets for validation
-    y_val_evaluate = y_val
-    y_val = y_val.reshape((-1, 1)).repeat(mask_val.shape[-1], axis=-1)
+    # the validation and test splits are evaluated in length sorted chunks of eval_chunksize videos
 
     for epoch in range(num_epoch):
         time_start = time.time()
@@ -295,7 +245,8 @@ def main():
             train(X, y, m, windowsize)
             print('\r', end='')
         cost = compute_train_cost(X, y, m, windowsize)
-        val_cost = compute_test_cost(X_val, y_val, mask_val, windowsize)
+        cr, val_conf, val_cost = evaluate_model_chunked([val_X], val_y, val_vidlens, val_fn, compute_test_cost,
+                                                        [windowsize], eval_chunksize)
         cost_train.append(cost)
         cost_val.append(val_cost)
         train_strip[epoch % STRIP_SIZE] = cost
@@ -305,13 +256,13 @@ def main():
         pk = 1000 * (np.sum(train_strip) / (STRIP_SIZE * np.min(train_strip)) - 1)
         pq = gl / pk
 
-        cr, val_conf = evaluate_model2(X_val, y_val_evaluate, mask_val, windowsize, val_fn)
         class_rate.append(cr)
 
         if val_cost < best_val:
             best_val = val_cost
             best_cr = cr
-            test_cr, test_conf = evaluate_model2(X_test, y_test, mask_test, windowsize, val_fn)
+            test_cr, test_conf, _ = evaluate_model_chunked([test_X], test_y, test_vidlens, val_fn,
+                                                           extra_inputs=[windowsize], chunksize=eval_chunksize)
             print("Epoch {} train cost = {}, val cost = {}, "
                   "GL loss = {:.3f}, GQ = {:.3f}, CR = {:.3f}, Test CR= {:.3f} ({:.1f}sec)"
                   .format(epoch + 1, cost_train[-1], cost_val[-1], gl, pq, cr, test_cr, time.time() - time_start))
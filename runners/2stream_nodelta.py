@@ -14,8 +14,9 @@ from utils.data_structures import circular_list
 from utils.datagen import *
 from utils.io import *
 from utils.regularization import early_stop2
+from utils.evaluation import evaluate_model_chunked
+from utils.runner_utils import load_decoder, configure_theano, postsplit_datapreprocessing
 from custom.objectives import temporal_softmax_loss
-from custom.nonlinearities import select_nonlinearity
 
 import theano.tensor as T
 import theano
@@ -28,58 +29,6 @@ from modelzoo import adenet_v2_nodelta
 from utils.plotting_utils import print_network
 
 
-def load_decoder(path, shapes, nonlinearities):
-    nn = sio.loadmat(path)
-    weights = []
-    biases = []
-    shapes = [int(s) for s in shapes.split(',')]
-    nonlinearities = [select_nonlinearity(nonlinearity) for nonlinearity in nonlinearities.split(',')]
-    for i in range(len(shapes)):
-        weights.append(nn['w{}'.format(i+1)].astype('float32'))
-        biases.append(nn['b{}'.format(i+1)][0].astype('float32'))
-    return weights, biases, shapes, nonlinearities
-
-
-def configure_theano():
-    theano.config.floatX = 'float32'
-    sys.setrecursionlimit(10000)
-
-
-def evaluate_model2(X_val, y_val, mask_val, X_diff_val, eval_fn):
-    """
-    Evaluate a lstm model
-    :param X_val: validation inputs
-    :param y_val: validation targets
-    :param mask_val: input masks for variable sequences
-    :param X_diff_val: validation inputs diff image
-    :param eval_fn: evaluation function
-    :return: classification rate, confusion matrix
-    """
-    output = eval_fn(X_val, mask_val, X_diff_val)
-    num_classes = output.shape[-1]
-    confusion_matrix = np.zeros((num_classes, num_classes), dtype='int')
-    ix = np.zeros((X_val.shape[0],), dtype='int')
-    seq_lens = np.sum(mask_val, axis=-1)
-
-    # for each example, we only consider argmax of the seq len
-    votes = np.zeros((num_classes,), dtype='int')
-    for i, eg in enumerate(output):
-        predictions = np.argmax(eg[:seq_lens[i]], axis=-1)
-        for cls in range(num_classes):
-            count = (predictions == cls).sum(axis=-1)
-            votes[cls] = count
-        ix[i] = np.argmax(votes)
-
-    c = ix == y_val
-    classification_rate = np.sum(c == True) / float(len(c))
-
-    # construct the confusion matrix
-    for i, target in enumerate(y_val):
-        confusion_matrix[target, ix[i]] += 1
-
-    return classification_rate, confusion_matrix
-
-
 def presplit_dataprocessing(data_matrix, vidlens, config, stream_name, **kwargs):
     reorderdata = config.getboolean(stream_name, 'reorderdata')
     diffimage = config.getboolean(stream_name, 'diffimage')
@@ -91,21 +40,12 @@ def presplit_dataprocessing(data_matrix, vidlens, config, stream_name, **kwargs)
     if samplewisenormalize:
         data_matrix = normalize_input(data_matrix)
     if meanremove:
-        data_matrix = sequencewise_mean_image_subtraction(data_matrix, vidlens)
+        data_matrix = sequencewise_mean_image_subtraction(data_matrix, vidlens, inplace=True)
     if diffimage:
-        data_matrix = compute_diff_images(data_matrix, vidlens)
+        data_matrix = compute_diff_images(data_matrix, vidlens, inplace=True)
     return data_matrix
 
 
-def postsplit_datapreprocessing(train_X, val_X, test_X, config, stream_name):
-    featurewisenormalize = config.getboolean(stream_name, 'featurewisenormalize')
-    if featurewisenormalize:
-        train_X, mean, std = featurewise_normalize_sequence(train_X)
-        val_X = (val_X - mean) / std
-        test_X = (test_X - mean) / std
-    return train_X, val_X, test_X
-
-
 def parse_options():
     options = dict()
     options['config'] = 'config/bimodal_meanrm_raw_diff.ini'
@@ -148,7 +88,7 @@ def main():
     print('preprocessing dataset...')
 
     # stream 1
-    s1_data = load_mat_file(config.get('stream1', 'data'))
+    s1_data = load_dataset(config.get('stream1', 'data'))
     s1_imagesize = tuple([int(d) for d in config.get('stream1', 'imagesize').split(',')])
     s1 = config.get('stream1', 'model')
     s1_inputdim = config.getint('stream1', 'input_dimensions')
@@ -156,7 +96,7 @@ def main():
     s1_nonlinearities = config.get('stream1', 'nonlinearities')
 
     # stream 2
-    s2_data = load_mat_file(config.get('stream2', 'data'))
+    s2_data = load_dataset(config.get('stream2', 'data'))
     s2_imagesize = tuple([int(d) for d in config.get('stream2', 'imagesize').split(',')])
     s2 = config.get('stream2', 'model')
     s2_inputdim = config.getint('stream2', 'input_dimensions')
@@ -181,6 +121,10 @@ def main():
         else config.getfloat('training', 'learning_rate')
     epochsize = config.getint('training', 'epochsize')
     batchsize = config.getint('training', 'batchsize')
+    bucketing = config.getboolean('training', 'bucketing') if config.has_option('training', 'bucketing') \
+        else False
+    eval_chunksize = config.getint('training', 'eval_chunksize') \
+        if config.has_option('training', 'eval_chunksize') else 100
 
     weight_init_fn = las.init.GlorotUniform()
     if weight_init == 'glorot':
@@ -196,8 +140,8 @@ def main():
     val_subject_ids = read_data_split_file(config.get('training', 'val_subjects_file'))
     test_subject_ids = read_data_split_file(config.get('training', 'test_subjects_file'))
 
-    s1_data_matrix = s1_data['dataMatrix'].astype('float32')
-    s2_data_matrix = s2_data['dataMatrix'].astype('float32')
+    s1_data_matrix = s1_data['dataMatrix'].astype('float32', copy=False)
+    s2_data_matrix = s2_data['dataMatrix'].astype('float32', copy=False)
     targets_vec = s1_data['targetsVec'].reshape((-1,))
     subjects_vec = s1_data['subjectsVec'].reshape((-1,))
     vidlen_vec = s1_data['videoLengthVec'].reshape((-1,))
@@ -208,17 +152,16 @@ def main():
     s1_data_matrix = presplit_dataprocessing(s1_data_matrix, vidlen_vec, config, 'stream1', imagesize=s1_imagesize)
     s2_data_matrix = presplit_dataprocessing(s2_data_matrix, vidlen_vec, config, 'stream2', imagesize=s2_imagesize)
 
-    s1_train_X, s1_train_y, s1_train_vidlens, s1_train_subjects, \
-    s1_val_X, s1_val_y, s1_val_vidlens, s1_val_subjects, \
-    s1_test_X, s1_test_y, s1_test_vidlens, s1_test_subjects = split_seq_data(s1_data_matrix, targets_vec, subjects_vec,
-                                                                             vidlen_vec, train_subject_ids,
-                                                                             val_subject_ids, test_subject_ids)
-
-    s2_train_X, s2_train_y, s2_train_vidlens, s2_train_subjects, \
-    s2_val_X, s2_val_y, s2_val_vidlens, s2_val_subjects, \
-    s2_test_X, s2_test_y, s2_test_vidlens, s2_test_subjects = split_seq_data(s2_data_matrix, targets_vec, subjects_vec,
-                                                                             vidlen_vec, train_subject_ids,
-                                                                             val_subject_ids, test_subject_ids)
+    # split all streams with a single shared index
+    streams = [s1_data_matrix, s2_data_matrix]
+    train_split, val_split, test_split = split_multistream_data(streams, targets_vec, subjects_vec, vidlen_vec,
+                                                                train_subject_ids, val_subject_ids, test_subject_ids)
+    s1_train_X, s2_train_X = train_split['X']
+    s1_val_X, s2_val_X = val_split['X']
+    s1_test_X, s2_test_X = test_split['X']
+    s1_train_y, s1_train_vidlens = train_split['y'], train_split['vidlens']
+    s1_val_y, s1_val_vidlens = val_split['y'], val_split['vidlens']
+    s1_test_y, s1_test_vidlens = test_split['y'], test_split['vidlens']
 
     s1_train_X, s1_val_X, s1_test_X = postsplit_datapreprocessing(s1_train_X, s1_val_X, s1_test_X, config, 'stream1')
     s2_train_X, s2_val_X, s2_test_X = postsplit_datapreprocessing(s2_train_X, s2_val_X, s2_test_X, config, 'stream2')
@@ -278,25 +221,20 @@ def main():
     best_val = float('inf')
     best_cr = 0.0
 
-    datagen = gen_lstm_batch_random(s1_train_X, s1_train_y, s1_train_vidlens, batchsize=batchsize)
+    if bucketing:
+        # pad each batch only to its longest video
+        datagen = gen_lstm_batch_bucketed(s1_train_X, s1_train_y, s1_train_vidlens, batchsize=batchsize)
+    else:
+        datagen = gen_lstm_batch_random(s1_train_X, s1_train_y, s1_train_vidlens, batchsize=batchsize)
     integral_lens = compute_integral_len(s1_train_vidlens)
 
-    val_datagen = gen_lstm_batch_random(s1_val_X, s1_val_y, s1_val_vidlens, batchsize=len(s1_val_vidlens))
-    test_datagen = gen_lstm_batch_random(s1_test_X, s1_test_y, s1_test_vidlens, batchsize=len(s1_test_vidlens))
-
-    # We'll use this "validation set" to periodically check progress
-    X_val, y_val, mask_val, idxs_val = next(val_datagen)
-    integral_lens_val = compute_integral_len(s1_val_vidlens)
-    X_diff_val = gen_seq_batch_from_idx(s2_val_X, idxs_val, s1_val_vidlens, integral_lens_val, np.max(s1_val_vidlens))
-
-    # we use the test set to check final classification rate
-    X_test, y_test, mask_test, idxs_test = next(test_datagen)
-    integral_lens_test = compute_integral_len(s1_test_vidlens)
-    X_diff_test = gen_seq_batch_from_idx(s2_test_X, idxs_test, s1_test_vidlens, integral_lens_test, np.max(s1_test_vidlens))
+    # the validation and test splits are evaluated in length sorted chunks of eval_chunksize videos,
+    # the chunks hold the stream batches first, then the targets and mask
+    def eval_fn(X, X_diff, m):
+        return val_fn(X, m, X_diff)
 
-    # reshape the targets for validation
-    y_val_evaluate = y_val
-    y_val = y_val.reshape((-1, 1)).repeat(mask_val.shape[-1], axis=-1)
+    def eval_cost_fn(X, X_diff, y, m):
+        return compute_test_cost(X, y, m, X_diff)
 
     for epoch in range(num_epoch):
         time_start = time.time()
@@ -306,7 +244,7 @@ def main():
             y = y.reshape((-1, 1))
             y = y.repeat(m.shape[-1], axis=-1)
             X_diff = gen_seq_batch_from_idx(s2_train_X, batch_idxs,
-                                            s1_train_vidlens, integral_lens, np.max(s1_train_vidlens))
+                                            s1_train_vidlens, integral_lens, m.shape[-1])
             print_str = 'Epoch {} batch {}/{}: {} examples using adam'.format(
                 epoch + 1, i + 1, epochsize, len(X))
             print(print_str, end='')
@@ -314,7 +252,8 @@ def main():
             train(X, y, m, X_diff)
             print('\r', end='')
         cost = compute_train_cost(X, y, m, X_diff)
-        val_cost = compute_test_cost(X_val, y_val, mask_val, X_diff_val)
+        cr, val_conf, val_cost = evaluate_model_chunked([s1_val_X, s2_val_X], s1_val_y, s1_val_vidlens, eval_fn,
+                                                        eval_cost_fn, [], eval_chunksize)
         cost_train.append(cost)
         cost_val.append(val_cost)
         train_strip[epoch % STRIP_SIZE] = cost
@@ -324,14 +263,13 @@ def main():
         pk = 1000 * (np.sum(train_strip) / (STRIP_SIZE * np.min(train_strip)) - 1)
         pq = gl / pk
 
-        cr, val_conf = evaluate_model2(X_val, y_val_evaluate, mask_val, X_diff_val, val_fn)
         class_rate.append(cr)
 
         if val_cost < best_val:
             best_val = val_cost
             best_cr = cr
-            test_cr, test_conf = evaluate_model2(X_test, y_test, mask_test,
-                                                 X_diff_test, val_fn)
+            test_cr, test_conf, _ = evaluate_model_chunked([s1_test_X, s2_test_X], s1_test_y, s1_test_vidlens, eval_fn,
+                                                           extra_inputs=[], chunksize=eval_chunksize)
             print("Epoch {} train cost = {}, val cost = {}, "
                   "GL loss = {:.3f}, GQ = {:.3f}, CR = {:.3f}, Test CR= {:.3f} ({:.1f}sec)"
                   .format(epoch + 1, cost_train[-1], cost_val[-1], gl, pq, cr, test_cr, time.time() - time_start))
@@ -0,0 +1,331 @@
+from __future__ import print_function
+import sys
+sys.path.insert(0, '../')
+import time
+import ConfigParser
+
+import matplotlib
+matplotlib.use('Agg')  # Change matplotlib backend, in case we have no X server running..
+
+from utils.preprocessing import *
+from utils.plotting_utils import *
+from utils.data_structures import circular_list
+from utils.datagen import *
+from utils.io import *
+from utils.regularization import early_stop2
+from utils.evaluation import evaluate_model_chunked
+from utils.compile_cache import compile_with_cache
+from utils.runner_utils import *
+from custom.objectives import temporal_softmax_loss
+from custom.layers import set_delta_mode
+
+import theano.tensor as T
+import theano
+
+import lasagne as las
+import numpy as np
+from lasagne.updates import adam
+
+from modelzoo import deltanet_majority_vote, adenet_2stream, adenet_3stream, adenet_3stream_dropout, adenet_4stream
+from utils.plotting_utils import print_network
+
+
+# model builders by number of streams, all take the autoencoders, then (shape, input) of each stream,
+# then the mask shape and mask input. adenet_2stream builds the same network as adenet_v2_2
+MODEL_BUILDERS = {1: deltanet_majority_vote, 2: adenet_2stream, 3: adenet_3stream, 4: adenet_4stream}
+DROPOUT_MODEL_BUILDERS = {3: adenet_3stream_dropout}
+# builders of models initialised with the pretrained lstm of each stream
+PRETRAINED_MODEL_BUILDERS = {2: adenet_2stream, 3: adenet_3stream}
+
+
+def select_model_builder(no_streams, use_dropout=False, pretrained=False):
+    """
+    :param no_streams: number of streams
+    :param use_dropout: use the dropout model
+    :param pretrained: use the model initialised with pretrained lstms
+    :return: modelzoo module building the model
+    """
+    if use_dropout:
+        builders, kind = DROPOUT_MODEL_BUILDERS, 'dropout '
+    elif pretrained:
+        builders, kind = PRETRAINED_MODEL_BUILDERS, 'pretrained lstm '
+    else:
+        builders, kind = MODEL_BUILDERS, ''
+    if no_streams not in builders:
+        raise ValueError('no {}model for {} streams, supported: {}'.format(kind, no_streams, sorted(builders.keys())))
+    return builders[no_streams]
+
+
+def create_model(builder, aes, lstms, stream_inputs, mask, lstm_size, window, output_classes, fusiontype,
+                 w_init_fn, use_peepholes):
+    """
+    build the end to end model of a number of streams
+    :param builder: modelzoo module, see select_model_builder
+    :param aes: pretrained decoder of each stream, see load_decoder
+    :param lstms: pretrained lstm of each stream, None to train the lstms from scratch
+    :param stream_inputs: list of (input shape, input variable) of each stream
+    :param mask: mask input variable
+    :return: output layer of the network
+    """
+    if builder is deltanet_majority_vote:
+        # the single stream DeltaNet has no fusion layer
+        (shape, input_var), = stream_inputs
+        return builder.create_model(aes[0], shape, input_var, (None, None), mask,
+                                    lstm_size, window, output_classes, w_init_fn, use_peepholes)
+    model_args = []
+    for i, ae in enumerate(aes):
+        model_args += [ae, lstms[i]] if lstms is not None else [ae]
+    for shape, input_var in stream_inputs:
+        model_args += [shape, input_var]
+    model_args += [(None, None), mask, lstm_size, window, output_classes, fusiontype]
+    create_fn = builder.create_pretrained_model if lstms is not None else builder.create_model
+    network, l_fuse = create_fn(*model_args, w_init_fn=w_init_fn, use_peepholes=use_peepholes)
+    return network
+
+
+def main(default_config='config/trimodal.ini', no_streams=None):
+    """
+    train a model on the stream sections of a config file
+    :param default_config: config file used without --config
+    :param no_streams: number of streams to use, stream1..streamN, defaults to all stream sections
+    """
+    configure_theano()
+    options = parse_options(default_config)
+    config_file = options['config']
+    config = ConfigParser.ConfigParser()
+    config.read(config_file)
+
+    print('CLI options: {}'.format(options.items()))
+
+    print('Reading Config File: {}...'.format(config_file))
+    stream_names = stream_sections(config, no_streams)
+    for stream_name in stream_names:
+        print(config.items(stream_name))
+    print(config.items('lstm_classifier'))
+    print(config.items('training'))
+
+    # lstm classifier
+    fusiontype = config.get('lstm_classifier', 'fusiontype') \
+        if config.has_option('lstm_classifier', 'fusiontype') else 'concat'
+    weight_init = options['weight_init'] if 'weight_init' in options else config.get('lstm_classifier', 'weight_init')
+    use_peepholes = options['use_peepholes'] if 'use_peepholes' in options else config.getboolean('lstm_classifier',
+                                                                                                  'use_peepholes')
+    windowsize = config.getint('lstm_classifier', 'windowsize')
+    delta_mode = config.get('lstm_classifier', 'delta_mode') \
+        if config.has_option('lstm_classifier', 'delta_mode') else 'scan'
+    set_delta_mode(delta_mode)
+    output_classes = config.getint('lstm_classifier', 'output_classes')
+    output_classnames = config.get('lstm_classifier', 'output_classnames').split(',')
+    lstm_size = config.getint('lstm_classifier', 'lstm_size')
+    matlab_target_offset = config.getboolean('lstm_classifier', 'matlab_target_offset')
+    use_dropout = config.getboolean('lstm_classifier', 'use_dropout') \
+        if config.has_option('lstm_classifier', 'use_dropout') else False
+
+    no_streams = len(stream_names)
+    # streams are initialised with pretrained lstms when every stream has an lstm_model
+    lstm_models = [config.get(stream_name, 'lstm_model') if config.has_option(stream_name, 'lstm_model') else None
+                   for stream_name in stream_names]
+    pretrained = no_streams > 1 and not use_dropout and all(lstm_models)
+    builder = select_model_builder(no_streams, use_dropout, pretrained)
+
+    # capture training parameters
+    validation_window = int(options['validation_window']) \
+        if 'validation_window' in options else config.getint('training', 'validation_window')
+    num_epoch = int(options['num_epoch']) if 'num_epoch' in options else config.getint('training', 'num_epoch')
+    learning_rate = options['learning_rate'] if 'learning_rate' in options \
+        else config.getfloat('training', 'learning_rate')
+    epochsize = config.getint('training', 'epochsize')
+    batchsize = config.getint('training', 'batchsize')
+    bucketing = config.getboolean('training', 'bucketing') if config.has_option('training', 'bucketing') \
+        else False
+    eval_chunksize = config.getint('training', 'eval_chunksize') \
+        if config.has_option('training', 'eval_chunksize') else 100
+
+    weight_init_fn = select_weight_init(weight_init)
+
+    train_subject_ids = read_data_split_file(config.get('training', 'train_subjects_file'))
+    val_subject_ids = read_data_split_file(config.get('training', 'val_subjects_file'))
+    test_subject_ids = read_data_split_file(config.get('training', 'test_subjects_file'))
+
+    print('preprocessing dataset...')
+    stream_data = [load_dataset(config.get(stream_name, 'data')) for stream_name in stream_names]
+    targets_vec = stream_data[0]['targetsVec'].reshape((-1,))
+    subjects_vec = stream_data[0]['subjectsVec'].reshape((-1,))
+    vidlen_vec = stream_data[0]['videoLengthVec'].reshape((-1,))
+
+    force_align_data = config.getboolean('stream1', 'force_align_data') \
+        if config.has_option('stream1', 'force_align_data') else False
+
+    if matlab_target_offset:
+        targets_vec -= 1
+
+    data_matrices = []
+    for stream_name, data in zip(stream_names, stream_data):
+        imagesize = tuple([int(d) for d in config.get(stream_name, 'imagesize').split(',')])
+        data_matrix = data['dataMatrix'].astype('float32', copy=False)
+        # sequencewise preprocessing uses the video lengths of the stream itself, which differ before force alignment
+        data_matrices.append(presplit_dataprocessing(data_matrix, data['videoLengthVec'].reshape((-1,)), config,
+                                                     stream_name, imagesize=imagesize))
+
+    if force_align_data:
+        orig_streams = [(data_matrices[0], targets_vec, vidlen_vec)]
+        for data_matrix, data in zip(data_matrices[1:], stream_data[1:]):
+            orig_streams.append((data_matrix, data['targetsVec'].reshape((-1,)),
+                                 data['videoLengthVec'].reshape((-1,))))
+        new_streams = multistream_force_align(orig_streams)
+        data_matrices = [data_matrix for data_matrix, _, _ in new_streams]
+        _, targets_vec, vidlen_vec = new_streams[0]
+
+    # split all streams with a single shared index
+    train_split, val_split, test_split = split_multistream_data(data_matrices, targets_vec, subjects_vec, vidlen_vec,
+                                                                train_subject_ids, val_subject_ids, test_subject_ids)
+    train_X, val_X, test_X = [], [], []
+    for i, stream_name in enumerate(stream_names):
+        s_train_X, s_val_X, s_test_X = postsplit_datapreprocessing(train_split['X'][i], val_split['X'][i],
+                                                                   test_split['X'][i], config, stream_name)
+        train_X.append(s_train_X)
+        val_X.append(s_val_X)
+        test_X.append(s_test_X)
+    train_y, train_vidlens = train_split['y'], train_split['vidlens']
+    val_y, val_vidlens = val_split['y'], val_split['vidlens']
+    test_y, test_vidlens = test_split['y'], test_split['vidlens']
+
+    aes = [load_decoder(config.get(stream_name, 'model'), config.get(stream_name, 'shape'),
+                        config.get(stream_name, 'nonlinearities')) for stream_name in stream_names]
+    lstms = [sio.loadmat(lstm_model) for lstm_model in lstm_models] if pretrained else None
+
+    window = T.iscalar('theta')
+    inputs = [T.tensor3('inputs{}'.format(i + 1), dtype='float32') for i in range(no_streams)]
+    mask = T.matrix('mask', dtype='uint8')
+    targets = T.imatrix('targets')
+
+    print('constructing end to end {}-stream model...'.format(no_streams))
+    stream_inputs = [((None, None, config.getint(stream_name, 'input_dimensions')), input_var)
+                     for stream_name, input_var in zip(stream_names, inputs)]
+    network = create_model(builder, aes, lstms, stream_inputs, mask, lstm_size, window, output_classes, fusiontype,
+                           weight_init_fn, use_peepholes)
+
+    print_network(network)
+    # draw_to_file(las.layers.get_all_layers(network), 'network.png')
+    def compile_model():
+        print('compiling model...')
+        learning_rate_var = theano.shared(las.utils.floatX(learning_rate), 'learning_rate')
+        predictions = las.layers.get_output(network, deterministic=False)
+        all_params = las.layers.get_all_params(network, trainable=True)
+        cost = temporal_softmax_loss(predictions, targets, mask)
+        updates = adam(cost, all_params, learning_rate=learning_rate_var)
+
+        train = theano.function(
+            inputs + [targets, mask, window],
+            cost, updates=updates, allow_input_downcast=True)
+        compute_train_cost = theano.function(inputs + [targets, mask, window],
+                                             cost, allow_input_downcast=True)
+
+        test_predictions = las.layers.get_output(network, deterministic=True)
+        test_cost = temporal_softmax_loss(test_predictions, targets, mask)
+        compute_test_cost = theano.function(
+            inputs + [targets, mask, window], test_cost, allow_input_downcast=True)
+
+        val_fn = theano.function(inputs + [mask, window], test_predictions, allow_input_downcast=True)
+        return {'network': network, 'learning_rate': learning_rate_var, 'train': train,
+                'compute_train_cost': compute_train_cost, 'compute_test_cost': compute_test_cost,
+                'val_fn': val_fn}
+
+    # compiled functions are reused across runs with the same model, learning rate is a shared variable
+    compile_cache = config.get('training', 'compile_cache') if config.has_option('training', 'compile_cache') \
+        else None
+    compiled = compile_with_cache(network, compile_model, compile_cache, '{}stream'.format(no_streams), 'adam')
+    compiled['learning_rate'].set_value(las.utils.floatX(learning_rate))
+    network = compiled['network']
+    train, compute_train_cost = compiled['train'], compiled['compute_train_cost']
+    compute_test_cost, val_fn = compiled['compute_test_cost'], compiled['val_fn']
+
+    print('begin training...')
+    cost_train = []
+    cost_val = []
+    class_rate = []
+    STRIP_SIZE = 3
+    val_window = circular_list(validation_window)
+    train_strip = np.zeros((STRIP_SIZE,))
+    best_val = float('inf')
+    best_cr = 0.0
+
+    # all streams of a batch are gathered with the same frame offsets
+    datagen = gen_multistream_batch(train_X, train_y, train_vidlens, batchsize=batchsize, bucketing=bucketing)
+
+    # the validation and test splits are evaluated in length sorted chunks of eval_chunksize videos
+
+    for epoch in range(num_epoch):
+        time_start = time.time()
+        for i in range(epochsize):
+            X, y, m, batch_idxs = next(datagen)
+            # repeat targets based on max sequence len
+            y = y.reshape((-1, 1))
+            y = y.repeat(m.shape[-1], axis=-1)
+            print_str = 'Epoch {} batch {}/{}: {} examples using adam with learning rate = {}'.format(
+                epoch + 1, i + 1, epochsize, len(m), learning_rate)
+            print(print_str, end='')
+            sys.stdout.flush()
+            train(*(X + [y, m, windowsize]))
+            print('\r', end='')
+        cost = compute_train_cost(*(X + [y, m, windowsize]))
+        cr, val_conf, val_cost = evaluate_model_chunked(val_X, val_y, val_vidlens, val_fn, compute_test_cost,
+                                                        [windowsize], eval_chunksize)
+        cost_train.append(cost)
+        cost_val.append(val_cost)
+        train_strip[epoch % STRIP_SIZE] = cost
+        val_window.push(val_cost)
+
+        gl = 100 * (cost_val[-1] / np.min(cost_val) - 1)
+        pk = 1000 * (np.sum(train_strip) / (STRIP_SIZE * np.min(train_strip)) - 1)
+        pq = gl / pk
+
+        class_rate.append(cr)
+
+        if val_cost < best_val:
+            best_val = val_cost
+            best_cr = cr
+            test_cr, test_conf, _ = evaluate_model_chunked(test_X, test_y, test_vidlens, val_fn,
+                                                           extra_inputs=[windowsize], chunksize=eval_chunksize)
+            print("Epoch {} train cost = {}, val cost = {}, "
+                  "GL loss = {:.3f}, GQ = {:.3f}, CR = {:.3f}, Test CR= {:.3f} ({:.1f}sec)"
+                  .format(epoch + 1, cost_train[-1], cost_val[-1], gl, pq, cr, test_cr, time.time() - time_start))
+            best_params = las.layers.get_all_param_values(network)
+        else:
+            print("Epoch {} train cost = {}, val cost = {}, "
+                  "GL loss = {:.3f}, GQ = {:.3f}, CR = {:.3f} ({:.1f}sec)"
+                  .format(epoch + 1, cost_train[-1], cost_val[-1], gl, pq, cr, time.time() - time_start))
+
+        if epoch >= validation_window and early_stop2(val_window, best_val, validation_window):
+            break
+
+    print('Final Model')
+    print('CR: {}, val loss: {}, Test CR: {}'.format(best_cr, best_val, test_cr))
+
+    # plot confusion matrix
+    table_str = plot_confusion_matrix(test_conf, output_classnames, fmt='pipe')
+    print('confusion matrix: ')
+    print(table_str)
+
+    if 'save_plot' in options:
+        prefix = options['save_plot']
+        plot_validation_cost(cost_train, cost_val, savefilename='{}.validloss.png'.format(prefix))
+        with open('{}.confmat.txt'.format(prefix), mode='a') as f:
+            f.write(table_str)
+            f.write('\n\n')
+
+    if 'write_results' in options:
+        print('writing results to {}'.format(options['write_results']))
+        results_file = options['write_results']
+        with open(results_file, mode='a') as f:
+            f.write('{},{},{}\n'.format(test_cr, best_cr, best_val))
+
+    if 'save_best' in options:
+        print('saving best model...')
+        las.layers.set_all_param_values(network, best_params)
+        save_model_params(network, options['save_best'])
+        print('best model saved to {}'.format(options['save_best']))
+
+
+if __name__ == '__main__':
+    main()
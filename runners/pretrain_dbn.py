@@ -0,0 +1,115 @@
+from __future__ import print_function
+import sys
+sys.path.insert(0, '../')
+import argparse
+from multiprocessing import Pool
+import numpy as np
+from utils.io import load_dataset
+from utils.preprocessing import normalize_input
+from utils.dbn import dbn_params_init, train_dbn, unfold_dbn_to_ae, save_ae
+
+
+def parse_options():
+    options = dict()
+    options['shape'] = '2000,1000,500,50'
+    options['nonlinearities'] = 'ReLu,ReLu,ReLu,linear'
+    options['input_activation'] = 'linear'
+    options['epochs'] = 20
+    options['batchsize'] = 100
+    options['cd_k'] = 1
+    options['seed'] = None
+    options['processes'] = 1
+    options['scratch_dir'] = None
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shape', help='hidden layer sizes of the DBN. Default: 2000,1000,500,50')
+    parser.add_argument('--nonlinearities', help='activation of each hidden layer, sigm, linear or ReLu. '
+                                                 'Default: ReLu,ReLu,ReLu,linear')
+    parser.add_argument('--input_activation', help='activation of the input layer, sigm for binary inputs, '
+                                                   'linear for continuous inputs. Default: linear')
+    parser.add_argument('--epochs', help='epochs per RBM. Default: 20')
+    parser.add_argument('--batchsize', help='minibatch size. Default: 100')
+    parser.add_argument('--cd_k', help='gibbs steps of contrastive divergence. Default: 1')
+    parser.add_argument('--seed', help='random seed')
+    parser.add_argument('--processes', help='number of datasets pretrained in parallel. Default: 1')
+    parser.add_argument('--scratch_dir', help='directory of the memory-mapped hidden activations of each layer. '
+                                              'Default: system temporary directory')
+    parser.add_argument('--output', nargs='+', required=True, help='output .mat files, one per input')
+    parser.add_argument('input', nargs='+', help='input .mat files or memmap dataset directories')
+    args = parser.parse_args()
+    options['input'] = args.input
+    options['output'] = args.output
+    if len(options['input']) != len(options['output']):
+        parser.error('number of inputs and outputs differ')
+    if args.shape:
+        options['shape'] = args.shape
+    if args.nonlinearities:
+        options['nonlinearities'] = args.nonlinearities
+    if args.input_activation:
+        options['input_activation'] = args.input_activation
+    if args.epochs:
+        options['epochs'] = int(args.epochs)
+    if args.batchsize:
+        options['batchsize'] = int(args.batchsize)
+    if args.cd_k:
+        options['cd_k'] = int(args.cd_k)
+    if args.seed:
+        options['seed'] = int(args.seed)
+    if args.processes:
+        options['processes'] = int(args.processes)
+    if args.scratch_dir:
+        options['scratch_dir'] = args.scratch_dir
+    return options
+
+
+def max_value(data_matrix, chunksize=10000):
+    return max(np.max(data_matrix[start:start + chunksize]) for start in range(0, len(data_matrix), chunksize))
+
+
+def input_preprocessor(data_matrix, input_activation):
+    """
+    minibatch preprocessing of the inputs as dbn/normaliseData.m, applied as the memory-mapped
+    inputs are read so the dataset is never copied into memory
+    :param data_matrix: input data matrix
+    :param input_activation: activation of the input layer
+    :return: function preprocessing a float32 minibatch, or None
+    """
+    if input_activation.lower() == 'linear':
+        # samplewise normalisation, on a copy as minibatches may be views of the read-only memmap
+        return lambda batch: normalize_input(np.array(batch, dtype='float32'))
+    elif input_activation.lower() == 'sigm':
+        scale = np.float32(1. / max_value(data_matrix))
+        return lambda batch: batch * scale
+    return None
+
+
+def pretrain(job):
+    input_path, output_path, options = job
+    data_matrix = load_dataset(input_path)['dataMatrix']
+    params = dbn_params_init(options['nonlinearities'].split(','),
+                             [int(s) for s in options['shape'].split(',')],
+                             options['input_activation'],
+                             epochs=options['epochs'], batchsize=options['batchsize'], cd_k=options['cd_k'])
+    rbms = train_dbn(data_matrix, params, np.random.RandomState(options['seed']),
+                     preprocess=input_preprocessor(data_matrix, options['input_activation']),
+                     scratch_dir=options['scratch_dir'])
+    weights, biases = unfold_dbn_to_ae(rbms)
+    save_ae(weights, biases, output_path)
+    return output_path
+
+
+def main():
+    options = parse_options()
+    print(options)
+    jobs = [(i, o, options) for i, o in zip(options['input'], options['output'])]
+    if options['processes'] > 1:
+        pool = Pool(options['processes'])
+        outputs = pool.map(pretrain, jobs)
+        pool.close()
+        pool.join()
+    else:
+        outputs = [pretrain(job) for job in jobs]
+    print('pretrained: {}'.format(', '.join(outputs)))
+
+
+if __name__ == '__main__':
+    main()
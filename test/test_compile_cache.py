@@ -0,0 +1,82 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+import lasagne as las
+from utils.compile_cache import *
+
+
+class TestCompileCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def build(self, num_units=3):
+        inputs = T.matrix('inputs', dtype='float32')
+        network = las.layers.DenseLayer(las.layers.InputLayer((None, 4), inputs), num_units)
+
+        def compile_model():
+            output = las.layers.get_output(network)
+            return {'network': network, 'predict': theano.function([inputs], output, allow_input_downcast=True)}
+        return network, compile_model
+
+    def test_cache_reuse(self):
+        x = np.random.rand(5, 4).astype('float32')
+        network, compile_model = self.build()
+        compiled = compile_with_cache(network, compile_model, self.cache_dir, 'test')
+        assert np.allclose(compiled['predict'](x), las.layers.get_output(network, x).eval())
+
+        # a new network with the same topology loads the cached functions with its own weights
+        network, compile_model = self.build()
+        key = compile_cache_key(network, 'test')
+        assert load_compiled(self.cache_dir, key) is not None
+        cached = compile_with_cache(network, compile_model, self.cache_dir, 'test')
+        assert cached['network'] is not network
+        assert np.allclose(cached['predict'](x), las.layers.get_output(network, x).eval())
+
+        # a different topology gets a different key
+        other, _ = self.build(num_units=5)
+        assert compile_cache_key(other, 'test') != key
+
+    def test_key_depends_on_compile_config(self):
+        network, _ = self.build()
+        key = compile_cache_key(network, 'test')
+        for option, value in (('mode', 'FAST_COMPILE'), ('optimizer', 'None')):
+            previous = getattr(theano.config, option)
+            setattr(theano.config, option, value)
+            try:
+                assert compile_cache_key(network, 'test') != key
+            finally:
+                setattr(theano.config, option, previous)
+        assert compile_cache_key(network, 'test') == key
+
+    def test_cache_reseeds_dropout(self):
+        inputs = T.matrix('inputs', dtype='float32')
+        x = np.ones((20, 4), dtype='float32')
+
+        def build():
+            network = las.layers.DropoutLayer(las.layers.InputLayer((None, 4), inputs), p=0.5)
+
+            def compile_model():
+                output = las.layers.get_output(network, deterministic=False)
+                return {'network': network, 'predict': theano.function([inputs], output)}
+            return network, compile_model
+
+        las.random.set_rng(np.random.RandomState(1))
+        network, compile_model = build()
+        compile_with_cache(network, compile_model, self.cache_dir, 'dropout')
+        masks = []
+        for seed in (2, 3):
+            las.random.set_rng(np.random.RandomState(seed))
+            network, compile_model = build()
+            masks.append(compile_with_cache(network, compile_model, self.cache_dir, 'dropout')['predict'](x))
+        # runs loading the same cached functions draw different dropout masks
+        assert not np.array_equal(masks[0], masks[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
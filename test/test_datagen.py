@@ -0,0 +1,169 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import traceback
+import unittest
+import numpy as np
+from utils.io import save_mat
+from utils.datagen import *
+
+
+class TestSequenceBatchAssembly(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.seqlens = rng.randint(3, 12, size=23)
+        self.X = rng.randn(np.sum(self.seqlens), 7).astype('float32')
+        self.y = np.repeat(rng.randint(0, 5, size=23), self.seqlens)
+
+    def test_integral_len(self):
+        integral_lens = compute_integral_len(self.seqlens)
+        assert integral_lens[0] == 0
+        assert np.all(np.diff(integral_lens) == self.seqlens[:-1])
+
+    def test_assemble_seq_batch(self):
+        integral_lens = compute_integral_len(self.seqlens)
+        idxs = [5, 0, 22, 9]
+        max_timesteps = np.max(self.seqlens)
+        X_batch, mask = assemble_seq_batch(self.X, idxs, self.seqlens, integral_lens, max_timesteps, batchsize=6)
+        assert X_batch.shape == (6, max_timesteps, 7)
+        assert mask.shape == (6, max_timesteps)
+        for i, idx in enumerate(idxs):
+            l = self.seqlens[idx]
+            start = integral_lens[idx]
+            assert np.array_equal(X_batch[i, :l], self.X[start:start + l])
+            assert np.all(X_batch[i, l:] == 0)
+            assert np.sum(mask[i]) == l and np.all(mask[i, :l] == 1)
+        # padding rows are fully masked
+        assert np.all(X_batch[4:] == 0)
+        assert np.all(mask[4:] == 0)
+
+    def test_gen_lstm_batch_random(self):
+        datagen = gen_lstm_batch_random(self.X, self.y, self.seqlens, batchsize=5)
+        integral_lens = compute_integral_len(self.seqlens)
+        for i in range(5):
+            X_batch, y_batch, mask, idxs = next(datagen)
+            assert X_batch.shape[1] == np.max(self.seqlens)
+            assert np.array_equal(np.sum(mask, axis=-1), self.seqlens[idxs])
+            assert np.array_equal(y_batch, self.y[integral_lens[idxs]])
+
+    def test_gen_lstm_batch_bucketed(self):
+        datagen = gen_lstm_batch_bucketed(self.X, self.y, self.seqlens, batchsize=5, bucketsize=2, verbose=False)
+        integral_lens = compute_integral_len(self.seqlens)
+        seen = []
+        # one pass over the data covers every video exactly once
+        while len(seen) < len(self.seqlens):
+            X_batch, y_batch, mask, idxs = next(datagen)
+            assert X_batch.shape[1] == np.max(self.seqlens[idxs])
+            assert np.array_equal(np.sum(mask, axis=-1), self.seqlens[idxs])
+            assert np.array_equal(y_batch, self.y[integral_lens[idxs]])
+            seen += idxs.tolist()
+        assert sorted(seen) == list(range(len(self.seqlens)))
+
+    def test_assemble_multistream_batch(self):
+        integral_lens = compute_integral_len(self.seqlens)
+        idxs = [5, 0, 22, 9]
+        max_timesteps = np.max(self.seqlens)
+        X2 = np.arange(np.sum(self.seqlens) * 3).reshape((-1, 3))
+        (X_batch, X2_batch), mask = assemble_multistream_batch([self.X, X2], idxs, self.seqlens, integral_lens,
+                                                               max_timesteps)
+        expected, expected_mask = assemble_seq_batch(self.X, idxs, self.seqlens, integral_lens, max_timesteps)
+        assert np.array_equal(X_batch, expected) and np.array_equal(mask, expected_mask)
+        assert X2_batch.dtype == X2.dtype
+        assert np.array_equal(X2_batch, gen_seq_batch_from_idx(X2, idxs, self.seqlens, integral_lens, max_timesteps))
+
+    def test_gen_multistream_batch(self):
+        X2 = np.arange(np.sum(self.seqlens) * 3).reshape((-1, 3))
+        integral_lens = compute_integral_len(self.seqlens)
+        for bucketing in [False, True]:
+            datagen = gen_multistream_batch([self.X, X2], self.y, self.seqlens, batchsize=5, bucketing=bucketing,
+                                            bucketsize=2, verbose=False)
+            seen = []
+            while len(seen) < len(self.seqlens):
+                (X_batch, X2_batch), y_batch, mask, idxs = next(datagen)
+                max_timesteps = np.max(self.seqlens[idxs]) if bucketing else np.max(self.seqlens)
+                assert X_batch.shape[1] == X2_batch.shape[1] == max_timesteps
+                assert np.array_equal(np.sum(mask, axis=-1), self.seqlens[idxs])
+                assert np.array_equal(y_batch, self.y[integral_lens[idxs]])
+                assert np.array_equal(X2_batch[mask.astype(bool)][:, 0] // 3,
+                                      np.concatenate([np.arange(integral_lens[i], integral_lens[i] + self.seqlens[i])
+                                                      for i in idxs]))
+                seen += idxs.tolist()
+            assert sorted(seen) == list(range(len(self.seqlens)))
+
+    def test_padding_ratio(self):
+        batches = bucket_batch_idxs(self.seqlens, batchsize=5, bucketsize=None)
+        assert compute_padding_ratio(self.seqlens, batches) <= \
+            compute_padding_ratio(self.seqlens, batches, np.max(self.seqlens))
+        assert compute_padding_ratio([3, 3], [[0, 1]]) == 0.0
+
+
+class TestPrefetchFileBatch(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.tmpdir = tempfile.mkdtemp()
+        self.seqlens = rng.randint(3, 9, size=11)
+        self.targets = rng.randint(0, 5, size=11)
+        self.data = []
+        self.files = []
+        for i, l in enumerate(self.seqlens):
+            path = os.path.join(self.tmpdir, '{}.mat'.format(i))
+            self.data.append(rng.randn(l, 6).astype('float32'))
+            save_mat({'dataMatrix': self.data[-1]}, path)
+            self.files.append(path)
+        # unreadable file is zero filled
+        self.files[4] = os.path.join(self.tmpdir, 'missing.mat')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_matches_gen_batch_from_file(self):
+        expected = gen_batch_from_file(self.files, self.targets, self.seqlens, 6, batchsize=4, shuffle=False)
+        prefetched = gen_batch_from_file_prefetch(self.files, self.targets, self.seqlens, 6, batchsize=4,
+                                                  shuffle=False, workers=3, depth=2)
+        for i in range(6):
+            for a, b in zip(next(expected), next(prefetched)):
+                assert np.array_equal(a, b)
+
+    def test_prefetch_releases_threads(self):
+        before = threading.active_count()
+        prefetched = gen_batch_from_file_prefetch(self.files, self.targets, self.seqlens, 6, batchsize=4,
+                                                  shuffle=False, workers=3, depth=2)
+        next(prefetched)
+        prefetched.close()
+        assert threading.active_count() <= before
+
+    def test_prefetch_finite_generator(self):
+        before = threading.active_count()
+        assert list(gen_prefetch(iter([1, 2, 3]))) == [1, 2, 3]
+        assert threading.active_count() <= before
+
+    def test_unstarted_prefetch_holds_no_threads(self):
+        before = threading.active_count()
+        gen_batch_from_file_prefetch(self.files, self.targets, self.seqlens, 6, batchsize=4, workers=3)
+        assert threading.active_count() <= before
+
+    def test_prefetch_error_traceback(self):
+        def failing():
+            yield 1
+            raise ValueError('bad batch')
+
+        prefetched = gen_prefetch(failing())
+        assert next(prefetched) == 1
+        try:
+            next(prefetched)
+            assert False
+        except ValueError:
+            frames = traceback.extract_tb(sys.exc_info()[2])
+            assert any(frame[2] == 'failing' for frame in frames)
+
+    def test_file_errors(self):
+        X_batch, errors = load_file_batch(self.files, [4, 2], self.seqlens, np.max(self.seqlens), 6)
+        assert len(errors) == 1 and errors[0][0] == self.files[4]
+        assert np.all(X_batch[0] == 0)
+        assert np.array_equal(X_batch[1, :self.seqlens[2]], self.data[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from utils.io import *
+
+
+class TestMemmapDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_convert_mat_to_memmap(self):
+        rng = np.random.RandomState(0)
+        vidlens = rng.randint(3, 9, size=10)
+        data = {
+            'dataMatrix': rng.randn(np.sum(vidlens), 12),
+            'targetsVec': np.repeat(rng.randint(1, 5, size=10), vidlens).reshape((-1, 1)),
+            'subjectsVec': np.arange(10).reshape((-1, 1)),
+            'videoLengthVec': vidlens.reshape((-1, 1))
+        }
+        mat_path = os.path.join(self.tmpdir, 'data.mat')
+        store_path = os.path.join(self.tmpdir, 'data')
+        save_mat(data, mat_path)
+        convert_mat_to_memmap(mat_path, store_path, chunksize=7)
+
+        loaded = load_dataset(store_path)
+        data_matrix = loaded['dataMatrix']
+        assert isinstance(data_matrix, np.memmap)
+        assert data_matrix.dtype == np.float32
+        assert np.allclose(data_matrix, data['dataMatrix'])
+        assert np.array_equal(loaded['targetsVec'], data['targetsVec'].reshape((-1,)))
+        assert np.array_equal(loaded['videoLengthVec'], vidlens)
+        assert loaded['videoOffsetVec'][3] == np.sum(vidlens[:3])
+        # no copy is made for float32 data
+        assert data_matrix.astype('float32', copy=False) is data_matrix
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import scipy.io as sio
+from utils.dbn import *
+
+
+class TestDBNPretraining(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        prototypes = rng.uniform(size=(4, 20)) > 0.5
+        self.X = prototypes[rng.randint(0, 4, size=500)].astype('float32')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_train_rbm(self):
+        params = dbn_params_init(['sigm'], [10], epochs=6, batchsize=20)
+        rbm = train_rbm(self.X, params, 10, ('sigm', 'sigm'), np.random.RandomState(1), verbose=False)
+        assert rbm['W'].shape == (20, 10)
+        assert rbm['errors'][-1] < rbm['errors'][0]
+
+    def test_minibatch_preprocess(self):
+        path = os.path.join(self.tmpdir, 'X.npy')
+        np.save(path, 2 * self.X)
+        params = dbn_params_init(['sigm', 'sigm'], [12, 4], epochs=2, batchsize=50)
+        expected = train_dbn(self.X, params, np.random.RandomState(1), verbose=False)
+        # scaling is applied to each minibatch read from the memmap, the hidden activations go to scratch files
+        rbms = train_dbn(np.load(path, mmap_mode='r'), params, np.random.RandomState(1), verbose=False,
+                         preprocess=lambda batch: batch * np.float32(0.5), scratch_dir=self.tmpdir)
+        for a, b in zip(expected, rbms):
+            assert np.allclose(a['W'], b['W'])
+        assert os.listdir(self.tmpdir) == ['X.npy']
+
+    def test_save_ae_format(self):
+        path = os.path.join(self.tmpdir, 'ae.npy')
+        np.save(path, self.X)
+        params = dbn_params_init(['sigm', 'linear'], [12, 4], epochs=2, batchsize=50)
+        # minibatches are read from a memory-mapped array
+        rbms = train_dbn(np.load(path, mmap_mode='r'), params, np.random.RandomState(1), verbose=False)
+        weights, biases = unfold_dbn_to_ae(rbms)
+        save_ae(weights, biases, os.path.join(self.tmpdir, 'ae.mat'))
+        nn = sio.loadmat(os.path.join(self.tmpdir, 'ae.mat'))
+        shapes = [(20, 12), (12, 4), (4, 12), (12, 20)]
+        for i, shape in enumerate(shapes):
+            assert nn['w{}'.format(i + 1)].shape == shape
+            # biases are read back as nn['bN'][0] by load_decoder
+            assert nn['b{}'.format(i + 1)][0].shape == (shape[1],)
+
+
+if __name__ == '__main__':
+    unittest.main()
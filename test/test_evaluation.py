@@ -0,0 +1,91 @@
+import unittest
+import numpy as np
+from utils.evaluation import *
+
+
+def loop_majority_vote(output, y_val, mask_val):
+    num_classes = output.shape[-1]
+    confusion_matrix = np.zeros((num_classes, num_classes), dtype='int')
+    ix = np.zeros((output.shape[0],), dtype='int')
+    seq_lens = np.sum(mask_val, axis=-1)
+    votes = np.zeros((num_classes,), dtype='int')
+    for i, eg in enumerate(output):
+        predictions = np.argmax(eg[:seq_lens[i]], axis=-1)
+        for cls in range(num_classes):
+            votes[cls] = (predictions == cls).sum(axis=-1)
+        ix[i] = np.argmax(votes)
+    for i, target in enumerate(y_val):
+        confusion_matrix[target, ix[i]] += 1
+    return np.sum(ix == y_val) / float(len(y_val)), confusion_matrix
+
+
+class TestMajorityVote(unittest.TestCase):
+    def test_matches_loop(self):
+        rng = np.random.RandomState(0)
+        seqlens = rng.randint(1, 15, size=40)
+        # few classes so ties between votes are common
+        output = rng.rand(40, 15, 4).astype('float32')
+        mask = (np.arange(15) < seqlens[:, np.newaxis]).astype('uint8')
+        # padded frames must not vote
+        output[~mask.astype(bool), 3] = 10
+        y = rng.randint(0, 4, size=40).astype('uint8')
+        cr, conf = evaluate_majority_vote(output, y, mask)
+        expected_cr, expected_conf = loop_majority_vote(output, y, mask)
+        assert cr == expected_cr
+        assert np.array_equal(conf, expected_conf)
+        assert np.sum(conf) == 40
+
+    def test_evaluate_model2(self):
+        output = np.zeros((2, 3, 3), dtype='float32')
+        output[0, :, 2] = 1
+        output[1, :2, 1] = 1
+        mask = np.array([[1, 1, 1], [1, 1, 0]], dtype='uint8')
+        cr, conf = evaluate_model2([mask], np.array([2, 0]), mask, lambda m: output)
+        assert cr == 0.5
+        assert conf[2, 2] == 1 and conf[0, 1] == 1
+
+
+class TestChunkedEvaluation(unittest.TestCase):
+    def test_matches_whole_split(self):
+        rng = np.random.RandomState(1)
+        seqlens = rng.randint(1, 12, size=37)
+        X = rng.randn(np.sum(seqlens), 5).astype('float32')
+        X2 = rng.randn(np.sum(seqlens), 2).astype('float32')
+        y = np.repeat(rng.randint(0, 5, size=37), seqlens)
+        W = rng.randn(5, 5).astype('float32')
+
+        def eval_fn(X_batch, X2_batch, mask, scale):
+            # per frame scores, so padding a chunk differently does not change the output
+            return np.exp(scale * np.dot(X_batch, W) + X2_batch[:, :, :1])
+
+        def cost_fn(X_batch, X2_batch, targets, mask, scale):
+            output = eval_fn(X_batch, X2_batch, mask, scale)
+            frame_cost = -np.log(np.take_along_axis(output, targets[:, :, np.newaxis].astype(int), -1)[:, :, 0])
+            return np.sum(frame_cost * mask) / np.sum(mask)
+
+        integral_lens = np.concatenate([[0], np.cumsum(seqlens)[:-1]])
+        mask = (np.arange(np.max(seqlens)) < seqlens[:, np.newaxis]).astype('uint8')
+        X_batch = np.zeros(mask.shape + (5,), dtype='float32')
+        X2_batch = np.zeros(mask.shape + (2,), dtype='float32')
+        X_batch[mask.astype(bool)] = X
+        X2_batch[mask.astype(bool)] = X2
+        y_video = y[integral_lens]
+        targets = y_video.reshape((-1, 1)).repeat(mask.shape[-1], axis=-1)
+        expected_cr, expected_conf = evaluate_majority_vote(eval_fn(X_batch, X2_batch, mask, 0.5), y_video, mask)
+        expected_cost = cost_fn(X_batch, X2_batch, targets, mask, 0.5)
+        for chunksize in [1, 4, 100]:
+            cr, conf, cost = evaluate_model_chunked([X, X2], y, seqlens, eval_fn, cost_fn, [0.5], chunksize)
+            assert cr == expected_cr
+            assert np.array_equal(conf, expected_conf)
+            assert np.isclose(cost, expected_cost, rtol=1e-5)
+        cr, conf, cost = evaluate_model_chunked([X, X2], y, seqlens, eval_fn, extra_inputs=[0.5], chunksize=8)
+        assert cr == expected_cr and cost is None
+
+    def test_eval_chunks(self):
+        seqlens = np.array([5, 2, 9, 2, 7])
+        chunks = gen_eval_chunks(seqlens, chunksize=2)
+        assert [c.tolist() for c in chunks] == [[1, 3], [0, 4], [2]]
+
+
+if __name__ == '__main__':
+    unittest.main()
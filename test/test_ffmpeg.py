@@ -0,0 +1,81 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+from utils.ffmpeg import *
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ffprobe_frames_compact.txt')
+
+# stand-in ffprobe for a damaged video, far more decode errors on stderr than a pipe buffer holds
+NOISY_FFPROBE = """#!{}
+import sys
+for i in range(5000):
+    sys.stderr.write('[h264 @ 0x1] error while decoding MB 12 7, bytestream -5\\n')
+for line in open({!r}):
+    sys.stdout.write(line)
+sys.exit(int(sys.argv[-1] == 'missing.mpg'))
+"""
+
+
+class TestFFProbeParser(unittest.TestCase):
+    def test_parse_compact_fixture(self):
+        # read in binary as from the ffprobe pipe
+        with open(FIXTURE, 'rb') as f:
+            times = parse_ffprobe_frame_times(f)
+        video_times = times['video']
+        audio_times = times['audio']
+        assert video_times.dtype == np.float64
+        assert len(video_times) == 12 and len(audio_times) == 17
+        assert np.isclose(video_times[0], 130.507411)
+        assert np.isnan(video_times[5])
+        assert np.allclose(np.diff(np.delete(video_times, [4, 5, 6])[:4]), 0.033367, atol=1e-6)
+        assert np.all(np.diff(audio_times) > 0)
+
+    def test_pts_time_and_other_sections(self):
+        lines = ['frame|media_type=video|pts_time=0.040000\n',
+                 'side_data|side_data_type=GOP timecode\n',
+                 'frame|media_type=video|pts_time=0.080000|pkt_pts_time=N/A\n',
+                 '\n']
+        times = parse_ffprobe_frame_times(lines, time_keys=('pts_time', 'pkt_pts_time'))
+        assert list(times.keys()) == ['video']
+        assert np.allclose(times['video'], [0.04, 0.08])
+
+    def test_command(self):
+        command = ffprobe_frames_command('s01.mpg')
+        assert command[0] == 'ffprobe' and command[-1] == 's01.mpg'
+        assert 'frame=media_type,pkt_pts_time,pts_time' in command
+
+
+class TestFFProbeSubprocess(unittest.TestCase):
+    def setUp(self):
+        self.bin_dir = tempfile.mkdtemp()
+        path = os.path.join(self.bin_dir, 'ffprobe')
+        with open(path, 'w') as f:
+            f.write(NOISY_FFPROBE.format(sys.executable, FIXTURE))
+        os.chmod(path, 0o755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.bin_dir + os.pathsep + self.path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.bin_dir)
+
+    def test_stderr_does_not_block(self):
+        result = []
+        worker = threading.Thread(target=lambda: result.append(ffprobe_video('damaged.mpg')))
+        worker.daemon = True
+        worker.start()
+        worker.join(60)
+        assert not worker.is_alive(), 'ffprobe_video deadlocked on a full stderr pipe'
+        audio_times, video_times = result[0]
+        assert len(video_times) == 12 and len(audio_times) == 17
+
+    def test_error_exit(self):
+        self.assertRaises(IOError, ffprobe_frame_times, 'missing.mpg')
+
+
+if __name__ == '__main__':
+    unittest.main()
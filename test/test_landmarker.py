@@ -0,0 +1,111 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import warnings
+import numpy as np
+from menpo.image import Image
+from menpo.shape import bounding_box
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'landmarking'))
+import landmarker_omp
+from landmarker_omp import ImageFitter
+
+
+class FakeDetector(object):
+    """
+    detects the bright square drawn by face_frame, records the shape of each image it searched
+    """
+    def __init__(self):
+        self.searched = []
+
+    def __call__(self, image, image_diagonal=None):
+        self.searched.append(image.shape)
+        ys, xs = np.nonzero(image.pixels[0] > 0.5)
+        if len(ys) == 0:
+            return []
+        return [bounding_box([ys.min(), xs.min()], [ys.max(), xs.max()])]
+
+
+class FakeFittingResult(object):
+    def __init__(self, final_shape):
+        self.final_shape = final_shape
+
+
+class FakeFitter(object):
+    """
+    like the shape predictor, always fits a shape inside its initial box, whether or not a face is there
+    """
+    def fit_from_bb(self, image, bbox):
+        return FakeFittingResult(bbox)
+
+
+def face_frame(top_left=None, size=20, shape=(100, 120)):
+    pixels = np.zeros(shape)
+    if top_left is not None:
+        pixels[top_left[0]:top_left[0] + size, top_left[1]:top_left[1] + size] = 1.
+    return Image(pixels)
+
+
+class TestImageFitterTracking(unittest.TestCase):
+    def setUp(self):
+        self.detector = FakeDetector()
+        self.loaders = landmarker_omp.load_dlib_frontal_face_detector, landmarker_omp.DlibWrapper
+        landmarker_omp.load_dlib_frontal_face_detector = lambda: self.detector
+        landmarker_omp.DlibWrapper = lambda model: FakeFitter()
+        self.fitter = ImageFitter('model.dat', tracking=True, keyframe_interval=30)
+
+    def tearDown(self):
+        landmarker_omp.load_dlib_frontal_face_detector, landmarker_omp.DlibWrapper = self.loaders
+
+    def fit(self, frame):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            image = self.fitter.fit_image(frame)
+        searched = self.detector.searched
+        self.detector.searched = []
+        return image, searched
+
+    def test_tracks_in_window(self):
+        _, searched = self.fit(face_frame((20, 30)))
+        assert searched == [(100, 120)]
+        image, searched = self.fit(face_frame((22, 33)))
+        # only a window around the previous face is searched
+        assert len(searched) == 1 and searched[0][0] < 100 and searched[0][1] < 120
+        min_b, max_b = image.landmarks['final_shape'].bounds()
+        assert np.allclose(min_b, [22, 33]) and np.allclose(max_b, [41, 52])
+
+    def test_redetects_lost_face(self):
+        self.fit(face_frame((20, 30)))
+        # the face leaves the tracking window, it is found again by whole frame detection
+        image, searched = self.fit(face_frame((70, 90)))
+        assert len(searched) == 2 and searched[-1] == (100, 120)
+        min_b, _ = image.landmarks['final_shape'].bounds()
+        assert np.allclose(min_b, [70, 90])
+        # no face at all, no landmarks are written although the fitter would fit any box
+        image, searched = self.fit(face_frame())
+        assert searched[-1] == (100, 120)
+        assert 'final_shape' not in image.landmarks
+
+
+class TestWrittenFileMode(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.umask = os.umask(0o022)
+
+    def tearDown(self):
+        os.umask(self.umask)
+        shutil.rmtree(self.dir)
+
+    def test_files_follow_umask(self):
+        # temporary files are created 0600, the renamed files are readable like any other output
+        landmarks = os.path.join(self.dir, 'video.csv')
+        manifest = os.path.join(self.dir, 'manifest.json')
+        landmarker_omp.write_landmarks(landmarks, [])
+        landmarker_omp.save_manifest(dict(), manifest)
+        assert os.stat(landmarks).st_mode & 0o777 == 0o644
+        assert os.stat(manifest).st_mode & 0o777 == 0o644
+
+
+if __name__ == '__main__':
+    unittest.main()
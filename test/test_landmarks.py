@@ -0,0 +1,64 @@
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from utils.landmarks import *
+
+
+class TestLandmarkStore(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.tmpdir = tempfile.mkdtemp()
+        self.videos = ['s1/v1', 's2/v1', 's2/v2']
+        self.landmarks = []
+        self.valid = []
+        self.files = []
+        for i, vidlen in enumerate([5, 1, 9]):
+            landmarks = (rng.rand(vidlen, 68, 2) * 100).astype('float32')
+            valid = rng.rand(vidlen) > 0.3
+            path = os.path.join(self.tmpdir, '{}.csv'.format(i))
+            # rows written as the landmarkers do, -1s when no face was detected
+            with open(path, 'w') as f:
+                writer = csv.writer(f)
+                for frame_no in range(vidlen):
+                    row = landmarks[frame_no].reshape((136,)).tolist() if valid[frame_no] else [-1] * 136
+                    writer.writerow([frame_no] + row)
+            landmarks[~valid] = 0
+            self.landmarks.append(landmarks)
+            self.valid.append(valid)
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_convert_csv_to_store(self):
+        store_path = os.path.join(self.tmpdir, 'store')
+        convert_csv_to_store(self.files, store_path, self.videos)
+        store = load_landmark_store(store_path)
+        assert isinstance(store['landmarks'], np.memmap)
+        assert store['landmarks'].shape == (15, 68, 2) and store['landmarks'].dtype == np.float32
+        for i, video in enumerate(self.videos):
+            landmarks, valid = get_video_landmarks(store, video)
+            assert np.array_equal(valid, self.valid[i])
+            assert np.allclose(landmarks, self.landmarks[i], atol=1e-4)
+        landmarks, valid = get_video_landmarks(store, 's2/v2', 3, 6)
+        assert np.allclose(landmarks, self.landmarks[2][3:6], atol=1e-4)
+        assert np.array_equal(valid, self.valid[2][3:6])
+        # ranges are clipped to the video
+        assert len(get_video_landmarks(store, 2, 7, 20)[0]) == 2
+        assert len(get_video_landmarks(store, 's2/v1', 4)[0]) == 0
+
+    def test_save_landmark_store(self):
+        store_path = os.path.join(self.tmpdir, 'store')
+        save_landmark_store(self.videos, self.landmarks, self.valid, store_path)
+        store = load_landmark_store(store_path)
+        assert np.array_equal(store['videoLengthVec'], [5, 1, 9])
+        assert np.array_equal(store['videoOffsetVec'], [0, 5, 6])
+        landmarks, valid = get_video_landmarks(store, 's1/v1', 1, 3)
+        assert np.array_equal(landmarks, self.landmarks[0][1:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
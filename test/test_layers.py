@@ -0,0 +1,25 @@
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+from lasagne.layers import InputLayer, get_output
+from custom.layers import DeltaLayer
+
+
+class TestDeltaLayer(unittest.TestCase):
+    def test_conv_matches_scan(self):
+        X = T.tensor3('X', dtype='float32')
+        window = T.iscalar('window')
+        l_in = InputLayer((None, None, 5), X)
+        scan_fn = theano.function([X, window], get_output(DeltaLayer(l_in, window, mode='scan')))
+        conv_fn = theano.function([X, window], get_output(DeltaLayer(l_in, window, mode='conv')))
+        x = np.random.RandomState(0).randn(3, 11, 5).astype('float32')
+        for w in [1, 2, 4]:
+            expected = scan_fn(x, w)
+            actual = conv_fn(x, w)
+            assert actual.shape == (3, 11, 15)
+            assert np.allclose(actual, expected, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
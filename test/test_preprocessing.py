@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 from utils.io import *
 from utils.preprocessing import *
@@ -67,5 +70,170 @@ class TestPreprocessingMethods(unittest.TestCase):
         assert len(a[0][1]) == len(a[1][1]) == len(a[2][1]) == len(a[3][1])
         assert len(a[0][2]) == len(a[1][2]) == len(a[2][2]) == len(a[3][2])
 
+    def test_force_align_modes(self):
+        x1 = np.arange(7).reshape((7, 1))
+        x2 = np.arange(10, 17).reshape((7, 1))
+        s1, s2 = force_align((x1, x1[:, 0], np.array([2, 5])), (x2, x2[:, 0], np.array([4, 3])))
+        assert np.array_equal(s1[0][:, 0], [0, 1, 1, 1, 2, 3, 4, 5, 6])
+        assert np.array_equal(s2[0][:, 0], [10, 11, 12, 13, 14, 15, 16, 16, 16])
+        assert np.array_equal(s1[2], [4, 5]) and np.array_equal(s2[2], [4, 5])
+        s1, s2 = force_align((x1, x1[:, 0], np.array([2, 5])), (x2, x2[:, 0], np.array([4, 3])), mode='discard')
+        assert np.array_equal(s1[0][:, 0], [0, 1, 2, 3, 4])
+        assert np.array_equal(s2[1], [10, 11, 14, 15, 16])
+        assert np.array_equal(s1[2], [2, 3]) and np.array_equal(s2[2], [2, 3])
+
+    def test_embed_temporal_info(self):
+        X = np.arange(9).reshape((9, 1))
+        targets = np.repeat([1, 2], [3, 6])
+        res, res_targets, res_len = embed_temporal_info(X, targets, np.array([3, 6]), 2, 3)
+        # windows centered every 3 frames, repeating the first and last frame of each sequence
+        assert np.array_equal(res, [[0, 0, 1, 2, 2], [3, 3, 4, 5, 6], [5, 6, 7, 8, 8]])
+        assert np.array_equal(res_targets, [1, 2, 2])
+        assert np.array_equal(res_len, [1, 2])
+        chunks = list(gen_embed_temporal_info(X, targets, np.array([3, 6]), 2, 3, seqs_per_chunk=1))
+        assert np.array_equal(np.concatenate([c[0] for c in chunks]), res)
+
+    def test_factorize(self):
+        lens = np.array([4, 7, 3])
+        X = np.arange(14)
+        res, res_targets, res_len = factorize(X, X, lens, 3, 0)
+        assert np.array_equal(res_len, [3, 6, 3])
+        assert len(res) == 12 and np.array_equal(res[:, 0], res_targets)
+        # removed frames come from the sequences that were not a multiple of 3
+        assert np.array_equal(np.bincount(np.repeat(np.arange(3), lens)[res_targets]), res_len)
+
+    def test_segmentwise_image_processing(self):
+        rng = np.random.RandomState(0)
+        vidlens = np.array([4, 1, 0, 7, 2])
+        X = rng.rand(np.sum(vidlens), 6).astype('float32')
+        mean_removed = sequencewise_mean_image_subtraction(X, vidlens)
+        diff = compute_diff_images(X, vidlens)
+        start = 0
+        for l in vidlens[vidlens > 0]:
+            seq = X[start:start + l]
+            assert np.allclose(mean_removed[start:start + l], seq - seq.mean(0), atol=1e-6)
+            if l > 1:
+                assert np.allclose(diff[start + 1:start + l], np.diff(seq, 1, 0))
+                assert np.allclose(diff[start], seq[1] - seq[0])
+            start += l
+        assert np.all(diff[4] == 0)
+        normalized = normalize_input(X.copy())
+        assert np.allclose(normalized.mean(1), 0, atol=1e-6) and np.allclose(normalized.std(1), 1, atol=1e-5)
+        # in place variants write into the input
+        X_copy = X.copy()
+        assert compute_diff_images(X_copy, vidlens, inplace=True) is X_copy
+        assert np.array_equal(X_copy, diff)
+
+    def test_resize_image_stack(self):
+        rng = np.random.RandomState(0)
+        images = rng.rand(25, 6, 8).astype('float32')
+        flattened = np.array([image.reshape((-1,), order='F') for image in images])
+        resized = resize_image_stack(flattened, (6, 8), (3, 4), chunksize=4, workers=2)
+        assert resized.dtype == np.float32 and resized.shape == (25, 12)
+        # chunked parallel resize matches resizing each image, output is in 'c' format
+        for image, res in zip(images, resized):
+            assert np.allclose(res.reshape((3, 4)), ndimage.zoom(image, 0.5, order=1))
+        stack = resize_image_stack(images, (6, 8), (3, 4), reshape=False, interp='nearest')
+        assert stack.shape == (25, 3, 4)
+
+    def test_zca_whitening(self):
+        rng = np.random.RandomState(0)
+        X = (rng.randn(3000, 8).dot(rng.randn(8, 8)) + 2).astype('float32')
+        zca = fit_zca(X, epsilon=1e-6, chunksize=700)
+        whitened = apply_zca(X, zca, chunksize=500)
+        assert whitened.dtype == np.float32
+        assert np.allclose(np.cov(whitened.T, bias=True), np.eye(8), atol=1e-3)
+        # ZCA matrix is symmetric
+        assert np.allclose(zca['zca'], zca['zca'].T)
+
+    def test_zca_cache_refits_on_other_data(self):
+        rng = np.random.RandomState(0)
+        X = rng.randn(500, 6).astype('float32')
+        path = os.path.join(tempfile.mkdtemp(), 'zca.npz')
+        try:
+            zca = load_or_fit_zca(X, path, chunksize=200)
+            assert np.array_equal(load_or_fit_zca(X, path, chunksize=200)['zca'], zca['zca'])
+            # same shape, differently preprocessed data is not whitened with the cached transform
+            X_meanremoved = X - X.mean(1, keepdims=True)
+            refitted = load_or_fit_zca(X_meanremoved, path, chunksize=200)
+            assert np.allclose(refitted['mean'], X_meanremoved.mean(0), atol=1e-6)
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_split_seq_data(self):
+        rng = np.random.RandomState(0)
+        subjects = np.repeat(np.arange(1, 7), 3)
+        vidlens = rng.randint(3, 9, size=len(subjects))
+        X = rng.randn(np.sum(vidlens), 5).astype('float32')
+        y = np.repeat(np.arange(len(subjects)), vidlens)
+
+        train_X, train_y, train_vidlens, train_subjects, \
+        val_X, val_y, val_vidlens, val_subjects, \
+        test_X, test_y, test_vidlens, test_subjects = split_seq_data([X, 2 * X], y, subjects, vidlens,
+                                                                     [1, 2], [4], [3, 5])
+        assert np.array_equal(train_subjects, [1, 1, 1, 2, 2, 2])
+        assert np.array_equal(val_vidlens, vidlens[9:12])
+        # subjects not in train or val go to the test split
+        assert np.array_equal(test_subjects, [3, 3, 3, 5, 5, 5, 6, 6, 6])
+        assert np.array_equal(test_y, np.repeat(np.r_[6:9, 12:18], vidlens[np.r_[6:9, 12:18]]))
+        assert len(train_X[0]) == np.sum(train_vidlens)
+        assert np.array_equal(train_X[1], 2 * train_X[0])
+        assert np.array_equal(test_X[0][-np.sum(vidlens[15:]):], X[np.sum(vidlens[:15]):])
+
+    def test_split_multistream_data(self):
+        rng = np.random.RandomState(0)
+        subjects = np.repeat(np.arange(1, 5), 2)
+        vidlens = rng.randint(3, 9, size=len(subjects))
+        y = np.repeat(np.arange(len(subjects)), vidlens)
+        streams = [rng.randn(np.sum(vidlens), d).astype('float32') for d in (4, 7, 2)]
+
+        train, val, test = split_multistream_data(streams, y, subjects, vidlens, [1, 3], [2], [4])
+        expected = split_seq_data(streams[1], y, subjects, vidlens, [1, 3], [2], [4])
+        assert len(train['X']) == 3
+        assert np.array_equal(train['X'][1], expected[0])
+        assert np.array_equal(val['y'], expected[5])
+        assert np.array_equal(test['vidlens'], expected[10])
+        assert np.array_equal(test['subjects'], [4, 4])
+
+    def test_concat_first_second_deltas(self):
+        rng = np.random.RandomState(0)
+        vidlens = rng.randint(2, 20, size=30)
+        X = rng.randn(np.sum(vidlens), 8)
+        for w in (3, 5, 9):
+            Y = concat_first_second_deltas(X, vidlens, w)
+            # reference: per sequence deltas
+            start = 0
+            for l in vidlens:
+                seq = X[start:start + l]
+                first_order = deltas(seq.T, w)
+                second_order = deltas(first_order, w)
+                expected = np.concatenate((seq, first_order.T, second_order.T), axis=1)
+                assert np.allclose(Y[start:start + l], expected)
+                start += l
+
+    def test_zigzag_dct_features(self):
+        rng = np.random.RandomState(0)
+        for shape in [(3, 4), (2, 6), (6, 5)]:
+            image = rng.randn(*shape)
+            assert np.array_equal(image.ravel()[zigzag_idxs(shape)], zigzag(image))
+        X = rng.randn(20, 30)
+        dct = compute_dct_features(X, (5, 6), no_coeff=10)
+        X_dct = fft.dct(X, norm='ortho')
+        for i in range(len(X)):
+            assert np.array_equal(dct[i], zigzag(X_dct[i].reshape((5, 6)))[1:11])
+
+    def test_compute_dct2_features(self):
+        rng = np.random.RandomState(0)
+        X = rng.randn(53, 5, 6)
+        X_dct = fft.dct(fft.dct(X, axis=1, norm='ortho'), axis=2, norm='ortho').reshape((53, -1))
+        # chunked features match the whole stack transformed at once
+        dct = compute_dct2_features(X.reshape((53, -1)), (5, 6), no_coeff=10, chunksize=7)
+        assert np.allclose(dct, X_dct[:, zigzag_idxs((5, 6))[1:11]])
+        for method in ('variance', 'energy'):
+            score = np.std(X_dct[:, 1:], 0) if method == 'variance' else np.sum(np.abs(X_dct[:, 1:]), 0)
+            expected = X_dct[:, 1:][:, np.argsort(score)[::-1][:10]]
+            assert np.allclose(compute_dct2_features(X, (5, 6), 10, method, chunksize=10), expected)
+
+
 if __name__ == '__main__':
     unittest.main()
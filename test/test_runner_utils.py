@@ -0,0 +1,29 @@
+import unittest
+from utils.runner_utils import *
+try:
+    import ConfigParser
+except ImportError:
+    import configparser as ConfigParser
+
+
+class TestStreamSections(unittest.TestCase):
+    def config(self, sections):
+        config = ConfigParser.RawConfigParser()
+        for section in sections:
+            config.add_section(section)
+        return config
+
+    def test_stream_sections(self):
+        config = self.config(['training', 'stream2', 'lstm_classifier', 'stream1', 'stream3'])
+        assert stream_sections(config) == ['stream1', 'stream2', 'stream3']
+        # the single and double stream runners use the first streams of the config
+        assert stream_sections(config, 1) == ['stream1']
+        assert stream_sections(config, 2) == ['stream1', 'stream2']
+        self.assertRaises(ValueError, stream_sections, config, 4)
+
+    def test_missing_stream_section(self):
+        self.assertRaises(ValueError, stream_sections, self.config(['stream1', 'stream3']))
+
+
+if __name__ == '__main__':
+    unittest.main()
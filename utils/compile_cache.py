@@ -0,0 +1,125 @@
+"""
+on-disk cache of compiled theano functions.
+compiled functions are pickled together with the network they were built from, so unpickling restores
+the same shared variables. theano does not reoptimize unpickled functions, loading skips graph optimization
+"""
+from __future__ import print_function
+import os
+import sys
+import hashlib
+import tempfile
+import theano
+import lasagne as las
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+def network_signature(network):
+    """
+    describe the topology of a network: layer types, output shapes, parameter shapes and
+    the scalar attributes of each layer, such as nonlinearities, peepholes or delta modes
+    :param network: output layer of a lasagne network
+    :return: signature string
+    """
+    lines = []
+    for layer in las.layers.get_all_layers(network):
+        attrs = []
+        for k, v in sorted(vars(layer).items()):
+            if k in ('name', 'params', 'input_layer', 'input_layers'):
+                continue
+            if isinstance(v, (bool, int, float, str, tuple)) or v is None:
+                attrs.append('{}={!r}'.format(k, v))
+            elif callable(v) and hasattr(v, '__name__'):
+                attrs.append('{}={}'.format(k, v.__name__))
+        params = ['{}{}'.format(p.name, p.get_value(borrow=True).shape) for p in layer.get_params()]
+        lines.append('{} {} {}'.format(type(layer).__name__, params, ' '.join(attrs)))
+    return '\n'.join(lines)
+
+
+def compile_cache_key(network, *extra):
+    """
+    cache key of the functions compiled for a network
+    :param network: output layer of a lasagne network
+    :param extra: anything else the compiled graph depends on, such as the optimizer or runner name
+    :return: hex digest
+    """
+    h = hashlib.sha1()
+    # functions compiled for another device, mode or graph optimizer must not be reused
+    config = [theano.config.floatX, theano.config.device, theano.config.mode, theano.config.optimizer]
+    for item in [theano.__version__, sys.version_info[:2]] + config + [network_signature(network)] + list(extra):
+        h.update(repr(item).encode('utf-8'))
+    return h.hexdigest()
+
+
+def load_compiled(cache_dir, key):
+    """
+    load cached compiled functions
+    :param cache_dir: cache directory
+    :param key: cache key, see compile_cache_key
+    :return: dict of cached objects or None if not cached
+    """
+    path = os.path.join(cache_dir, '{}.pkl'.format(key))
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_compiled(cache_dir, key, compiled):
+    """
+    atomically write compiled functions to the cache
+    :param cache_dir: cache directory
+    :param key: cache key, see compile_cache_key
+    :param compiled: dict of compiled functions and the shared variables they use
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, os.path.join(cache_dir, '{}.pkl'.format(key)))
+
+
+def reseed_random_streams(network):
+    """
+    reseed the random streams of the layers of a network, such as the dropout masks of DropoutLayer, from
+    lasagne's random generator. the compiled functions share the stream states, so unpickled functions
+    draw new masks rather than repeating those of the run that cached them
+    :param network: output layer of a lasagne network
+    """
+    for layer in las.layers.get_all_layers(network):
+        srng = getattr(layer, '_srng', None)
+        if srng is not None:
+            srng.seed(las.random.get_rng().randint(1, 2147462579))
+
+
+def compile_with_cache(network, compile_fn, cache_dir=None, *extra):
+    """
+    compile theano functions for a network, or load them from the cache.
+    compile_fn must return a dict holding the network under 'network' and the compiled functions,
+    any hyperparameter that should not invalidate the cache, such as the learning rate, must be a
+    shared variable in the dict. on a cache hit the current parameter values of network are copied into
+    the cached network, so fresh initializations and pretrained weights are kept, and its random streams are
+    reseeded from lasagne's random generator, so a seeded run gets its own dropout masks
+    :param network: output layer of the freshly built lasagne network
+    :param compile_fn: function compiling the network, called on a cache miss
+    :param cache_dir: cache directory, None disables caching
+    :param extra: anything else the compiled graph depends on, see compile_cache_key
+    :return: dict returned by compile_fn, use its 'network' in place of network
+    """
+    if cache_dir is None:
+        return compile_fn()
+    key = compile_cache_key(network, *extra)
+    compiled = load_compiled(cache_dir, key)
+    if compiled is None:
+        compiled = compile_fn()
+        # cache before training so optimizer state such as adam moments is stored at its initial value
+        save_compiled(cache_dir, key, compiled)
+        print('compiled functions cached as {}'.format(key))
+    else:
+        las.layers.set_all_param_values(compiled['network'], las.layers.get_all_param_values(network))
+        reseed_random_streams(compiled['network'])
+        print('compiled functions loaded from cache {}'.format(key))
+    return compiled
@@ -1,8 +1,232 @@
+import sys
+import threading
+from functools import partial
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from utils.io import load_mat_file
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 
-def gen_batch_from_file(X, y, seqlen, feature_len, batchsize=30, shuffle=True, datafieldname='dataMatrix'):
+def compute_integral_len(lengths):
+    """
+    compute integral lengths (start offsets) of the videos for fast offset access for data matrix
+    :param lengths: lengths of each video
+    :return: array of start offsets, same length as lengths
+    """
+    lengths = np.asarray(lengths, dtype='int64').reshape((-1,))
+    integral_lens = np.zeros((len(lengths),), dtype='int64')
+    np.cumsum(lengths[:-1], out=integral_lens[1:])
+    return integral_lens
+
+
+def gen_seq_mask(lens, max_timesteps, batchsize=None):
+    """
+    generate the input mask for a batch of variable length sequences
+    :param lens: lengths of the sequences in the batch
+    :param max_timesteps: padded length of the batch
+    :param batchsize: number of rows in the mask, defaults to len(lens). Extra rows are fully masked
+    :return: mask of shape (batchsize, max_timesteps), 1 for valid timesteps, 0 for padding
+    """
+    lens = np.asarray(lens).reshape((-1,))
+    if batchsize is None:
+        batchsize = len(lens)
+    mask = np.zeros((batchsize, max_timesteps), dtype='uint8')
+    mask[:len(lens)] = np.arange(max_timesteps) < lens[:, np.newaxis]
+    return mask
+
+
+def assemble_seq_batch(data, idxs, seqlens, integral_lens, max_timesteps, batchsize=None, dtype=None):
+    """
+    assemble a zero padded batch of sequences from a data matrix using a single gather
+    :param data: data matrix of shape (total frames, feature...)
+    :param idxs: indexes of the sequences to put in the batch
+    :param seqlens: lengths of all sequences in data
+    :param integral_lens: start offsets of all sequences in data, see compute_integral_len
+    :param max_timesteps: padded length of the batch
+    :param batchsize: number of rows in the batch, defaults to len(idxs). Extra rows are left as zeros
+    :param dtype: dtype of returned batch, defaults to data.dtype
+    :return: X_batch of shape (batchsize, max_timesteps, feature...), mask of shape (batchsize, max_timesteps)
+    """
+    X_batches, mask = assemble_multistream_batch([data], idxs, seqlens, integral_lens, max_timesteps, batchsize,
+                                                 dtype)
+    return X_batches[0], mask
+
+
+def assemble_multistream_batch(streams, idxs, seqlens, integral_lens, max_timesteps, batchsize=None, dtype=None):
+    """
+    assemble zero padded batches of the same sequences from several frame aligned data matrices.
+    the frame offsets are computed once and every stream is gathered with them
+    :param streams: list of data matrices of shape (total frames, feature...), one per stream
+    :param idxs: indexes of the sequences to put in the batch
+    :param seqlens: lengths of all sequences, shared by all streams
+    :param integral_lens: start offsets of all sequences, see compute_integral_len
+    :param max_timesteps: padded length of the batch
+    :param batchsize: number of rows in the batch, defaults to len(idxs). Extra rows are left as zeros
+    :param dtype: dtype of returned batches, defaults to the dtype of each stream
+    :return: list of X_batch of shape (batchsize, max_timesteps, feature...), one per stream,
+        mask of shape (batchsize, max_timesteps)
+    """
+    idxs = np.asarray(idxs, dtype='int64').reshape((-1,))
+    lens = np.asarray(seqlens)[idxs]
+    starts = np.asarray(integral_lens)[idxs]
+    mask = gen_seq_mask(lens, max_timesteps, batchsize)
+    # frame offsets of every valid timestep, gathered and scattered in one operation per stream
+    valid = mask[:len(idxs)].astype(bool)
+    frame_idxs = (starts[:, np.newaxis] + np.arange(max_timesteps))[valid]
+    X_batches = []
+    for data in streams:
+        X_batch = np.zeros(mask.shape + data.shape[1:], dtype=data.dtype if dtype is None else dtype)
+        X_batch[:len(idxs)][valid] = data[frame_idxs]
+        X_batches.append(X_batch)
+    return X_batches, mask
+
+
+def load_seq_file(file_path, datafieldname='dataMatrix'):
+    """
+    load a single sequence from a .mat file
+    :param file_path: path to .mat file
+    :param datafieldname: name of field containing data
+    :return: data as float32 (None if the file could not be read), error message (None if no error)
+    """
+    try:
+        return load_mat_file(file_path)[datafieldname].astype('float32'), None
+    except (IOError, ValueError, KeyError) as err:
+        return None, '{}'.format(err)
+
+
+def load_file_batch(files, idxs, seqlens, max_timesteps, feature_len, datafieldname='dataMatrix', pool=None):
+    """
+    load a zero padded batch of sequences from a list of .mat files
+    unreadable files are left as zeros and reported back in the order of idxs
+    :param files: file list containing file paths
+    :param idxs: indexes of files to load
+    :param seqlens: length of sequences
+    :param max_timesteps: maximum len of all sequences
+    :param feature_len: length of feature
+    :param datafieldname: name of field containing data
+    :param pool: optional worker pool used to read the files in parallel
+    :return: batch of size equal to length of indexes, list of (file path, error message)
+    """
+    paths = [files[seq_id] for seq_id in idxs]
+    load = partial(load_seq_file, datafieldname=datafieldname)
+    results = pool.map(load, paths) if pool is not None else [load(path) for path in paths]
+    X_batch = np.zeros((len(paths), max_timesteps, feature_len), dtype='float32')
+    errors = []
+    for i, (seq_id, (data, err)) in enumerate(zip(idxs, results)):
+        if err is not None:
+            errors.append((paths[i], err))
+            continue
+        vidlen = seqlens[seq_id]
+        X_batch[i, :vidlen] = data[:vidlen]
+    return X_batch, errors
+
+
+def report_file_errors(errors):
+    for file_path, err in errors:
+        print('Error reading file: {}, {}'.format(file_path, err))
+
+
+def reraise(exc_info):
+    """
+    raise an exception caught in another thread with its original traceback
+    :param exc_info: sys.exc_info() of the caught exception
+    """
+    if sys.version_info[0] >= 3:
+        raise exc_info[1].with_traceback(exc_info[2])
+    exec('raise exc_info[0], exc_info[1], exc_info[2]')
+
+
+# marks the end of the prefetched data
+_END = object()
+
+
+def gen_prefetch(datagen, depth=2, close=None, poll_interval=0.1):
+    """
+    run a data generator ahead in a background thread.
+    the thread stops when the returned generator is closed or garbage collected
+    :param datagen: data generator to prefetch from
+    :param depth: maximum number of ready items held in the queue
+    :param close: optional function called once the prefetching stops, e.g. to terminate a worker pool
+    :param poll_interval: seconds between checks for a stop while the queue is full
+    :return: generator yielding the items of datagen in order
+    """
+    ready = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                ready.put(entry, timeout=poll_interval)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for item in datagen:
+                if not put((item, None)):
+                    return
+            put((_END, None))
+        except Exception:
+            # hand the error over to the consumer, it is raised on the next item
+            put((None, sys.exc_info()))
+
+    worker = threading.Thread(target=producer)
+    worker.daemon = True
+    worker.start()
+    try:
+        while True:
+            item, exc_info = ready.get()
+            if exc_info is not None:
+                reraise(exc_info)
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+        # the producer finishes its current item before close releases the resources it may be using
+        worker.join()
+        if close is not None:
+            close()
+
+
+def gen_batch_from_file_prefetch(X, y, seqlen, feature_len, batchsize=30, shuffle=True, datafieldname='dataMatrix',
+                                 workers=4, depth=2):
+    """
+    prefetching version of gen_batch_from_file
+    batches are assembled in a background thread, reading the files of each batch with a pool of workers
+    :param X: input as a list of file names (in .mat format)
+    :param y: target as a list of classifications against the each input
+    :param seqlen: lengths of video
+    :param batchsize: size of batch (number of videos sequences)
+    :param shuffle: shuffle the input
+    :param datafieldname: name of field in dictionary that contains input data
+    :param workers: number of threads reading files
+    :param depth: number of ready batches to keep in the queue
+    :return: train, target, seqlen
+    """
+    # the pool is created on the first batch, so a generator that is never started holds no threads
+    pool = ThreadPool(workers)
+
+    def close_pool():
+        # the producer has stopped, so no reads are pending and the workers can be joined
+        pool.close()
+        pool.join()
+
+    batches = gen_prefetch(gen_batch_from_file(X, y, seqlen, feature_len, batchsize, shuffle, datafieldname, pool),
+                           depth, close=close_pool)
+    try:
+        for batch in batches:
+            yield batch
+    finally:
+        batches.close()
+
+
+def gen_batch_from_file(X, y, seqlen, feature_len, batchsize=30, shuffle=True, datafieldname='dataMatrix', pool=None):
     """
     randomized data generator for training data from list of file paths
     :param X: input as a list of file names (in .mat format)
@@ -11,6 +235,7 @@ def gen_batch_from_file(X, y, seqlen, feature_len, batchsize=30, shuffle=True, d
     :param batchsize: size of batch (number of videos sequences)
     :param shuffle: shuffle the input
     :param datafieldname: name of field in dictionary that contains input data
+    :param pool: optional worker pool used to read the files in parallel
     :return: train, target, seqlen
     """
     len_X = len(seqlen)
@@ -34,23 +259,10 @@ def gen_batch_from_file(X, y, seqlen, feature_len, batchsize=30, shuffle=True, d
             reset = True
             # end_idx = batchsize - (len_X - start_idx)
             # batch_idxs = batch_idxs.append(shuffle_idxs[start_idx:end_idx])
-        bsize = len(batch_idxs)
-        X_batch = np.zeros((bsize, max_timesteps, feature_len), dtype='float32')  # returned batch input
-        y_batch = np.zeros((bsize,), dtype='uint8')
-        mask = np.zeros((bsize, max_timesteps), dtype='uint8')
-
-        for i, video_idx in enumerate(batch_idxs):
-            file_path = X[video_idx]
-            try:
-                data = load_mat_file(file_path)[datafieldname].astype('float32')
-            except ValueError as err:
-                print('Error reading file: {}, {}'.format(file_path, err.message))
-                data = np.zeros((max_timesteps, feature_len), dtype='float32')
-            vidlen = seqlen[video_idx]
-            X_batch[i] = np.concatenate([data, np.zeros((max_timesteps - vidlen, feature_len))])
-            y_batch[i] = y[video_idx]
-            mask[i, :vidlen] = 1  # set 1 for length of video
-            mask[i, vidlen:] = 0  # set 0 for rest of video
+        X_batch, errors = load_file_batch(X, batch_idxs, seqlen, max_timesteps, feature_len, datafieldname, pool)
+        report_file_errors(errors)
+        y_batch = np.asarray(y)[batch_idxs].astype('uint8')
+        mask = gen_seq_mask(np.asarray(seqlen)[batch_idxs], max_timesteps)
         if reset:
             start_idx = 0
             reset = False
@@ -73,9 +285,7 @@ def gen_lstm_seq_random(X, y, seqlen):
     :return: x_train, y_target
     """
     # compute integral lengths of the video for fast offset access for data matrix
-    integral_lens = [0]
-    for i in range(1, len(seqlen)):
-        integral_lens.append(integral_lens[i - 1] + seqlen[i - 1])
+    integral_lens = compute_integral_len(seqlen)
 
     while True:
         # permutate the video sequences for each batch
@@ -102,15 +312,12 @@ def gen_lstm_batch_random(X, y, seqlen, batchsize=30, shuffle=True):
     """
     # find the max len of all videos for creating the mask
     max_timesteps = np.max(seqlen)
-    feature_len = X.shape[1]
     no_videos = len(seqlen)
     start_video = 0
     reset = False
 
     # compute integral lengths of the video for fast offset access for data matrix
-    integral_lens = [0]
-    for i in range(1, len(seqlen)):
-        integral_lens.append(integral_lens[i-1] + seqlen[i - 1])
+    integral_lens = compute_integral_len(seqlen)
 
     # permutate the video sequences for each batch
     if shuffle:
@@ -125,21 +332,9 @@ def gen_lstm_batch_random(X, y, seqlen, batchsize=30, shuffle=True):
             reset = True
         else:
             batch_video_idxs = randomized[start_video:end_video]
-        bsize = len(batch_video_idxs)
-        X_batch = np.zeros((bsize, max_timesteps, feature_len), dtype=X.dtype)  # returned batch input
-        y_batch = np.zeros((bsize,), dtype='uint8')
-        mask = np.zeros((bsize, max_timesteps), dtype='uint8')
-
         # populate the batch X and batch y
-        for i, idx in enumerate(batch_video_idxs):
-            start = integral_lens[idx]
-            l = seqlen[idx]
-            end = start + l
-            X_batch[i] = np.concatenate([X[start:end],
-                                         np.zeros((max_timesteps - l, feature_len))])
-            y_batch[i] = y[start]
-            mask[i, :l] = 1  # set 1 for length of video
-            mask[i, l:] = 0  # set 0 for rest of video
+        X_batch, mask = assemble_seq_batch(X, batch_video_idxs, seqlen, integral_lens, max_timesteps)
+        y_batch = y[integral_lens[batch_video_idxs]].astype('uint8')
         if reset:
             # permutate the new video sequences for each batch
             if shuffle:
@@ -153,6 +348,107 @@ def gen_lstm_batch_random(X, y, seqlen, batchsize=30, shuffle=True):
         yield X_batch, y_batch, mask, batch_video_idxs
 
 
+def compute_padding_ratio(seqlen, batches, max_timesteps=None):
+    """
+    compute the fraction of padded timesteps over a list of batches
+    :param seqlen: lengths of video
+    :param batches: list of video idxs per batch
+    :param max_timesteps: pad every batch to this length, defaults to the batch-local max
+    :return: padded timesteps / total timesteps
+    """
+    seqlen = np.asarray(seqlen)
+    total = 0
+    padded = 0
+    for batch_idxs in batches:
+        lens = seqlen[batch_idxs]
+        batch_timesteps = np.max(lens) if max_timesteps is None else max_timesteps
+        total += len(lens) * batch_timesteps
+        padded += len(lens) * batch_timesteps - np.sum(lens)
+    return padded / float(total) if total else 0.0
+
+
+def bucket_batch_idxs(seqlen, batchsize=30, bucketsize=10, shuffle=True):
+    """
+    group videos of similar length into batches
+    videos are split into buckets of batchsize * bucketsize videos, each bucket is sorted by
+    length and cut into batches, so each batch only holds videos of similar length
+    :param seqlen: lengths of video
+    :param batchsize: number of videos per batch
+    :param bucketsize: number of batches per bucket, None sorts all videos as a single bucket
+    :param shuffle: shuffle the videos before bucketing and the order of the batches
+    :return: list of video idxs per batch
+    """
+    seqlen = np.asarray(seqlen)
+    no_videos = len(seqlen)
+    order = np.random.permutation(no_videos) if shuffle else np.arange(no_videos)
+    pool = no_videos if bucketsize is None else batchsize * bucketsize
+    batches = []
+    for start in range(0, no_videos, pool):
+        bucket = order[start:start + pool]
+        # stable sort keeps the shuffled order between videos of equal length
+        bucket = bucket[np.argsort(seqlen[bucket], kind='mergesort')]
+        batches += [bucket[i:i + batchsize] for i in range(0, len(bucket), batchsize)]
+    if shuffle:
+        batches = [batches[i] for i in np.random.permutation(len(batches))]
+    return batches
+
+
+def gen_lstm_batch_bucketed(X, y, seqlen, batchsize=30, bucketsize=10, shuffle=True, verbose=True):
+    """
+    length-bucketed data generator for training data
+    creates an infinite loop of mini batches, each padded only to the longest video in the batch
+    :param X: input
+    :param y: target
+    :param seqlen: lengths of video
+    :param batchsize: number of videos per batch
+    :param bucketsize: number of batches per length bucket, None to sort the whole split
+    :param shuffle: shuffle the input
+    :param verbose: print the padding ratio saved at the start of each pass over the data
+    :return: x_train, y_target, input_mask, video idx used
+    """
+    # a single stream of the multistream generator, so both share the batch order and padding
+    datagen = gen_multistream_batch([X], y, seqlen, batchsize, bucketing=True, bucketsize=bucketsize, shuffle=shuffle,
+                                    verbose=verbose)
+    for X_batches, y_batch, mask, batch_video_idxs in datagen:
+        yield X_batches[0], y_batch, mask, batch_video_idxs
+
+
+def gen_multistream_batch(streams, y, seqlen, batchsize=30, bucketing=False, bucketsize=10, shuffle=True,
+                          verbose=True):
+    """
+    data generator for frame aligned streams of the same videos
+    creates an infinite loop of mini batches, all streams of a batch are assembled together
+    :param streams: list of data matrices, one per stream
+    :param y: target
+    :param seqlen: lengths of video, shared by all streams
+    :param batchsize: number of videos per batch
+    :param bucketing: pad each batch only to its longest video, see gen_lstm_batch_bucketed.
+        otherwise every batch is padded to the longest video, as gen_lstm_batch_random
+    :param bucketsize: number of batches per length bucket, None to sort the whole split
+    :param shuffle: shuffle the input
+    :param verbose: print the padding ratio saved at the start of each pass over the data when bucketing
+    :return: list of x_train per stream, y_target, input_mask, video idx used
+    """
+    seqlen = np.asarray(seqlen)
+    max_timesteps = np.max(seqlen)
+    integral_lens = compute_integral_len(seqlen)
+    while True:
+        if bucketing:
+            batches = bucket_batch_idxs(seqlen, batchsize, bucketsize, shuffle)
+            if verbose:
+                print('bucketed batches padding ratio: {:.3f} (unbucketed: {:.3f})'.format(
+                    compute_padding_ratio(seqlen, batches), compute_padding_ratio(seqlen, batches, max_timesteps)))
+        else:
+            order = np.random.permutation(len(seqlen)) if shuffle else np.arange(len(seqlen))
+            batches = [order[i:i + batchsize] for i in range(0, len(seqlen), batchsize)]
+        for batch_video_idxs in batches:
+            batch_timesteps = np.max(seqlen[batch_video_idxs]) if bucketing else max_timesteps
+            X_batches, mask = assemble_multistream_batch(streams, batch_video_idxs, seqlen, integral_lens,
+                                                         batch_timesteps)
+            y_batch = y[integral_lens[batch_video_idxs]].astype('uint8')
+            yield X_batches, y_batch, mask, batch_video_idxs
+
+
 def gen_lstm_batch_seq(X, y, seqlen, batchsize=30):
     """
     generate the next batch of training data
@@ -165,71 +461,46 @@ def gen_lstm_batch_seq(X, y, seqlen, batchsize=30):
     """
     # find the max len of all videos for creating the mask
     max_timesteps = np.max(seqlen)
-    feature_len = X.shape[1]
     no_videos = len(seqlen)
+    integral_lens = compute_integral_len(seqlen)
     start_video = 0
-    start_data = 0
     reset = False
     while True:
         end_video = start_video + batchsize
         if end_video > no_videos:
             # print('reached the end, restarting')
-            slice_step = int(np.sum(seqlen[start_video:]))
-            batch_vidlen = seqlen[start_video:]
+            batch_video_idxs = np.arange(start_video, no_videos)
             reset = True
         else:
-            slice_step = int(np.sum(seqlen[start_video:end_video]))
-            batch_vidlen = seqlen[start_video:end_video]
-        # print('slice step: {}'.format(slice_step))
-        # slice X, y according to the slice_step,
-        # track the index of the data
-        end_data = start_data + slice_step
-        batch_sequence = X[start_data:end_data]
-        batch_target = y[start_data:end_data]
-        X_batch = np.zeros((batchsize, max_timesteps, feature_len), dtype='float32')  # returned batch input
+            batch_video_idxs = np.arange(start_video, end_video)
+        # batches are always batchsize long, unused rows are left fully masked
+        X_batch, mask = assemble_seq_batch(X, batch_video_idxs, seqlen, integral_lens, max_timesteps,
+                                           batchsize=batchsize, dtype='float32')
         y_batch = np.zeros((batchsize,), dtype='uint8')
-        mask = np.zeros((batchsize, max_timesteps), dtype='uint8')
-        start = 0
-        for i, l in enumerate(batch_vidlen):
-            end = start + l
-            X_batch[i] = np.concatenate([batch_sequence[start:end],
-                                        np.zeros((max_timesteps-l, feature_len))])
-            y_batch[i] = batch_target[start]
-            mask[i, :l] = 1  # set 1 for length of video
-            mask[i, l:] = 0  # set 0 for rest of video
-            start = end
+        y_batch[:len(batch_video_idxs)] = y[integral_lens[batch_video_idxs]]
         if reset:
             start_video = 0
-            start_data = 0
             reset = False
         else:
             start_video = end_video
-            start_data = end_data
         yield X_batch, y_batch, mask
 
 
-def compute_integral_len(lengths):
-    # compute integral lengths of the video for fast offset access for data matrix
-    integral_lens = [0]
-    for i in range(1, len(lengths)):
-        integral_lens.append(integral_lens[i - 1] + lengths[i - 1])
-    return integral_lens
-
-
 def gen_seq_batch_from_idx(data, idxs, seqlens, integral_lens, max_timesteps):
-    feature_len = data.shape[-1]
-    X_batch = np.zeros((len(idxs), max_timesteps, feature_len), dtype=data.dtype)
-
-    for i, seq_id in enumerate(idxs):
-        l = seqlens[seq_id]
-        start = integral_lens[seq_id]
-        end = start + l
-        X_batch[i] = np.concatenate([data[start:end],
-                                     np.zeros((max_timesteps - l, feature_len), dtype=data.dtype)])
+    """
+    generate batch from a data matrix given the indexes of another batch
+    :param data: data matrix
+    :param idxs: indexes of sequences to generate batch from
+    :param seqlens: length of sequences
+    :param integral_lens: start offsets of sequences, see compute_integral_len
+    :param max_timesteps: maximum len of all sequences
+    :return: batch of size equal to length of indexes
+    """
+    X_batch, _ = assemble_seq_batch(data, idxs, seqlens, integral_lens, max_timesteps)
     return X_batch
 
 
-def gen_file_batch_from_idx(files, idxs, seqlens, max_timesteps, feature_len, datafieldname='dataMatrix'):
+def gen_file_batch_from_idx(files, idxs, seqlens, max_timesteps, feature_len, datafieldname='dataMatrix', pool=None):
     """
     generate batch from file list given the indexes of another batch
     :param files: file list containing file paths
@@ -238,18 +509,11 @@ def gen_file_batch_from_idx(files, idxs, seqlens, max_timesteps, feature_len, da
     :param max_timesteps: maximum len of all sequences
     :param feature_len: length of feature
     :param datafieldname: name of field containing data
+    :param pool: optional worker pool used to read the files in parallel
     :return: batch of size equal to length of indexes
     """
-    X_batch = np.zeros((len(idxs), max_timesteps, feature_len), dtype='float32')
-    for i, seq_id in enumerate(idxs):
-        file_path = files[seq_id]
-        try:
-            data = load_mat_file(file_path)[datafieldname].astype('float32')
-        except ValueError as err:
-            print('Error reading file: {}, {}'.format(file_path, err.message))
-            data = np.zeros((max_timesteps, feature_len), dtype='float32')
-        vidlen = seqlens[seq_id]
-        X_batch[i] = np.concatenate([data, np.zeros((max_timesteps - vidlen, feature_len))])
+    X_batch, errors = load_file_batch(files, idxs, seqlens, max_timesteps, feature_len, datafieldname, pool)
+    report_file_errors(errors)
     return X_batch
 
 
@@ -265,46 +529,28 @@ def sequence_batch_iterator(X, y, seqlen, batchsize=30):
     """
     # find the max len of all videos for creating the mask
     max_timesteps = np.max(seqlen)
-    feature_len = X.shape[1]
     no_videos = len(seqlen)
+    integral_lens = compute_integral_len(seqlen)
     start_video = 0
-    start_data = 0
     reset = False
     while True:
         end_video = start_video + batchsize
         if end_video > no_videos:
             # print('reached the end, restarting')
-            slice_step = int(np.sum(seqlen[start_video:]))
-            batch_vidlen = seqlen[start_video:]
+            batch_video_idxs = np.arange(start_video, no_videos)
             reset = True
         else:
-            slice_step = int(np.sum(seqlen[start_video:end_video]))
-            batch_vidlen = seqlen[start_video:end_video]
-        # print('slice step: {}'.format(slice_step))
-        # slice X, y according to the slice_step,
-        # track the index of the data
-        end_data = start_data + slice_step
-        batch_sequence = X[start_data:end_data]
-        batch_target = y[start_data:end_data]
-        X_batch = np.zeros((batchsize, max_timesteps, feature_len), dtype='float32')  # returned batch input
+            batch_video_idxs = np.arange(start_video, end_video)
+        # batches are always batchsize long, unused rows are left fully masked
+        X_batch, mask = assemble_seq_batch(X, batch_video_idxs, seqlen, integral_lens, max_timesteps,
+                                           batchsize=batchsize, dtype='float32')
         y_batch = np.zeros((batchsize,), dtype='uint8')
-        mask = np.zeros((batchsize, max_timesteps), dtype='uint8')
-        start = 0
-        for i, l in enumerate(batch_vidlen):
-            end = start + l
-            X_batch[i] = np.concatenate([batch_sequence[start:end],
-                                        np.zeros((max_timesteps-l, feature_len))])
-            y_batch[i] = batch_target[start]
-            mask[i, :l] = 1  # set 1 for length of video
-            mask[i, l:] = 0  # set 0 for rest of video
-            start = end
+        y_batch[:len(batch_video_idxs)] = y[integral_lens[batch_video_idxs]]
         if reset:
             start_video = 0
-            start_data = 0
             reset = False
         else:
             start_video = end_video
-            start_data = end_data
         yield X_batch, y_batch, mask
 
 
@@ -329,10 +575,8 @@ def batch_iterator(X, y, batchsize=128):
 
         batch_X = np.zeros((batchsize,) + X.shape[1:], dtype=X.dtype)
         batch_y = np.zeros((batchsize,) + y.shape[1:], dtype=y.dtype)
-
-        for i, idx in enumerate(batch_idxs):
-            batch_X[i] = X[idx]
-            batch_y[i] = y[idx]
+        batch_X[:len(batch_idxs)] = X[batch_idxs]
+        batch_y[:len(batch_idxs)] = y[batch_idxs]
         if reset:
             randomized = np.random.permutation(len(X))
             start = 0
@@ -370,7 +614,6 @@ class SequenceBatchIterator(object):
         """
         # find the max len of all videos for creating the mask
         max_timesteps = np.max(self.seqlens)
-        feature_len = self.X.shape[1]
         no_videos = len(self.seqlens)
         start_seq = 0
         reset = False
@@ -385,21 +628,11 @@ class SequenceBatchIterator(object):
                 reset = True
             else:
                 batch_seq_idxs = randomized[start_seq:end_seq]
-            # returned batch input
-            X_batch = np.zeros((self.batchsize, max_timesteps, feature_len), dtype=self.X.dtype)
-            y_batch = np.zeros((self.batchsize, ), dtype=self.y.dtype)
-            mask = np.zeros((self.batchsize, max_timesteps), dtype='uint8')
-
             # populate the batch X and batch y
-            for i, idx in enumerate(batch_seq_idxs):
-                start = self.integral_lens[idx]
-                l = self.seqlens[idx]
-                end = start + l
-                X_batch[i] = np.concatenate([self.X[start:end],
-                                             np.zeros((max_timesteps - l, feature_len), dtype=self.X.dtype)])
-                y_batch[i] = self.y[start]
-                mask[i, :l] = 1  # set 1 for length of video
-                mask[i, l:] = 0  # set 0 for rest of video
+            X_batch, mask = assemble_seq_batch(self.X, batch_seq_idxs, self.seqlens, self.integral_lens,
+                                               max_timesteps, batchsize=self.batchsize)
+            y_batch = np.zeros((self.batchsize, ), dtype=self.y.dtype)
+            y_batch[:len(batch_seq_idxs)] = self.y[self.integral_lens[batch_seq_idxs]]
             if reset:
                 # permutate the new video sequences for each batch
                 randomized = np.random.permutation(len(self.seqlens))
@@ -0,0 +1,271 @@
+"""
+NumPy port of the MATLAB DBN pretraining in dbn/ (trainRBM.m, trainDBN.m, unfoldDBNtoAE.m).
+Pretrained autoencoders are written as w1..wN, b1..bN .mat files, the format read by load_decoder
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import numpy as np
+from utils.io import save_mat
+
+
+def dbn_params_init(hidden_activations, hidden_layers, input_activation='sigm', **kwargs):
+    """
+    create parameters for DBN pretraining, defaults follow dbn/dbnParamsInit.m
+    :param hidden_activations: activation function of each hidden layer, 'sigm', 'linear', 'ReLu'
+    :param hidden_layers: size of each hidden layer
+    :param input_activation: activation function of the input layer, 'sigm' for binary inputs,
+        'linear' for continuous inputs
+    :param kwargs: overrides of the rbm parameters below
+    :return: dict of DBN parameters
+    """
+    params = {
+        'epochs': 10,
+        'batchsize': 100,
+        'lr_w': 0.1,  # learning rate for weights
+        'lr_vb': 0.1,  # learning rate for visible biases
+        'lr_hb': 0.1,  # learning rate for hidden biases
+        'lr_w_linear': 0.001,  # learning rates used when one layer is linear or ReLu
+        'lr_vb_linear': 0.001,
+        'lr_hb_linear': 0.001,
+        'weight_penalty_l2': 0.0002,
+        'init_momentum': 0.5,
+        'final_momentum': 0.9,
+        'momentum_epoch_thres': 5,  # epoch after which final momentum is used
+        'type': 1,  # 1 uses hidden probabilities in the statistics (Hinton's guide), 2 uses states
+        'cd_k': 1,  # number of gibbs steps in contrastive divergence
+        'hidden_activations': list(hidden_activations),
+        'hidden_layers': list(hidden_layers),
+        'input_activation': input_activation
+    }
+    for k, v in kwargs.items():
+        if k not in params:
+            raise KeyError('unknown dbn parameter {}'.format(k))
+        params[k] = v
+    return params
+
+
+def compute_activations(layer_type, data):
+    """
+    activations of a layer given its input, see dbn/computeActivations.m
+    :param layer_type: activation function, 'sigm', 'tanh', 'linear', 'ReLu', 'leakyReLu', 'softplus', 'softsign'
+    :param data: input to the neurons, (examples, neurons)
+    :return: activations, (examples, neurons)
+    """
+    layer_type = layer_type.lower()
+    if layer_type == 'sigm':
+        return 1. / (1 + np.exp(-data))
+    elif layer_type == 'tanh':
+        return np.tanh(data)
+    elif layer_type == 'linear':
+        return data
+    elif layer_type == 'relu':
+        return np.maximum(0, data)
+    elif layer_type == 'leakyrelu':
+        return np.maximum(0.01 * data, data)
+    elif layer_type == 'softplus':
+        return np.logaddexp(0, data)
+    elif layer_type == 'softsign':
+        return data / (1 + np.abs(data))
+    raise NotImplementedError('activation {} not implemented'.format(layer_type))
+
+
+def compute_states(layer_type, probs, data, rng):
+    """
+    sample states of a layer, see dbn/computeStates.m
+    :param layer_type: activation function, 'sigm', 'linear', 'ReLu'
+    :param probs: activations of the layer, (examples, neurons)
+    :param data: input to the neurons, (examples, neurons)
+    :param rng: numpy RandomState
+    :return: states, (examples, neurons)
+    """
+    layer_type = layer_type.lower()
+    if layer_type == 'sigm':
+        return (probs > rng.uniform(size=probs.shape)).astype(probs.dtype)
+    elif layer_type == 'linear':
+        return probs + rng.standard_normal(probs.shape).astype(probs.dtype)
+    elif layer_type == 'relu':
+        noise = compute_activations('sigm', data) * rng.standard_normal(probs.shape).astype(probs.dtype)
+        return np.maximum(0, data + noise)
+    raise NotImplementedError('sampling {} units not implemented'.format(layer_type))
+
+
+def rbm_up(data, weights, hidbiases, layer_type, rng):
+    """
+    activations and states of the hidden layer of an RBM, see dbn/RBMup.m
+    :return: activations, states
+    """
+    inp = np.dot(data, weights) + hidbiases
+    probs = compute_activations(layer_type, inp)
+    return probs, compute_states(layer_type, probs, inp, rng)
+
+
+def rbm_down(data, weights, visbiases, layer_type, rng):
+    """
+    activations and states of the visible layer of an RBM, see dbn/RBMdown.m
+    :return: activations, states
+    """
+    inp = np.dot(data, weights.T) + visbiases
+    probs = compute_activations(layer_type, inp)
+    return probs, compute_states(layer_type, probs, inp, rng)
+
+
+def train_rbm(data, params, num_hid, layer_types, rng=None, verbose=True, preprocess=None):
+    """
+    train an RBM with CD-k, momentum and L2 weight decay, see dbn/trainRBM.m.
+    minibatches are read from data one at a time, so data can be a memory-mapped array
+    :param data: training examples, (examples, dimensions)
+    :param params: DBN parameters, see dbn_params_init
+    :param num_hid: number of hidden units
+    :param layer_types: activation functions of the visible and hidden layers
+    :param rng: numpy RandomState
+    :param verbose: print reconstruction error per epoch
+    :param preprocess: optional function applied to each float32 minibatch, such as samplewise normalisation
+    :return: dict with weights 'W', 'hidbiases', 'visbiases' and the mean squared error per epoch 'errors'
+    """
+    rng = rng or np.random.RandomState()
+    v_type, h_type = layer_types
+    num_examples, num_dims = data.shape
+    batchsize = params['batchsize']
+    lr_w, lr_vb, lr_hb = params['lr_w'], params['lr_vb'], params['lr_hb']
+    types = [t.lower() for t in layer_types]
+    if 'linear' in types or 'relu' in types:
+        lr_w, lr_vb, lr_hb = params['lr_w_linear'], params['lr_vb_linear'], params['lr_hb_linear']
+
+    # random initial weights and zero biases as in Hinton's code, smaller weights for ReLu
+    weights = (0.01 if 'relu' in types else 0.1) * rng.standard_normal((num_dims, num_hid)).astype('float32')
+    hidbiases = np.zeros((num_hid,), dtype='float32')
+    visbiases = np.zeros((num_dims,), dtype='float32')
+    delta_w = np.zeros_like(weights)
+    delta_vb = np.zeros_like(visbiases)
+    delta_hb = np.zeros_like(hidbiases)
+    errors = []
+
+    for epoch in range(params['epochs']):
+        momentum = params['final_momentum'] if epoch >= params['momentum_epoch_thres'] else params['init_momentum']
+        order = rng.permutation(num_examples)
+        err_sum = 0.
+        for start in range(0, num_examples, batchsize):
+            # sorted indexes read memory-mapped data sequentially
+            batch = np.asarray(data[np.sort(order[start:start + batchsize])], dtype='float32')
+            if preprocess is not None:
+                batch = preprocess(batch)
+
+            # positive phase
+            pos_hid_probs, pos_hid_states = rbm_up(batch, weights, hidbiases, h_type, rng)
+            pos_hid = pos_hid_probs if params['type'] == 1 else pos_hid_states
+            pos_prods = np.dot(batch.T, pos_hid)
+            pos_hid_act = np.sum(pos_hid, 0)
+            pos_vis_act = np.sum(batch, 0)
+
+            # negative phase, k steps of gibbs sampling from the hidden states
+            hid_states = pos_hid_states
+            for k in range(params['cd_k']):
+                neg_vis_probs, neg_vis_states = rbm_down(hid_states, weights, visbiases, v_type, rng)
+                neg_vis = neg_vis_probs if params['type'] == 1 else neg_vis_states
+                neg_hid_probs, hid_states = rbm_up(neg_vis, weights, hidbiases, h_type, rng)
+            neg_prods = np.dot(neg_vis.T, neg_hid_probs)
+            neg_hid_act = np.sum(neg_hid_probs, 0)
+            neg_vis_act = np.sum(neg_vis, 0)
+            err_sum += np.sum((batch - neg_vis) ** 2)
+
+            # updates
+            n = float(len(batch))
+            delta_w = momentum * delta_w + lr_w * ((pos_prods - neg_prods) / n - params['weight_penalty_l2'] * weights)
+            delta_vb = momentum * delta_vb + lr_vb * (pos_vis_act - neg_vis_act) / n
+            delta_hb = momentum * delta_hb + lr_hb * (pos_hid_act - neg_hid_act) / n
+            weights += delta_w
+            visbiases += delta_vb
+            hidbiases += delta_hb
+
+        if np.any(np.isnan(weights)):
+            raise FloatingPointError('RBM weights diverged to nan at epoch {}'.format(epoch + 1))
+        errors.append(err_sum / num_examples)
+        if verbose:
+            print('epoch = {}, mean squared error per sample = {}'.format(epoch + 1, errors[-1]))
+    return {'W': weights, 'hidbiases': hidbiases, 'visbiases': visbiases, 'errors': errors}
+
+
+def compute_hidden(data, rbm, layer_type, chunksize=10000, out=None, preprocess=None):
+    """
+    hidden activations of an RBM for all examples, computed in chunks
+    :param data: examples, (examples, dimensions)
+    :param rbm: trained RBM, see train_rbm
+    :param layer_type: activation function of the hidden layer
+    :param chunksize: number of examples computed at a time
+    :param out: optional float32 output array of shape (examples, hidden units), such as a memory-mapped array
+    :param preprocess: optional function applied to each float32 chunk, see train_rbm
+    :return: float32 activations, (examples, hidden units)
+    """
+    if out is None:
+        out = np.zeros((len(data), rbm['W'].shape[1]), dtype='float32')
+    for start in range(0, len(data), chunksize):
+        chunk = np.asarray(data[start:start + chunksize], dtype='float32')
+        if preprocess is not None:
+            chunk = preprocess(chunk)
+        out[start:start + len(chunk)] = compute_activations(layer_type, np.dot(chunk, rbm['W']) + rbm['hidbiases'])
+    return out
+
+
+def train_dbn(data, params, rng=None, verbose=True, preprocess=None, scratch_dir=None):
+    """
+    greedy layer-wise DBN pretraining, see dbn/trainDBN.m.
+    the hidden activations feeding each next RBM are written to memory-mapped .npy files in scratch_dir,
+    so neither the input nor the activations of a layer are held in memory at once
+    :param data: training examples, (examples, dimensions), may be a memory-mapped array
+    :param params: DBN parameters, see dbn_params_init
+    :param rng: numpy RandomState
+    :param verbose: print progress
+    :param preprocess: optional function applied to each minibatch of data, not to the hidden activations,
+        see train_rbm
+    :param scratch_dir: directory of the hidden activation files, defaults to a temporary directory
+        removed after training
+    :return: list of trained RBMs, one per hidden layer
+    """
+    rng = rng or np.random.RandomState()
+    activations = [params['input_activation']] + params['hidden_activations']
+    tmp_dir = tempfile.mkdtemp(dir=scratch_dir)
+    rbms = []
+    try:
+        for i, num_hid in enumerate(params['hidden_layers']):
+            if verbose:
+                print('Pretraining Layer {} with RBM: {}-{}'.format(i + 1, data.shape[1], num_hid))
+            layer_preprocess = preprocess if i == 0 else None
+            rbm = train_rbm(data, params, num_hid, activations[i:i + 2], rng, verbose, layer_preprocess)
+            rbms.append(rbm)
+            if i + 1 == len(params['hidden_layers']):
+                break
+            # hidden activations are the inputs of the next RBM
+            hidden = np.lib.format.open_memmap(os.path.join(tmp_dir, 'hidden{}.npy'.format(i + 1)), mode='w+',
+                                               dtype='float32', shape=(len(data), num_hid))
+            data = compute_hidden(data, rbm, activations[i + 1], out=hidden, preprocess=layer_preprocess)
+            hidden.flush()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return rbms
+
+
+def unfold_dbn_to_ae(rbms):
+    """
+    unfold a DBN to an autoencoder, decoding layers mirror the encoding layers, see dbn/unfoldDBNtoAE.m
+    :param rbms: trained RBMs, see train_dbn
+    :return: list of weights, list of biases
+    """
+    weights = [rbm['W'] for rbm in rbms] + [rbm['W'].T for rbm in reversed(rbms)]
+    biases = [rbm['hidbiases'] for rbm in rbms] + [rbm['visbiases'] for rbm in reversed(rbms)]
+    return weights, biases
+
+
+def save_ae(weights, biases, path):
+    """
+    save autoencoder weights as w1..wN, b1..bN in a .mat file, as written by dbn/extractNN.m
+    :param weights: list of weights
+    :param biases: list of biases
+    :param path: .mat file to write
+    """
+    d = dict()
+    for i, (w, b) in enumerate(zip(weights, biases)):
+        d['w{}'.format(i + 1)] = w
+        d['b{}'.format(i + 1)] = b.reshape((1, -1))
+    save_mat(d, path)
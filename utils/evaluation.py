@@ -0,0 +1,114 @@
+"""
+evaluation of sequence classifiers by majority vote over the frame predictions of each sequence
+"""
+import numpy as np
+from utils.datagen import compute_integral_len, assemble_multistream_batch
+
+
+def majority_votes(output, mask, num_classes=None):
+    """
+    count the frame predictions of each sequence, padded timesteps are not counted
+    :param output: frame class scores of shape (examples, timesteps, classes)
+    :param mask: input masks for variable sequences of shape (examples, timesteps)
+    :param num_classes: number of classes, defaults to output.shape[-1]
+    :return: votes of shape (examples, classes)
+    """
+    num_examples = output.shape[0]
+    num_classes = output.shape[-1] if num_classes is None else num_classes
+    predictions = np.argmax(output, axis=-1)
+    valid = np.asarray(mask).astype(bool)
+    # flat (example, class) bin of every valid frame
+    bins = np.nonzero(valid)[0] * num_classes + predictions[valid]
+    return np.bincount(bins, minlength=num_examples * num_classes).reshape((num_examples, num_classes))
+
+
+def compute_confusion_matrix(targets, predictions, num_classes):
+    """
+    confusion matrix with targets as rows and predictions as columns
+    :param targets: target class of each example
+    :param predictions: predicted class of each example
+    :param num_classes: number of classes
+    :return: confusion matrix of shape (classes, classes)
+    """
+    targets = np.asarray(targets, dtype='int64').reshape((-1,))
+    predictions = np.asarray(predictions, dtype='int64').reshape((-1,))
+    return np.bincount(targets * num_classes + predictions,
+                       minlength=num_classes * num_classes).reshape((num_classes, num_classes))
+
+
+def evaluate_majority_vote(output, y_val, mask_val):
+    """
+    classify each sequence by the class predicted for most of its frames,
+    ties go to the lowest class index
+    :param output: frame class scores of shape (examples, timesteps, classes)
+    :param y_val: target class of each example
+    :param mask_val: input masks for variable sequences
+    :return: classification rate, confusion matrix
+    """
+    num_classes = output.shape[-1]
+    ix = np.argmax(majority_votes(output, mask_val, num_classes), axis=-1)
+    y_val = np.asarray(y_val).reshape((-1,))
+    classification_rate = np.sum(ix == y_val) / float(len(y_val))
+    return classification_rate, compute_confusion_matrix(y_val, ix, num_classes)
+
+
+def evaluate_model2(eval_inputs, y_val, mask_val, eval_fn):
+    """
+    Evaluate a lstm model
+    :param eval_inputs: list of inputs of eval_fn, such as the stream inputs, mask and window size
+    :param y_val: validation targets
+    :param mask_val: input masks for variable sequences
+    :param eval_fn: evaluation function
+    :return: classification rate, confusion matrix
+    """
+    output = eval_fn(*eval_inputs)
+    return evaluate_majority_vote(output, y_val, mask_val)
+
+
+def gen_eval_chunks(seqlens, chunksize=100):
+    """
+    split a set of sequences into chunks of similar length, so each chunk is padded little
+    :param seqlens: lengths of sequences
+    :param chunksize: number of sequences per chunk
+    :return: list of sequence idxs per chunk
+    """
+    order = np.argsort(np.asarray(seqlens), kind='mergesort')
+    return [order[i:i + chunksize] for i in range(0, len(order), chunksize)]
+
+
+def evaluate_model_chunked(streams, y, seqlens, eval_fn, cost_fn=None, extra_inputs=(), chunksize=100):
+    """
+    Evaluate a lstm model on a whole split, streaming length sorted chunks of sequences through the
+    model, so memory is bounded by the chunk size rather than the split size
+    :param streams: list of split data matrices, one per stream, with frames aligned across streams
+    :param y: frame targets of the split
+    :param seqlens: lengths of sequences of the split
+    :param eval_fn: evaluation function, called with the stream batches, the mask and extra_inputs
+    :param cost_fn: optional cost function, called with the stream batches, the targets, the mask and extra_inputs
+    :param extra_inputs: inputs passed to eval_fn and cost_fn after the mask, such as the window size
+    :param chunksize: number of sequences evaluated at a time
+    :return: classification rate, confusion matrix, mean frame cost (None without cost_fn)
+    """
+    seqlens = np.asarray(seqlens)
+    integral_lens = compute_integral_len(seqlens)
+    extra_inputs = list(extra_inputs)
+    targets = []
+    predictions = []
+    num_classes = None
+    cost_sum = 0.
+    for idxs in gen_eval_chunks(seqlens, chunksize):
+        X_batches, mask = assemble_multistream_batch(streams, idxs, seqlens, integral_lens, np.max(seqlens[idxs]))
+        y_chunk = y[integral_lens[idxs]].astype('uint8')
+        output = eval_fn(*(X_batches + [mask] + extra_inputs))
+        num_classes = output.shape[-1]
+        predictions.append(np.argmax(majority_votes(output, mask, num_classes), axis=-1))
+        targets.append(y_chunk)
+        if cost_fn is not None:
+            # the cost is a mean over the valid frames of the chunk
+            y_frames = y_chunk.reshape((-1, 1)).repeat(mask.shape[-1], axis=-1)
+            cost_sum += float(cost_fn(*(X_batches + [y_frames, mask] + extra_inputs))) * np.sum(seqlens[idxs])
+    targets = np.concatenate(targets)
+    predictions = np.concatenate(predictions)
+    classification_rate = np.sum(predictions == targets) / float(len(targets))
+    cost = cost_sum / np.sum(seqlens) if cost_fn is not None else None
+    return classification_rate, compute_confusion_matrix(targets, predictions, num_classes), cost
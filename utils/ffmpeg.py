@@ -1,212 +1,95 @@
 """
-module containing functions to use ffprobe to parse video frame info
+module containing functions to use ffprobe to parse video frame info.
+ffprobe is asked only for the frame entries needed, in its one line per frame compact format, and its
+output is parsed line by line from the pipe, so the whole frame dump is never held in memory
 """
 from __future__ import print_function
 import subprocess
-import cStringIO
+import tempfile
+from array import array
+import numpy as np
 
+# pkt_pts_time was renamed pts_time in newer ffprobe versions, both are requested
+FRAME_ENTRIES = ('media_type', 'pkt_pts_time', 'pts_time')
 
-class base_frame(object):
-    """
-    Base Frame from FFProbe
-    [FRAME]
-    media_type=video
-    stream_index=0
-    key_frame=0
-    pkt_pts=11745667
-    pkt_pts_time=130.507411
-    pkt_dts=11745667
-    pkt_dts_time=130.507411
-    best_effort_timestamp=11745667
-    best_effort_timestamp_time=130.507411
-    pkt_duration=3003
-    pkt_duration_time=0.033367
-    pkt_pos=86509020
-    pkt_size=13294
-    ...
-    [/FRAME]
-    """
-    def __init__(self, buf, parser):
-        """
-        Constructs a base ffprobe frame
-        :param buf: buffer containing frame info
-        :param parser: ffprobe frame parser
-        """
-        self.stream_index = parser.get_int(buf)
-        self.key_frame = parser.get_int(buf)
-        self.pkt_pts = parser.get_int(buf)
-        self.pkt_pts_time = parser.get_float(buf)
-        self.pkt_dts = parser.get_int(buf)
-        self.pkt_dts_time = parser.get_float(buf)
-        self.best_effort_timestamp = parser.get_int(buf)
-        self.best_effort_timestamp_time = parser.get_float(buf)
-        self.pkt_duration = parser.get_int(buf)
-        self.pkt_duration_time = parser.get_float(buf)
-        self.pkt_pos = parser.get_int(buf)
-        self.pkt_size = parser.get_int(buf)
 
-
-class audio_frame(base_frame):
+def ffprobe_frames_command(filename, entries=FRAME_ENTRIES):
     """
-    Audio Frame from FFProbe
-    [FRAME]
-    ...
-    sample_fmt=s16p
-    nb_samples=1152
-    channels=2
-    channel_layout=stereo
-    [/FRAME]
+    ffprobe command printing the requested entries of every frame, one frame per line
+    e.g. frame|media_type=video|pkt_pts_time=130.507411
+    :param filename: video file to probe
+    :param entries: frame entries to show
+    :return: command as a list of arguments
     """
-    def __init__(self, buf, parser):
-        """
-        Constructs an Audio Frame from FFprobe
-        :param buf: buffer containing ffprobe frame info
-        :param parser: ffprobe frame parser
-        """
-        super(audio_frame, self).__init__(buf, parser)
-        self.media_type = 'audio'
-        self.sample_fmt = parser.get_str(buf)
-        self.nb_samples = parser.get_int(buf)
-        self.channels = parser.get_int(buf)
-        self.channel_layout = parser.get_str(buf)
+    return ['ffprobe', '-v', 'error', '-show_entries', 'frame={}'.format(','.join(entries)),
+            '-of', 'compact', filename]
 
 
-class video_frame(base_frame):
-    """
-    Video Frame from FFProbe
-    [FRAME]
-    ...
-    width=720
-    height=480
-    pix_fmt=yuv420p
-    sample_aspect_ratio=1:1
-    pict_type=B
-    coded_picture_number=3889
-    display_picture_number=0
-    interlaced_frame=0
-    top_field_first=0
-    repeat_pict=0
-    [/FRAME]
-    """
-    def __init__(self, buf, parser):
-        """
-        Constructs a Video Frame from ffprobe
-        :param buf: buffer containing ffprobe frame info
-        :param parser: ffprobe frame parser
-        """
-        super(video_frame, self).__init__(buf, parser)
-        self.media_type = 'video'
-        self.width = parser.get_int(buf)
-        self.height = parser.get_int(buf)
-        self.pix_fmt = parser.get_str(buf)
-        self.sample_aspect_ratio = parser.get_str(buf)
-        self.pict_type = parser.get_str(buf)
-        self.coded_picture_number = parser.get_int(buf)
-        self.display_picture_number = parser.get_int(buf)
-        self.interlaced_frame = parser.get_int(buf)
-        self.top_field_first = parser.get_int(buf)
-        self.repeat_pict = parser.get_int(buf)
+def parse_compact_value(value):
+    return float('nan') if value == 'N/A' else float(value)
 
 
-class side_data(object):
+def parse_ffprobe_frame_times(lines, time_keys=('pkt_pts_time', 'pts_time')):
     """
-    Side Data from FFProbe
-    [SIDE_DATA]
-    side_data_type=GOP timecode
-    side_data_size=8
-    timecode=00:00:00:00
-    [/SIDE_DATA]
+    parse the frame timestamps from ffprobe compact output
+    :param lines: iterable of output lines, such as the stdout pipe of ffprobe
+    :param time_keys: frame entries holding the timestamp, the first one present is used
+    :return: dictionary of media type -> float64 array of frame timestamps in seconds, in frame order
     """
-    def __init__(self, buf, parser):
-        """
-        Constructs side data frame
-        :param buf: buffer containing ffprobe frame info
-        :param parser: ffprobe frame parser
-        """
-        self.side_data_type = parser.get_str(buf)
-        self.side_data_size = parser.get_int(buf)
-        self.timecode = parser.get_str(buf)
-
-
-class ffprobe_frame_info_parser(object):
+    times = dict()
+    for line in lines:
+        if not isinstance(line, str):
+            line = line.decode('utf-8')
+        fields = line.rstrip('\r\n').split('|')
+        if fields[0] != 'frame':
+            continue
+        entries = dict(field.split('=', 1) for field in fields[1:] if '=' in field)
+        if 'media_type' not in entries:
+            continue
+        time = float('nan')
+        for key in time_keys:
+            if key in entries:
+                time = parse_compact_value(entries[key])
+                break
+        times.setdefault(entries['media_type'], array('d')).append(time)
+    return dict((media_type, np.frombuffer(t, dtype='float64') if len(t) else np.zeros((0,)))
+                for media_type, t in times.items())
+
+
+def ffprobe_frame_times(filename):
     """
-    ffprobe frame parser, reads ffprobe entries and extracts key, value pairs
+    probes the frame timestamps of a video using an ffprobe subprocess
+    :param filename: video file to probe
+    :return: dictionary of media type ('video', 'audio') -> float64 array of frame timestamps in seconds
     """
-    def get_str(self, buf, sep='='):
-        _, value = buf.readline().split(sep)
-        return value[:-1]
-
-    def get_int(self, buf, sep='='):
-        _, value = buf.readline().split(sep)
-        value = value[:-1]
-        if value == 'N/A':
-            value = -1
-        else:
-            value = int(value)
-        return value
-
-    def get_float(self, buf, sep='='):
-        _, value = buf.readline().split(sep)
-        value = value[:-1]
-        if value == 'N/A':
-            value = float('nan')
-        else:
-            value = float(value)
-        return value
-
-    def get_entry(self, buf, sep='='):
-        key, value = buf.readline().split(sep)
-        value = value[:-1]
-        return key, value
-
-
-def peek_line(buf):
-    pos = buf.tell()
-    line = buf.readline()
-    buf.seek(pos)
-    return line
+    # stderr goes to a file, a pipe could fill up with the decode errors of a damaged video while
+    # stdout is read, blocking ffprobe
+    with tempfile.TemporaryFile() as stderr:
+        p = subprocess.Popen(ffprobe_frames_command(filename), stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            times = parse_ffprobe_frame_times(p.stdout)
+        finally:
+            p.stdout.close()
+            p.wait()
+        if p.returncode != 0:
+            stderr.seek(0)
+            raise IOError('ffprobe failed on {}: {}'.format(filename, stderr.read().decode('utf-8', 'replace')))
+    return times
 
 
 def ffprobe_video(filename):
     """
     probes a video using ffprobe subprocess
     :param filename: video file to probe
-    :return: list of audio, video frames
+    :return: audio frame timestamps, video frame timestamps, float64 arrays in seconds
     """
-    command = ["ffprobe", "-show_frames", filename]
-    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = p.communicate()
-    video_frames = []
-    audio_frames = []
-    p = ffprobe_frame_info_parser()
-    buf = cStringIO.StringIO(out)
-    while True:
-        line = buf.readline()
-        if line == '':
-            break
-        else:
-            info_type = line[:-1]
-            if info_type == '[FRAME]':
-                media_type = p.get_str(buf)
-                if media_type == "video":
-                    frame = video_frame(buf, p)
-                    video_frames.append(frame)
-                    # check if [SIDE_DATA] exists
-                    line = peek_line(buf)[:-1]
-                    if line == '[SIDE_DATA]':
-                        _ = buf.readline()  # read the header [SIDE_DATA]
-                        _ = side_data(buf, p)
-                        buf.readline()  # read the end tag [/SIDE_DATA]
-                else:
-                    frame = audio_frame(buf, p)
-                    audio_frames.append(frame)
-                buf.readline()  # read the end tag [/FRAME]
-    return audio_frames, video_frames
+    times = ffprobe_frame_times(filename)
+    return times.get('audio', np.zeros((0,))), times.get('video', np.zeros((0,)))
 
 
 def main():
-    audio_frames, video_frames = ffprobe_video('s01.mpg')
-    assert len(video_frames) == 3890
+    audio_times, video_times = ffprobe_video('s01.mpg')
+    assert len(video_times) == 3890
 
 
 if __name__ == '__main__':
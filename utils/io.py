@@ -1,4 +1,6 @@
+import os
 import sys
+import numpy as np
 import scipy.io as sio
 import lasagne as las
 sys.path.insert(0, '../')
@@ -24,6 +26,72 @@ def load_mat_file(path):
     return sio.loadmat(path)
 
 
+# fields of the .mat dataset layout stored by the memory-mapped format
+DATASET_FIELDS = ('dataMatrix', 'targetsVec', 'subjectsVec', 'videoLengthVec')
+DATASET_OFFSETS = 'videoOffsetVec'
+
+
+def save_memmap_dataset(data, path, chunksize=10000):
+    """
+    save a dataset in the .mat layout as a directory of memory-mappable .npy files
+    dataMatrix is stored as float32, videoOffsetVec holds the start row of every video
+    :param data: dictionary containing dataMatrix, targetsVec, subjectsVec and videoLengthVec
+    :param path: output directory
+    :param chunksize: number of rows of dataMatrix converted to float32 at a time
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    data_matrix = data['dataMatrix']
+    out = np.lib.format.open_memmap(os.path.join(path, 'dataMatrix.npy'), mode='w+',
+                                    dtype='float32', shape=data_matrix.shape)
+    for start in range(0, len(data_matrix), chunksize):
+        out[start:start + chunksize] = data_matrix[start:start + chunksize]
+    out.flush()
+    del out
+    for field in DATASET_FIELDS[1:]:
+        np.save(os.path.join(path, field + '.npy'), np.asarray(data[field]).reshape((-1,)))
+    vidlens = np.asarray(data['videoLengthVec'], dtype='int64').reshape((-1,))
+    offsets = np.zeros((len(vidlens),), dtype='int64')
+    np.cumsum(vidlens[:-1], out=offsets[1:])
+    np.save(os.path.join(path, DATASET_OFFSETS + '.npy'), offsets)
+
+
+def convert_mat_to_memmap(mat_path, path, chunksize=10000):
+    """
+    convert a .mat dataset (dataMatrix, targetsVec, subjectsVec, videoLengthVec) to the memory-mapped format
+    :param mat_path: path to .mat file
+    :param path: output directory
+    :param chunksize: number of rows of dataMatrix converted to float32 at a time
+    """
+    save_memmap_dataset(load_mat_file(mat_path), path, chunksize)
+
+
+def load_memmap_dataset(path, mmap_mode='c'):
+    """
+    load a dataset saved by save_memmap_dataset without reading dataMatrix into memory
+    slicing dataMatrix returns views of the mapped file
+    :param path: dataset directory
+    :param mmap_mode: numpy memmap mode, 'c' (copy-on-write) allows in-place preprocessing without
+        modifying the file, 'r' for read only
+    :return: dictionary with the same fields as the .mat dataset, plus videoOffsetVec
+    """
+    data = {'dataMatrix': np.load(os.path.join(path, 'dataMatrix.npy'), mmap_mode=mmap_mode)}
+    for field in DATASET_FIELDS[1:] + (DATASET_OFFSETS,):
+        data[field] = np.load(os.path.join(path, field + '.npy'))
+    return data
+
+
+def load_dataset(path):
+    """
+    load a dataset from either a .mat file or a memory-mapped dataset directory
+    :param path: path to .mat file or dataset directory
+    :return: dictionary containing dataset fields
+    """
+    if os.path.isdir(path):
+        return load_memmap_dataset(path)
+    return load_mat_file(path)
+
+
 def save_mat(dict, path):
     print('save matlab file...')
     sio.savemat(path, dict)
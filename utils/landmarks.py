@@ -0,0 +1,136 @@
+"""
+binary landmark store.
+the landmarks of all videos are stored as one float32 (frames, 68, 2) array with a per-frame valid flag,
+in place of the landmark csv rows of -1s, and an index of the videos and their frame offsets.
+the arrays are .npy files, so loading memory maps them and slicing a video returns views of the file
+"""
+import os
+import json
+import numpy as np
+
+NO_LANDMARKS = 68
+STORE_FIELDS = ('landmarks', 'valid', 'videoOffsetVec', 'videoLengthVec')
+
+
+def read_landmark_csv(path):
+    """
+    read a landmark csv written by the landmarkers, one row per frame of frame number and 136 coordinates
+    :param path: landmark csv file
+    :return: float32 landmarks of shape (frames, 68, 2), bool valid flag of shape (frames,)
+    """
+    rows = np.loadtxt(path, delimiter=',', dtype='float64', ndmin=2)
+    no_frames = int(rows[:, 0].max()) + 1 if len(rows) else 0
+    landmarks = np.zeros((no_frames, NO_LANDMARKS, 2), dtype='float32')
+    valid = np.zeros((no_frames,), dtype=bool)
+    if len(rows):
+        frame_nos = rows[:, 0].astype('int64')
+        coords = rows[:, 1:].reshape((-1, NO_LANDMARKS, 2))
+        # frames without a detected face are written as rows of -1s
+        frame_valid = ~np.all(coords == -1, axis=(1, 2))
+        landmarks[frame_nos[frame_valid]] = coords[frame_valid]
+        valid[frame_nos[frame_valid]] = True
+    return landmarks, valid
+
+
+def count_csv_frames(path):
+    """
+    :param path: landmark csv file
+    :return: number of frames, one more than the last frame number
+    """
+    last = None
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                last = line
+    return int(float(last.split(',', 1)[0])) + 1 if last is not None else 0
+
+
+def save_landmark_index(videos, vidlens, path):
+    vidlens = np.asarray(vidlens, dtype='int64').reshape((-1,))
+    offsets = np.zeros((len(vidlens),), dtype='int64')
+    np.cumsum(vidlens[:-1], out=offsets[1:])
+    np.save(os.path.join(path, 'videoOffsetVec.npy'), offsets)
+    np.save(os.path.join(path, 'videoLengthVec.npy'), vidlens)
+    with open(os.path.join(path, 'videos.json'), 'w') as f:
+        json.dump(list(videos), f, indent=1)
+    return offsets
+
+
+def convert_csv_to_store(csv_files, path, videos=None):
+    """
+    convert landmark csv files to a landmark store, one video per file.
+    the frames are counted first, so only one video is held in memory while the store file is filled
+    :param csv_files: list of landmark csv files
+    :param path: output directory
+    :param videos: name of each video in the index, defaults to the csv file names without extension
+    """
+    if videos is None:
+        videos = [os.path.splitext(os.path.basename(f))[0] for f in csv_files]
+    if len(set(videos)) != len(videos):
+        raise ValueError('video names of the landmark store must be unique')
+    if not os.path.exists(path):
+        os.makedirs(path)
+    vidlens = [count_csv_frames(f) for f in csv_files]
+    offsets = save_landmark_index(videos, vidlens, path)
+    total_frames = int(np.sum(vidlens))
+    landmarks = np.lib.format.open_memmap(os.path.join(path, 'landmarks.npy'), mode='w+', dtype='float32',
+                                          shape=(total_frames, NO_LANDMARKS, 2))
+    valid = np.lib.format.open_memmap(os.path.join(path, 'valid.npy'), mode='w+', dtype=bool,
+                                      shape=(total_frames,))
+    for csv_file, offset, vidlen in zip(csv_files, offsets, vidlens):
+        video_landmarks, video_valid = read_landmark_csv(csv_file)
+        landmarks[offset:offset + vidlen] = video_landmarks
+        valid[offset:offset + vidlen] = video_valid
+    landmarks.flush()
+    valid.flush()
+
+
+def save_landmark_store(videos, landmarks, valid, path):
+    """
+    save landmarks of several videos as a landmark store
+    :param videos: name of each video
+    :param landmarks: list of landmarks of shape (frames, 68, 2), one per video
+    :param valid: list of valid flags of shape (frames,), one per video
+    :param path: output directory
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    save_landmark_index(videos, [len(l) for l in landmarks], path)
+    np.save(os.path.join(path, 'landmarks.npy'),
+            np.concatenate(landmarks).astype('float32', copy=False).reshape((-1, NO_LANDMARKS, 2)))
+    np.save(os.path.join(path, 'valid.npy'), np.concatenate(valid).astype(bool, copy=False).reshape((-1,)))
+
+
+def load_landmark_store(path, mmap_mode='r'):
+    """
+    load a landmark store without reading the landmarks into memory
+    :param path: store directory
+    :param mmap_mode: numpy memmap mode, 'r' for read only, 'c' for copy-on-write
+    :return: dictionary of landmarks, valid, videoOffsetVec, videoLengthVec, the list of videos and
+        videoIndex mapping each video to its position
+    """
+    store = dict()
+    for field in STORE_FIELDS:
+        store[field] = np.load(os.path.join(path, field + '.npy'),
+                               mmap_mode=mmap_mode if field in ('landmarks', 'valid') else None)
+    with open(os.path.join(path, 'videos.json')) as f:
+        store['videos'] = json.load(f)
+    store['videoIndex'] = dict((video, i) for i, video in enumerate(store['videos']))
+    return store
+
+
+def get_video_landmarks(store, video, start=0, end=None):
+    """
+    landmarks of a range of frames of a video, views of the memory-mapped store
+    :param store: landmark store, see load_landmark_store
+    :param video: video name or position in the index
+    :param start: first frame
+    :param end: end frame (exclusive), defaults to the end of the video
+    :return: landmarks of shape (frames, 68, 2), valid flag of shape (frames,)
+    """
+    i = store['videoIndex'][video] if not isinstance(video, (int, np.integer)) else video
+    offset = store['videoOffsetVec'][i]
+    vidlen = store['videoLengthVec'][i]
+    end = vidlen if end is None else min(end, vidlen)
+    start = min(max(start, 0), end)
+    return store['landmarks'][offset + start:offset + end], store['valid'][offset + start:offset + end]
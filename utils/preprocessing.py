@@ -1,10 +1,14 @@
 # Preprocessing scripts for AV Letters Dataset
 
-import math
+import os
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import numpy.matlib as matlab
 import scipy.signal as signal
 import scipy.fftpack as fft
+import scipy.sparse as sparse
+import scipy.ndimage as ndimage
 from scipy.misc import imresize
 
 
@@ -108,73 +112,82 @@ def split_data(data_matrix, split_idx, len_vec=None):
         return split
 
 
+def compute_split_idxs(subjects, video_lens, train_ids, val_ids, test_ids):
+    """
+    computes the video and frame indexes of the training, validation and testing splits
+    videos of subjects in neither train_ids nor val_ids are assigned to the test split
+    :param subjects: array of video -> subject mapping
+    :param video_lens: array of video lengths for each video
+    :param train_ids: list of subject ids used for training
+    :param val_ids: list of subject ids used for validation
+    :param test_ids: list of subject ids used for testing
+    :return: list of (video indexes, frame indexes) for the train, val and test splits
+    """
+    subjects = np.asarray(subjects).reshape((-1,))
+    video_lens = np.asarray(video_lens).reshape((-1,))
+    # label each video with its split: 0 train, 1 val, 2 test
+    video_split = np.full((len(subjects),), 2, dtype='int8')
+    video_split[np.isin(subjects, val_ids)] = 1
+    video_split[np.isin(subjects, train_ids)] = 0
+    frame_split = np.repeat(video_split, video_lens)
+    return [(np.flatnonzero(video_split == i), np.flatnonzero(frame_split == i)) for i in range(3)]
+
+
+def take_frames(X, frame_idxs):
+    """
+    extracts frames from a data matrix, returns a view if the frames are contiguous, otherwise a single gather
+    :param X: data matrix
+    :param frame_idxs: sorted frame indexes to extract
+    :return: extracted frames
+    """
+    if len(frame_idxs) > 0 and frame_idxs[-1] - frame_idxs[0] + 1 == len(frame_idxs):
+        return X[frame_idxs[0]:frame_idxs[-1] + 1]
+    return X[frame_idxs]
+
+
 def split_seq_data(X, y, subjects, video_lens, train_ids, val_ids, test_ids):
     """
     Splits the data into training and testing sets
-    :param X: input X
+    :param X: input X, or a list of inputs for multiple streams sharing the same videos
     :param y: target y
     :param subjects: array of video -> subject mapping
     :param video_lens: array of video lengths for each video
     :param train_ids: list of subject ids used for training
     :param val_ids: list of subject ids used for validation
     :param test_ids: list of subject ids used for testing
-    :return: split data
+    :return: split data, X splits are lists if X is a list. X splits of contiguous subjects are views of X,
+        copy them before modifying in place if X is reused
+    """
+    subjects = np.asarray(subjects).reshape((-1,))
+    video_lens = np.asarray(video_lens).reshape((-1,))
+    splits = []
+    for video_idxs, frame_idxs in compute_split_idxs(subjects, video_lens, train_ids, val_ids, test_ids):
+        if isinstance(X, (list, tuple)):
+            split_X = [take_frames(stream, frame_idxs) for stream in X]
+        else:
+            split_X = take_frames(X, frame_idxs)
+        splits += [split_X, take_frames(y, frame_idxs).astype('int'),
+                   video_lens[video_idxs].astype('int'), subjects[video_idxs].astype('int')]
+    return tuple(splits)
+
+
+def split_multistream_data(streams, y, subjects, video_lens, train_ids, val_ids, test_ids):
     """
-    # construct a subjects data matrix offset
-    X_feature_dim = X.shape[1]
-    train_X = np.empty((0, X_feature_dim), dtype='float32')
-    val_X = np.empty((0, X_feature_dim), dtype='float32')
-    test_X = np.empty((0, X_feature_dim), dtype='float32')
-    train_y = np.empty((0,), dtype='int')
-    val_y = np.empty((0,), dtype='int')
-    test_y = np.empty((0,), dtype='int')
-    train_vidlens = np.empty((0,), dtype='int')
-    val_vidlens = np.empty((0,), dtype='int')
-    test_vidlens = np.empty((0,), dtype='int')
-    train_subjects = np.empty((0,), dtype='int')
-    val_subjects = np.empty((0,), dtype='int')
-    test_subjects = np.empty((0,), dtype='int')
-    previous_subject = 1
-    subject_video_count = 0
-    current_video_idx = 0
-    current_data_idx = 0
-    populate = False
-    for idx, subject in enumerate(subjects):
-        if previous_subject == subject:  # accumulate
-            subject_video_count += 1
-        else:  # populate the previous subject
-            populate = True
-        if idx == len(subjects) - 1:  # check if it is the last entry, if so populate
-            populate = True
-            previous_subject = subject
-        if populate:
-            # slice the data into the respective splits
-            end_video_idx = current_video_idx + subject_video_count
-            subject_data_len = int(np.sum(video_lens[current_video_idx:end_video_idx]))
-            end_data_idx = current_data_idx + subject_data_len
-            if previous_subject in train_ids:
-                train_X = np.concatenate((train_X, X[current_data_idx:end_data_idx]))
-                train_y = np.concatenate((train_y, y[current_data_idx:end_data_idx]))
-                train_vidlens = np.concatenate((train_vidlens, video_lens[current_video_idx:end_video_idx]))
-                train_subjects = np.concatenate((train_subjects, subjects[current_video_idx:end_video_idx]))
-            elif previous_subject in val_ids:
-                val_X = np.concatenate((val_X, X[current_data_idx:end_data_idx]))
-                val_y = np.concatenate((val_y, y[current_data_idx:end_data_idx]))
-                val_vidlens = np.concatenate((val_vidlens, video_lens[current_video_idx:end_video_idx]))
-                val_subjects = np.concatenate((val_subjects, subjects[current_video_idx:end_video_idx]))
-            else:
-                test_X = np.concatenate((test_X, X[current_data_idx:end_data_idx]))
-                test_y = np.concatenate((test_y, y[current_data_idx:end_data_idx]))
-                test_vidlens = np.concatenate((test_vidlens, video_lens[current_video_idx:end_video_idx]))
-                test_subjects = np.concatenate((test_subjects, subjects[current_video_idx:end_video_idx]))
-            previous_subject = subject
-            current_video_idx = end_video_idx
-            current_data_idx = end_data_idx
-            subject_video_count = 1
-            populate = False
-    return train_X, train_y, train_vidlens, train_subjects, \
-           val_X, val_y, val_vidlens, val_subjects, \
-           test_X, test_y, test_vidlens, test_subjects
+    Splits multiple streams of the same videos into training, validation and testing sets
+    the split indexes are computed once and shared by all streams, so each split holds a
+    single copy of the targets, video lengths and subjects
+    :param streams: list of stream data matrices with frames aligned across streams
+    :param y: target y
+    :param subjects: array of video -> subject mapping
+    :param video_lens: array of video lengths for each video
+    :param train_ids: list of subject ids used for training
+    :param val_ids: list of subject ids used for validation
+    :param test_ids: list of subject ids used for testing
+    :return: train, val, test splits, each a dictionary of
+        'X' (list of split streams), 'y', 'vidlens' and 'subjects'
+    """
+    splits = split_seq_data(list(streams), y, subjects, video_lens, train_ids, val_ids, test_ids)
+    return [dict(zip(('X', 'y', 'vidlens', 'subjects'), splits[i:i + 4])) for i in range(0, 12, 4)]
 
 
 def resize_img(img, orig_dim=(60, 80), dim=(30, 40), reshape=True, order='F'):
@@ -215,30 +228,81 @@ def resize_images(images, orig_dim=(60, 80), dim=(30, 40), reshape=True, order='
     return resized
 
 
-def normalize_input(input, centralize=True, quantize=False):
+# spline orders used by resize_image_stack for each interpolation
+RESIZE_INTERP_ORDERS = {'nearest': 0, 'bilinear': 1, 'bicubic': 3, 'cubic': 3}
+
+
+def resize_image_stack(images, orig_dim=(60, 80), dim=(30, 40), reshape=True, order='F', interp='bilinear',
+                       chunksize=1000, workers=None):
+    """
+    batched resize of a stack of images in chunks, chunks are resized in parallel by a thread pool.
+    unlike resize_images, values are kept as float32 and not bytescaled to 0-255
+    :param images: images as flattened (frames, height * width) or (frames, height, width) if reshape is False,
+        may be a memory-mapped array
+    :param orig_dim: original dimension of images
+    :param dim: new dimension of images
+    :param reshape: 1-D to 2-D reshaping required
+    :param order: 'C' order or 'F' order of flattened images
+    :param interp: interpolation to use, 'nearest', 'bilinear', 'bicubic' or 'cubic'
+    :param chunksize: number of frames resized at a time
+    :param workers: number of threads, defaults to the number of cores
+    :return: float32 resized images, flattened in 'c' format if reshape else in shape (frames, height, width)
+    """
+    if interp not in RESIZE_INTERP_ORDERS:
+        raise NotImplementedError("interp not implemented, use only 'nearest', 'bilinear', 'bicubic', 'cubic'")
+    n = len(images)
+    if reshape and order.upper() == 'F':
+        # a flattened 'F' image is the transpose of a 'C' image of the reversed shape
+        stack = images.reshape((n, orig_dim[1], orig_dim[0])).transpose((0, 2, 1))
+    elif reshape:
+        stack = images.reshape((n,) + tuple(orig_dim))
+    else:
+        stack = images
+    zoom = (1, float(dim[0]) / orig_dim[0], float(dim[1]) / orig_dim[1])
+    resized = np.zeros((n, dim[0], dim[1]), dtype='float32')
+
+    def resize_chunk(start):
+        chunk = np.asarray(stack[start:start + chunksize], dtype='float32')
+        resized[start:start + len(chunk)] = ndimage.zoom(chunk, zoom, order=RESIZE_INTERP_ORDERS[interp])
+
+    pool = ThreadPool(workers or multiprocessing.cpu_count())
+    try:
+        pool.map(resize_chunk, range(0, n, chunksize))
+    finally:
+        pool.close()
+        pool.join()
+    if reshape:
+        return resized.reshape((n, dim[0] * dim[1]))
+    return resized
+
+
+def normalize_input(input, centralize=True, quantize=False, chunksize=10000):
     """
-    samplewise normalize input
+    samplewise normalize input, in place for float inputs.
+    rows are normalized chunksize at a time to bound temporary memory
     :param input: input features
     :param centralize: apply 0 mean, std 1
-    :param quantize: rescale values to fall between 0 and 1
+    :param quantize: rescale values to fall between 0 and 1, takes precedence over centralize
+    :param chunksize: number of samples normalized at a time
     :return: normalized input
     """
-    def center(item):
-        item = item - item.mean()
-        item = item / np.std(item)
-        return item
-
-    def rescale(item):
-        min = np.min(item)
-        max = np.max(item)
-        item = (item - min) / (max - min)
-        return item
-
-    for i, item in enumerate(input):
-        if centralize:
-            input[i] = center(item)
+    axes = tuple(range(1, input.ndim))
+    inplace = np.issubdtype(input.dtype, np.floating)
+    for start in range(0, len(input), chunksize):
+        chunk = input[start:start + chunksize]
         if quantize:
-            input[i] = rescale(item)
+            shift = np.min(chunk, axis=axes, keepdims=True)
+            scale = np.max(chunk, axis=axes, keepdims=True) - shift
+        elif centralize:
+            shift = np.mean(chunk, axis=axes, keepdims=True)
+            scale = np.std(chunk, axis=axes, keepdims=True)
+        else:
+            break
+        if inplace:
+            chunk -= shift
+            chunk /= scale
+        else:
+            chunk[...] = (chunk - shift) / scale
     return input
 
 
@@ -257,23 +321,60 @@ def featurewise_normalize_sequence(input):
     return input, feature_means, feature_std
 
 
-def sequencewise_mean_image_subtraction(input, seqlens, axis=0):
+def segment_ids(seqlens):
+    """
+    sequence index of every frame
+    :param seqlens: sequence lengths
+    :return: array of length sum(seqlens)
+    """
+    return np.repeat(np.arange(len(seqlens)), seqlens)
+
+
+def segment_sums(input, seqlens, chunksize=10000):
     """
-    sequence-wise mean image removal
+    sum of the frames of every sequence, reduceat style over the sequence offsets.
+    frames are reduced chunksize at a time with a sparse sequence indicator product in the input
+    precision (float64 for integer inputs), chunk sums are accumulated in float64
+    :param input: input sequences in shape (frames, ...)
+    :param seqlens: sequence lengths
+    :param chunksize: number of frames reduced at a time
+    :return: sums in shape (len(seqlens), ...), empty sequences sum to 0
+    """
+    ids = segment_ids(seqlens)
+    dtype = input.dtype if np.issubdtype(input.dtype, np.floating) else np.dtype('float64')
+    sums = np.zeros((len(seqlens), int(np.prod(input.shape[1:]))), dtype='float64')
+    for start in range(0, len(ids), chunksize):
+        chunk_ids = ids[start:start + chunksize]
+        chunk = np.asarray(input[start:start + chunksize], dtype=dtype).reshape((len(chunk_ids), -1))
+        first = chunk_ids[0]
+        indicator = sparse.csr_matrix((np.ones(len(chunk_ids), dtype=dtype),
+                                       (chunk_ids - first, np.arange(len(chunk_ids)))),
+                                      shape=(chunk_ids[-1] - first + 1, len(chunk_ids)))
+        sums[first:chunk_ids[-1] + 1] += indicator.dot(chunk)
+    return sums.reshape((len(seqlens),) + input.shape[1:])
+
+
+def sequencewise_mean_image_subtraction(input, seqlens, axis=0, inplace=False, chunksize=10000):
+    """
+    sequence-wise mean image removal.
+    sequence means come from one segmented reduction, see segment_sums
     :param input: input sequences
     :param seqlens: sequence lengths
-    :param axis: axis to apply mean image removal
+    :param axis: axis to apply mean image removal, only 0 (frames) is supported
+    :param inplace: subtract the means from input directly instead of a copy
+    :param chunksize: number of frames updated at a time
     :return: mean removed input sequences
     """
-    mean_subtracted = np.zeros(input.shape, input.dtype)
-    start = 0
-    end = 0
-    for len in seqlens:
-        end += len
-        seq = input[start:end, :]
-        mean_image = np.sum(seq, axis, input.dtype) / len
-        mean_subtracted[start:end, :] = seq - mean_image
-        start += len
+    if axis != 0:
+        raise NotImplementedError('mean image removal is only supported over frames, axis 0')
+    seqlens = np.asarray(seqlens, dtype=int)
+    mean_subtracted = input if inplace else np.array(input)
+    mean_images = segment_sums(input, seqlens, chunksize)
+    mean_images /= np.maximum(seqlens, 1).reshape((-1,) + (1,) * (input.ndim - 1))
+    mean_images = mean_images.astype(input.dtype)
+    ids = segment_ids(seqlens)
+    for start in range(0, len(ids), chunksize):
+        mean_subtracted[start:start + chunksize] -= mean_images[ids[start:start + chunksize]]
     return mean_subtracted
 
 
@@ -414,6 +515,26 @@ def test_zigzag():
     assert all(res[i] < res[i + 1] for i in range(len(res) - 1))
 
 
+# zigzag traversal indexes cached by image shape
+_zigzag_idxs_cache = {}
+
+
+def zigzag_idxs(shape):
+    """
+    flat indexes of a 2D array of given shape in zigzag traversal order, see zigzag.
+    indexes are computed once per shape and cached
+    :param shape: shape of 2D array
+    :return: read-only 1D array of indexes into the flattened ('c' order) array
+    """
+    shape = tuple(shape)
+    if shape not in _zigzag_idxs_cache:
+        # fill_zigzag numbers each element by its position in the traversal
+        idxs = np.argsort(fill_zigzag(shape).ravel())
+        idxs.setflags(write=False)
+        _zigzag_idxs_cache[shape] = idxs
+    return _zigzag_idxs_cache[shape]
+
+
 def compute_dct_features(X, image_shape, no_coeff=30, method='zigzag'):
     """
     compute 2D-dct features of a given image.
@@ -427,11 +548,8 @@ def compute_dct_features(X, image_shape, no_coeff=30, method='zigzag'):
     X_dct = fft.dct(X, norm='ortho')
 
     if method == 'zigzag':
-        out = np.zeros((len(X_dct), no_coeff), dtype=X_dct.dtype)
-        for i in xrange(len(X_dct)):
-            image = X_dct[i].reshape(image_shape)
-            out[i] = zigzag(image)[1:no_coeff + 1]
-        return out
+        # gather the first coefficients in zigzag order, skipping DC, for all frames at once
+        return np.take(X_dct, zigzag_idxs(image_shape)[1:no_coeff + 1], axis=1)
     elif method == 'rel_variance':
         X_dct = X_dct[:, 1:]
         # mean coefficient per frequency
@@ -462,6 +580,114 @@ def compute_dct_features(X, image_shape, no_coeff=30, method='zigzag'):
         raise NotImplementedError("method not implemented, use only 'zigzag', 'variance', 'rel_variance")
 
 
+def dct2(images):
+    """
+    separable 2D type 2 DCT of a stack of images, orthonormal scaling
+    :param images: image stack in shape (frames, height, width)
+    :return: 2D-dct coefficients in shape (frames, height, width)
+    """
+    return fft.dct(fft.dct(images, axis=2, norm='ortho'), axis=1, norm='ortho')
+
+
+def gen_dct2_chunks(X, image_shape, chunksize=1000):
+    """
+    generates 2D-dct coefficients of an image stack, chunksize frames at a time
+    :param X: images as (frames, height, width) or flattened (frames, height * width) in 'c' format,
+        may be a memory-mapped array
+    :param image_shape: image shape (height, width)
+    :param chunksize: number of frames transformed at a time
+    :return: (start, coefficients) flattened to (frames, height * width) in 'c' format
+    """
+    for start in range(0, len(X), chunksize):
+        chunk = np.asarray(X[start:start + chunksize], dtype='float64')
+        chunk = dct2(chunk.reshape((-1,) + tuple(image_shape)))
+        yield start, chunk.reshape((len(chunk), -1))
+
+
+def select_dct_coeffs(X, image_shape, no_coeff=30, method='zigzag', chunksize=1000):
+    """
+    flat indexes of the dct coefficients to keep, DC coefficient is never selected
+    :param X: images, see gen_dct2_chunks
+    :param image_shape: image shape (height, width)
+    :param no_coeff: number of coefficients to extract
+    :param method: zigzag, variance, rel_variance or energy
+    :param chunksize: number of frames transformed at a time
+    :return: indexes of selected coefficients
+    """
+    if method == 'zigzag':
+        return zigzag_idxs(image_shape)[1:no_coeff + 1]
+    if method not in ('variance', 'rel_variance', 'energy'):
+        raise NotImplementedError("method not implemented, use only 'zigzag', 'variance', 'rel_variance', 'energy'")
+    size = np.prod(image_shape)
+    count = 0
+    mean = np.zeros((size,))
+    m2 = np.zeros((size,))
+    energy = np.zeros((size,))
+    for _, X_dct in gen_dct2_chunks(X, image_shape, chunksize):
+        if method == 'energy':
+            energy += np.sum(np.abs(X_dct), 0)
+            continue
+        # merge per chunk mean and sum of squared deviations into running totals
+        n = len(X_dct)
+        chunk_mean = np.mean(X_dct, 0)
+        chunk_m2 = np.sum((X_dct - chunk_mean) ** 2, 0)
+        diff = chunk_mean - mean
+        total = count + n
+        mean += diff * n / total
+        m2 += chunk_m2 + diff ** 2 * count * n / total
+        count = total
+    # rel_variance mean normalizes before taking the std, which gives the same ranking as variance
+    score = energy if method == 'energy' else m2
+    return np.argsort(score[1:])[::-1][:no_coeff] + 1
+
+
+def compute_dct2_features(X, image_shape, no_coeff=30, method='zigzag', chunksize=1000):
+    """
+    compute separable 2D-dct features of an image stack in chunks of frames,
+    memory use is bounded by chunksize regardless of the number of frames.
+    variance, rel_variance and energy selection need a first pass over all frames to rank coefficients
+    :param X: images as (frames, height, width) or flattened (frames, height * width) in 'c' format,
+        may be a memory-mapped array
+    :param image_shape: image shape (height, width)
+    :param no_coeff: number of coefficients to extract
+    :param method: method to extract coefficients, zigzag, variance, rel_variance, energy
+    :param chunksize: number of frames transformed at a time
+    :return: dct features in shape (frames, no_coeff)
+    """
+    idxs = select_dct_coeffs(X, image_shape, no_coeff, method, chunksize)
+    out = np.zeros((len(X), len(idxs)), dtype='float64')
+    for start, X_dct in gen_dct2_chunks(X, image_shape, chunksize):
+        out[start:start + len(X_dct)] = np.take(X_dct, idxs, axis=1)
+    return out
+
+
+def segment_deltas(X, vidlenvec, w=9):
+    """
+    Calculate the deltas of all sequences of a data matrix at once
+    Computes the same result as calling deltas() on each transposed sequence, including its edge padding:
+    the head of each sequence is padded with its 2nd frame and the tail with its last frame
+    :param X: input matrix of shape (total frames, features), sequences stored back to back
+    :param vidlenvec: lengths of each sequence
+    :param w: window size, defaults to 9
+    :return: deltas of shape (total frames, features)
+    """
+    vidlenvec = np.asarray(vidlenvec, dtype='int64').reshape((-1,))
+    hlen = w // 2
+    starts = np.repeat(np.cumsum(vidlenvec) - vidlenvec, vidlenvec)  # sequence start of each frame
+    lens = np.repeat(vidlenvec, vidlenvec)
+    t = np.arange(len(starts)) - starts  # position of each frame within its sequence
+    head = np.minimum(1, lens - 1)
+    out = np.zeros(X.shape, dtype=np.result_type(X.dtype, np.float32))
+    # weighted sum of the frames within the window, one gather per window offset
+    for m in range(-hlen, hlen + 1):
+        if m == 0:
+            continue
+        src = t + m
+        src = np.where(src < 0, head, np.minimum(src, lens - 1))
+        out += m * X[starts + src]
+    return out
+
+
 def concat_first_second_deltas(X, vidlenvec, w=9):
     """
     Compute and concatenate 1st and 2nd order derivatives of input X given a sequence list
@@ -470,23 +696,9 @@ def concat_first_second_deltas(X, vidlenvec, w=9):
     :param w: window size, defaults to 9
     :return: A matrix of shape(num rows of intput X, X + 1st order X + 2nd order X)
     """
-    # construct a new feature matrix
-    feature_len = X.shape[1]
-    Y = np.zeros((X.shape[0], feature_len * 3))  # new feature vector with 1st, 2nd delta
-    start = 0
-    for vidlen in vidlenvec:
-        end = start + vidlen
-        seq = X[start: end]  # (vidlen, feature_len)
-        first_order = deltas(seq.T, w)
-        second_order = deltas(first_order, w)
-        assert first_order.shape == (feature_len, vidlen)
-        assert second_order.shape == (feature_len, vidlen)
-        assert len(seq) == vidlen
-        seq = np.concatenate((seq, first_order.T, second_order.T), axis=1)
-        for idx, j in enumerate(range(start, end)):
-            Y[j] = seq[idx]
-        start += vidlen
-    return Y
+    first_order = segment_deltas(X, vidlenvec, w)
+    second_order = segment_deltas(first_order, vidlenvec, w)
+    return np.concatenate((X, first_order, second_order), axis=1).astype('float64')
 
 
 def reorder_data(X, shape, orig_order='f', desired_order='c'):
@@ -503,17 +715,27 @@ def reorder_data(X, shape, orig_order='f', desired_order='c'):
     return X
 
 
-def compute_diff_images(X, vidlenvec):
-
-    diff_X = np.zeros(X.shape, dtype=X.dtype)
-    start = 0
-    for l in vidlenvec:
-        end = start + l
-        seq = X[start:end]
-        diff_seq = np.diff(seq, 1, 0)
-        diff_X[start] = diff_seq[0]  # copy the 1st diff image
-        diff_X[start+1:end] = diff_seq
-        start = end
+def compute_diff_images(X, vidlenvec, inplace=False, chunksize=10000):
+    """
+    difference of consecutive images within each sequence, the first image of a sequence
+    takes the first difference of the sequence. single frame sequences get a zero image
+    :param X: images in shape (frames, features)
+    :param vidlenvec: sequence lengths
+    :param inplace: overwrite X with the differences instead of a copy
+    :param chunksize: number of frames differenced at a time
+    :return: difference images
+    """
+    vidlenvec = np.asarray(vidlenvec, dtype=int)
+    diff_X = X if inplace else np.array(X)
+    # difference over the whole matrix, walking backwards so every chunk still reads unmodified frames
+    for end in range(len(diff_X), 1, -chunksize):
+        start = max(end - chunksize, 1)
+        diff_X[start:end] -= diff_X[start - 1:end - 1]
+    # first frame of each sequence copies the first difference of its sequence
+    starts = (np.cumsum(vidlenvec) - vidlenvec)[vidlenvec > 0]
+    lens = vidlenvec[vidlenvec > 0]
+    diff_X[starts[lens > 1]] = diff_X[starts[lens > 1] + 1]
+    diff_X[starts[lens == 1]] = 0
     return diff_X
 
 
@@ -525,10 +747,90 @@ def zca_whiten(inputs):
     return np.dot(ZCAMatrix, inputs)  # Data whitening
 
 
+def fit_zca(X, epsilon=0.1, chunksize=10000):
+    """
+    fit a ZCA whitening transform, the feature covariance is accumulated chunksize samples at a time
+    :param X: training samples in shape (samples, features), may be a memory-mapped array
+    :param epsilon: whitening constant, prevents division by zero
+    :param chunksize: number of samples accumulated at a time
+    :return: dict with the feature 'mean' and the symmetric whitening matrix 'zca'
+    """
+    n, dim = X.shape
+    total = np.zeros((dim,))
+    scatter = np.zeros((dim, dim))
+    for start in range(0, n, chunksize):
+        chunk = np.asarray(X[start:start + chunksize], dtype='float64')
+        total += np.sum(chunk, 0)
+        scatter += np.dot(chunk.T, chunk)
+    mean = total / n
+    sigma = scatter / n - np.outer(mean, mean)  # Covariance matrix
+    S, U = np.linalg.eigh(sigma)
+    S = np.maximum(S, 0)  # remove negative eigenvalues from rounding
+    zca = np.dot(U / np.sqrt(S + epsilon), U.T)
+    return {'mean': mean, 'zca': zca, 'epsilon': epsilon, 'samples': n}
+
+
+def apply_zca(X, zca, chunksize=10000):
+    """
+    whiten samples with a fitted ZCA transform, one matrix multiply per chunk
+    :param X: samples in shape (samples, features)
+    :param zca: fitted transform from fit_zca
+    :param chunksize: number of samples whitened at a time
+    :return: float32 whitened samples
+    """
+    mean = zca['mean'].astype('float32')
+    W = zca['zca'].astype('float32')
+    out = np.zeros(X.shape, dtype='float32')
+    for start in range(0, len(X), chunksize):
+        np.dot(np.asarray(X[start:start + chunksize], dtype='float32') - mean, W, out=out[start:start + chunksize])
+    return out
+
+
+def chunked_mean(X, chunksize=10000):
+    """
+    mean of the samples, accumulated a chunk at a time so memory mapped data is not loaded at once
+    :param X: samples in shape (samples, features)
+    :param chunksize: number of samples accumulated at a time
+    :return: float64 mean of shape (features,)
+    """
+    total = np.zeros((X.shape[1],))
+    for start in range(0, len(X), chunksize):
+        total += np.sum(np.asarray(X[start:start + chunksize], dtype='float64'), 0)
+    return total / len(X)
+
+
+def load_or_fit_zca(X, path=None, epsilon=0.1, chunksize=10000):
+    """
+    load a fitted ZCA transform cached at path, or fit it on X and cache it.
+    the cache is refitted if it does not match the number of samples, features or epsilon of X, or if the
+    mean of X differs from the cached mean, as it does when X is preprocessed differently or read from other data
+    :param X: training samples in shape (samples, features)
+    :param path: .npz file to cache the transform, no caching if None
+    :param epsilon: whitening constant, prevents division by zero
+    :param chunksize: number of samples accumulated at a time
+    :return: fitted transform, see fit_zca
+    """
+    if path and os.path.isfile(path):
+        cached = np.load(path)
+        zca = dict((k, cached[k]) for k in cached.files)
+        cached.close()
+        if zca['samples'] == len(X) and zca['zca'].shape == (X.shape[1], X.shape[1]) and \
+                zca['epsilon'] == epsilon and np.allclose(chunked_mean(X, chunksize), zca['mean']):
+            return zca
+        print('ZCA cache {} does not match the data, refitting'.format(path))
+    zca = fit_zca(X, epsilon, chunksize)
+    if path:
+        np.savez(path, **zca)
+    return zca
+
+
 def apply_zca_whitening(X):
-    for i, img in enumerate(X):
-        X[i] = zca_whiten(img.reshape((1, -1)))
-    return X
+    """
+    ZCA whiten samples with a transform fitted on X itself
+    :param X: samples in shape (samples, features)
+    :return: float32 whitened samples
+    """
+    return apply_zca(X, fit_zca(X))
 
 
 def factorize(inputs, targets, input_len, multipleof, axis_to_delete=None):
@@ -543,19 +845,40 @@ def factorize(inputs, targets, input_len, multipleof, axis_to_delete=None):
     # if 1 dimension, reshape to 2 dim array
     if len(inputs.shape) < 2:
         inputs = inputs.reshape((-1, 1))
-    idx_to_remove = []
-    curr_idx = 0
-    for l in input_len:
-        end_idx = curr_idx + l
-        remainder = l % multipleof
-        # randomly remove items if it is not divisible by merge size
-        idx_to_remove += np.random.permutation(range(curr_idx, end_idx))[:remainder].tolist()
-        curr_idx += l
-    input_len = input_len - (input_len % multipleof)
+    input_len = np.asarray(input_len, dtype=int)
+    remainders = input_len % multipleof
+    seq_idxs = np.repeat(np.arange(len(input_len)), input_len)
+    # randomly remove items if it is not divisible by merge size:
+    # shuffle frames within each sequence and drop the first remainder frames of each
+    order = np.lexsort((np.random.random(len(seq_idxs)), seq_idxs))
+    rank = np.arange(len(order)) - np.repeat(np.cumsum(input_len) - input_len, input_len)
+    idx_to_remove = order[rank < remainders[seq_idxs]]
+    input_len = input_len - remainders
     return np.delete(inputs, idx_to_remove, axis=axis_to_delete),\
            np.delete(targets, idx_to_remove, axis=axis_to_delete), input_len
 
 
+def temporal_embed_idxs(X_len, window, step):
+    """
+    frame indexes of the temporal windows embedded by embed_temporal_info.
+    one window is centered every step frames starting at floor(step/2), windows are
+    padded by repeating the first and last frame of their sequence
+    :param X_len: lengths of each sequence
+    :param window: temporal window to embed features
+    :param step: step size to move per temporal feature
+    :return: window frame indexes in shape (sum(X_len / step), 2 * window + 1), index of the sequence of each window
+    """
+    X_len = np.asarray(X_len, dtype=int)
+    res_len = X_len // step
+    starts = np.cumsum(X_len) - X_len
+    seq_idxs = np.repeat(np.arange(len(X_len)), res_len)
+    # center of each window relative to its sequence
+    centers = (np.arange(np.sum(res_len)) - np.repeat(np.cumsum(res_len) - res_len, res_len)) * step + step // 2
+    offsets = np.arange(-window, window + 1)
+    idxs = np.clip(centers[:, None] + offsets, 0, X_len[seq_idxs][:, None] - 1)
+    return idxs + starts[seq_idxs][:, None], seq_idxs
+
+
 def embed_temporal_info(X, targets, X_len, window, step):
     """
     first downsample input to multiple of step
@@ -568,6 +891,8 @@ def embed_temporal_info(X, targets, X_len, window, step):
     win = 3, step = 3, repeats = 3 - 3 + ceil(step/2) = 3 - 3 + 2 = 2
     win = 6, step = 3, repeats = 6 - 3 + ceil(step/2) = 6 - 3 + 2 = 5
     startpos = floor(step/2) = floor(3/2) = 1
+    head and tail repeats are never materialized, window indexes are clipped to each sequence instead
+    and all windows are gathered at once
     :param X: input matrix in the shape (feature no, feature size)
     :param targets: target matrix
     :param X_len: lengths of each sequence
@@ -575,35 +900,41 @@ def embed_temporal_info(X, targets, X_len, window, step):
     :param step: step size to move per temporal feature
     :return:
     """
-    embedsize = X.shape[-1] * (window*2 + 1)
-    res = np.zeros((np.sum(X_len)/step, embedsize), dtype=X.dtype)
-    res_targets = np.zeros((np.sum(X_len)/step,), dtype=targets.dtype)
-    # select the sequence
-    curr_idx = 0
-    res_iter = 0
-    for l in X_len:
-        end_idx = curr_idx + l
-        seq = X[curr_idx:end_idx]
-        seq_target = targets[curr_idx:end_idx]
-        repeats = int(window - step + math.ceil(step/2.0))  # compute the number of elements to repeat
-        # extend the sequence in the head and tail based on the number of repeats
-        seq = np.concatenate((np.repeat(seq[:1, :], repeats, axis=0),
-                              seq,
-                              np.repeat(seq[-1:, :], repeats, axis=0)), axis=0)
-        # compute the starting position of the sequence to embed temporal info
-        startpos = repeats + (step/2)
-        # iterate through the sequence and embed temporal information, stop at the end of the original sequence len
-        while startpos - repeats < l:
-            temporal_feature = seq[startpos - window: startpos + window + 1].reshape((-1,))
-            res[res_iter] = temporal_feature
-            res_targets[res_iter] = seq_target[0]
-            startpos += step
-            res_iter += 1
-        curr_idx += l  # move to next sequence
-    res_len = X_len / step
+    idxs, seq_idxs = temporal_embed_idxs(X_len, window, step)
+    res = np.take(X, idxs, axis=0).reshape((len(idxs), -1))
+    # each window takes the target of the first frame of its sequence
+    starts = np.cumsum(X_len) - X_len
+    res_targets = np.take(targets, starts[seq_idxs])
+    res_len = np.asarray(X_len, dtype=int) // step
     return res, res_targets, res_len
 
 
+def gen_embed_temporal_info(X, targets, X_len, window, step, seqs_per_chunk=100, remove_remainder=False):
+    """
+    generator version of embed_temporal_info for datasets too large for memory,
+    embeds seqs_per_chunk sequences at a time and only reads their frames from X
+    :param X: input matrix in the shape (feature no, feature size), may be a memory-mapped array
+    :param targets: target matrix
+    :param X_len: lengths of each sequence
+    :param window: temporal window to embed features
+    :param step: step size to move per temporal feature
+    :param seqs_per_chunk: number of sequences embedded per chunk
+    :param remove_remainder: randomly remove frames so sequence lengths are a multiple of step, see factorize
+    :return: embedded features, targets and lengths of each chunk of sequences
+    """
+    X_len = np.asarray(X_len, dtype=int)
+    starts = np.cumsum(X_len) - X_len
+    for i in range(0, len(X_len), seqs_per_chunk):
+        chunk_len = X_len[i:i + seqs_per_chunk]
+        start = starts[i]
+        end = start + np.sum(chunk_len)
+        chunk = np.asarray(X[start:end])
+        chunk_targets = np.asarray(targets[start:end])
+        if remove_remainder:
+            chunk, chunk_targets, chunk_len = factorize(chunk, chunk_targets, chunk_len, step, 0)
+        yield embed_temporal_info(chunk, chunk_targets, chunk_len, window, step)
+
+
 def force_align(x1, x2, mode='fill'):
     """
     Force Align 2 streams of data to equal lengths
@@ -612,53 +943,26 @@ def force_align(x1, x2, mode='fill'):
     :param mode: 'fill', 'discard'
     :return: x1, x2 streams forced aligned
     """
-    x1, x1_targets, x1_lens = x1
-    x2, x2_targets, x2_lens = x2
-    x1_new = []
-    x1_targets_new = []
-    x2_new = []
-    x2_targets_new = []
-    x1_curr_idx = 0
-    x2_curr_idx = 0
-    for i, l1 in enumerate(x1_lens):
-        l2 = x2_lens[i]
-        difference = l1 - l2
-        if mode == 'fill':
-            if difference < 0:
-                '''fill x1 with difference'''
-                difference = abs(difference)
-                for j in range(l1):
-                    x1_new.append(x1[x1_curr_idx + j])
-                    x1_targets_new.append(x1_targets[x1_curr_idx + j])
-                '''[0][1][2][3]'''
-                last_element = x1[x1_curr_idx + l1 - 1]
-                last_element_target = x1_targets[x1_curr_idx + l1 - 1]
-                for j in range(difference):
-                    x1_new.append(np.copy(last_element))
-                    x1_targets_new.append(np.copy(last_element_target))
-                x1_lens[i] = l1 + difference  # update the lens
-                for j in range(l2):
-                    x2_new.append(x2[x2_curr_idx + j])
-                    x2_targets_new.append(x2_targets[x2_curr_idx + j])
-            else:
-                '''fill x2 with difference'''
-                for j in range(l2):
-                    x2_new.append(x2[x2_curr_idx + j])
-                    x2_targets_new.append(x2_targets[x2_curr_idx + j])
-                '''[0][1][2][3]'''
-                last_element = x2[x2_curr_idx + l1 - 1]
-                last_element_target = x2_targets[x2_curr_idx + l2 - 1]
-                for j in range(difference):
-                    x2_new.append(np.copy(last_element))
-                    x2_targets_new.append(np.copy(last_element_target))
-                x2_lens[i] = l2 + difference  # update the lens
-                for j in range(l1):
-                    x1_new.append(x1[x1_curr_idx + j])
-                    x1_targets_new.append(x1_targets[x1_curr_idx + j])
-            x1_curr_idx += l1
-            x2_curr_idx += l2
-        # TODO: discard mode
-    return (np.array(x1_new), np.array(x1_targets_new), x1_lens), (np.array(x2_new), np.array(x2_targets_new), x2_lens)
+    x1, x2 = multistream_force_align([x1, x2], mode)
+    return x1, x2
+
+
+def aligned_frame_idxs(lens, target_lens):
+    """
+    frame indexes that align a stream of sequences to target lengths, sequences shorter than
+    their target repeat their last frame and longer sequences are truncated
+    :param lens: sequence lengths of the stream
+    :param target_lens: sequence lengths to align to
+    :return: indexes into the stream frames, of length sum(target_lens)
+    """
+    lens = np.asarray(lens, dtype=int)
+    target_lens = np.asarray(target_lens, dtype=int)
+    starts = np.cumsum(lens) - lens
+    target_starts = np.cumsum(target_lens) - target_lens
+    # sequence and position within the sequence of each aligned frame
+    seq_idxs = np.repeat(np.arange(len(lens)), target_lens)
+    positions = np.arange(np.sum(target_lens)) - np.repeat(target_starts, target_lens)
+    return starts[seq_idxs] + np.minimum(positions, lens[seq_idxs] - 1)
 
 
 def extract_stream_elements(streams):
@@ -672,41 +976,23 @@ def extract_stream_elements(streams):
 
 def multistream_force_align(orig_streams, mode='fill'):
     """
-    force align multiple streams to be of the same length
+    force align multiple streams to be of the same length.
+    each stream is gathered once with repeat last frame indexes, input_lens are updated in place
     :param orig_streams: original streams in a list of tuple (input, target, input_lens)
-    :param mode: 'fill', 'discard' missing or excess data
+    :param mode: 'fill' copies the last frame of shorter sequences up to the longest stream,
+        'discard' truncates longer sequences to the shortest stream
     :return: list of new streams of tuple (new_input, new_target, new_lens)
     """
-    INPUT_IDX = 0
-    TARGET_IDX = 1
-    LEN_IDX = 2
-    new_streams = [([], [], s[2]) for s in orig_streams]
-    curr_idxs = [0]*len(orig_streams)
-    inputs, targets, input_lens = extract_stream_elements(orig_streams)
-    # for each sequence
-    for i, l1 in enumerate(input_lens[0]):
-        # compute the lens, find stream with longest length
-        lens = [input_len_vec[i] for input_len_vec in input_lens]
-        max_idx = np.argmax(lens)
-        # compute the number of copies to generate
-        copies_to_make = [input_lens[max_idx][i] - l[i] for l in input_lens]
-        # for each stream, append the original stream and copies to make to new stream
-        for j in range(len(orig_streams)):
-            input_vec = inputs[j]
-            target_vec = targets[j]
-            l = lens[j]  # length of sequence for current stream
-            for k in range(l):
-                new_streams[j][INPUT_IDX].append(input_vec[curr_idxs[j] + k])
-                new_streams[j][TARGET_IDX].append(target_vec[curr_idxs[j] + k])
-            copies = copies_to_make[j]
-            # make copies to fill shorter streams
-            for k in range(copies):
-                last_element = input_vec[curr_idxs[j] + l - 1]
-                last_element_target = target_vec[curr_idxs[j] + l - 1]
-                new_streams[j][INPUT_IDX].append(np.copy(last_element))
-                new_streams[j][TARGET_IDX].append(np.copy(last_element_target))
-            new_streams[j][LEN_IDX][i] = l + copies
-            curr_idxs[j] += l
-    # convert the lists to numpy arrays
-    new_streams = [(np.array(x[INPUT_IDX]), np.array(x[TARGET_IDX]), x[LEN_IDX]) for x in new_streams]
+    _, _, input_lens = extract_stream_elements(orig_streams)
+    if mode == 'fill':
+        target_lens = np.max(input_lens, axis=0)
+    elif mode == 'discard':
+        target_lens = np.min(input_lens, axis=0)
+    else:
+        raise NotImplementedError("mode not implemented, use only 'fill', 'discard'")
+    new_streams = []
+    for input_vec, target_vec, lens in orig_streams:
+        idxs = aligned_frame_idxs(lens, target_lens)
+        lens[:] = target_lens
+        new_streams.append((np.take(input_vec, idxs, axis=0), np.take(target_vec, idxs, axis=0), lens))
     return new_streams
@@ -0,0 +1,125 @@
+"""
+helpers shared by the training runners: command line options, stream config sections,
+pretrained decoders and the per-stream data preprocessing
+"""
+import sys
+import argparse
+import scipy.io as sio
+import theano
+import lasagne as las
+from utils.preprocessing import reorder_data, sequencewise_mean_image_subtraction, compute_diff_images, \
+    normalize_input, featurewise_normalize_sequence, load_or_fit_zca, apply_zca
+from custom.nonlinearities import select_nonlinearity
+
+
+def configure_theano():
+    theano.config.floatX = 'float32'
+    sys.setrecursionlimit(10000)
+
+
+def parse_options(default_config):
+    """
+    command line options of the runners
+    :param default_config: config file used without --config
+    :return: dict of options
+    """
+    options = dict()
+    options['config'] = default_config
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', help='[CONFIG_FILE] config file with sections stream1..streamN, '
+                                         'default={}'.format(default_config))
+    parser.add_argument('--write_results', help='[FILE] write results to file')
+    parser.add_argument('--learning_rate', help='[LEARNING_RATE] learning rate')
+    parser.add_argument('--save_best', help='[FILE] save the best model')
+    parser.add_argument('--save_plot', help='[FILE_PREFIX] plot the train/validation '
+                                            'loss curve using user supplied prefix')
+    args = parser.parse_args()
+    if args.config:
+        options['config'] = args.config
+    if args.write_results:
+        options['write_results'] = args.write_results
+    if args.learning_rate:
+        options['learning_rate'] = float(args.learning_rate)
+    if args.save_best:
+        options['save_best'] = args.save_best
+    if args.save_plot:
+        options['save_plot'] = args.save_plot
+    return options
+
+
+def load_decoder(path, shapes, nonlinearities):
+    nn = sio.loadmat(path)
+    weights = []
+    biases = []
+    shapes = [int(s) for s in shapes.split(',')]
+    nonlinearities = [select_nonlinearity(nonlinearity) for nonlinearity in nonlinearities.split(',')]
+    for i in range(len(shapes)):
+        weights.append(nn['w{}'.format(i+1)].astype('float32'))
+        biases.append(nn['b{}'.format(i+1)][0].astype('float32'))
+    return weights, biases, shapes, nonlinearities
+
+
+def select_weight_init(weight_init):
+    """
+    :param weight_init: 'glorot', 'norm', 'uniform' or 'ortho', anything else is glorot
+    :return: lasagne initializer
+    """
+    if weight_init == 'norm':
+        return las.init.Normal(0.1)
+    if weight_init == 'uniform':
+        return las.init.Uniform()
+    if weight_init == 'ortho':
+        return las.init.Orthogonal()
+    return las.init.GlorotUniform()
+
+
+def stream_sections(config, no_streams=None):
+    """
+    find the stream sections of a config file
+    :param config: ConfigParser
+    :param no_streams: number of streams to use, defaults to all stream sections
+    :return: section names stream1..streamN, in order
+    """
+    stream_nos = sorted(int(s[len('stream'):]) for s in config.sections()
+                        if s.startswith('stream') and s[len('stream'):].isdigit())
+    if stream_nos != list(range(1, len(stream_nos) + 1)):
+        raise ValueError('stream sections must be numbered stream1..streamN, found {}'.format(stream_nos))
+    if no_streams is not None:
+        if no_streams > len(stream_nos):
+            raise ValueError('{} streams required, the config has {}'.format(no_streams, len(stream_nos)))
+        stream_nos = stream_nos[:no_streams]
+    return ['stream{}'.format(n) for n in stream_nos]
+
+
+def presplit_dataprocessing(data_matrix, vidlens, config, stream_name, **kwargs):
+    reorderdata = config.getboolean(stream_name, 'reorderdata')
+    diffimage = config.getboolean(stream_name, 'diffimage')
+    meanremove = config.getboolean(stream_name, 'meanremove')
+    samplewisenormalize = config.getboolean(stream_name, 'samplewisenormalize')
+    if reorderdata:
+        imagesize = kwargs['imagesize']
+        data_matrix = reorder_data(data_matrix, imagesize)
+    if meanremove:
+        data_matrix = sequencewise_mean_image_subtraction(data_matrix, vidlens, inplace=True)
+    if diffimage:
+        data_matrix = compute_diff_images(data_matrix, vidlens, inplace=True)
+    if samplewisenormalize:
+        data_matrix = normalize_input(data_matrix)
+    return data_matrix
+
+
+def postsplit_datapreprocessing(train_X, val_X, test_X, config, stream_name):
+    featurewisenormalize = config.getboolean(stream_name, 'featurewisenormalize')
+    zcawhiten = config.getboolean(stream_name, 'zcawhiten') if config.has_option(stream_name, 'zcawhiten') else False
+    if zcawhiten:
+        # fit on the training split only, cached fits are reused across runs
+        zca_cache = config.get(stream_name, 'zca_cache') if config.has_option(stream_name, 'zca_cache') else None
+        zca = load_or_fit_zca(train_X, zca_cache)
+        train_X = apply_zca(train_X, zca)
+        val_X = apply_zca(val_X, zca)
+        test_X = apply_zca(test_X, zca)
+    if featurewisenormalize:
+        train_X, mean, std = featurewise_normalize_sequence(train_X)
+        val_X = (val_X - mean) / std
+        test_X = (test_X - mean) / std
+    return train_X, val_X, test_X
@@ -80,6 +80,39 @@ def append_delta_coeff(A, theta):
     return res
 
 
+def temporal_delta_conv(X, theta):
+    """
+    compute delta coefficients of a batch of sequences as a 1-D temporal convolution.
+    equivalent to delta_coeff applied to every sequence of the batch
+    :param X: input sequences in shape (batch, time_step, number_of_features)
+    :param theta: window size
+    :return: delta coefficients in shape (batch, time_step, number_of_features)
+    """
+    # repeat the first and last frames theta times along the time axis
+    Y = T.concatenate([T.extra_ops.repeat(X[:, :1], theta, axis=1), X,
+                       T.extra_ops.repeat(X[:, -1:], theta, axis=1)], axis=1)
+    # frame at offset t in [-theta, theta] is weighted by sign(t) / 2|t|,
+    # the kernel is stored reversed since conv2d flips it
+    offsets = T.arange(theta, -theta - 1, -1, dtype='int32')
+    kernel = (T.sgn(offsets) / (2. * T.maximum(abs(offsets), 1))).astype(X.dtype)
+    # convolve along time, the kernel is shared over all batches and features
+    delta = T.nnet.conv2d(Y.dimshuffle(0, 'x', 1, 2), kernel.reshape((1, 1, -1, 1)), border_mode='valid')
+    return delta[:, 0]
+
+
+def append_delta_coeff_conv(X, theta):
+    """
+    append delta + acceleration coefficients to a batch of sequences using temporal convolutions.
+    equivalent to append_delta_coeff applied to every sequence of the batch
+    :param X: input sequences in shape (batch, time_step, number_of_features)
+    :param theta: window size
+    :return: sequences with delta + acceleration coefficients in shape (batch, time_step, 3 * number_of_features)
+    """
+    delta = temporal_delta_conv(X, theta)
+    acc = temporal_delta_conv(delta, theta)
+    return T.concatenate([X, delta, acc], axis=2)
+
+
 def main():
     """
     test runner, computes delta for an array of sequences